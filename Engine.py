@@ -0,0 +1,416 @@
+from math import dist, log, pi
+from time import perf_counter
+from typing import Callable, Iterable, List, Sequence, Tuple
+import numpy as np
+
+from Estimation import Estimate, estimate
+from FreeSpace import FreeSpace
+from Laser import Laser
+from LikelihoodField import LikelihoodField
+from MapFile import MapData
+from Odometry import Linear, Angular
+from Parallel import ParallelSensor
+from Profiling import NULL_PROFILER, Profiler
+from Pyramid import MapPyramid
+from Particles import ParticleSet
+from Resampling import RESAMPLERS, KLDSampler
+from Robot import Robot
+from ScanCache import ScanCache
+from Scheduler import UpdateScheduler
+from Streaming import ParticleStream
+from Weighting import effective_sample_size, log_similarities, normalize_log
+
+# beam angles of the default laser
+DEFAULT_ANGLES = (0, pi/12, pi/6, pi/4, -pi/12, -pi/6, -pi/4)
+
+# where scattered particles are put: anywhere on the map, anywhere the robot can reach, or reachable poses drawn
+# toward the current scan
+SCATTER_MODES = ("uniform", "free", "informed")
+
+
+def redistribute(sim_robots: ParticleSet, log_weights: np.ndarray, dims: Tuple[int, int], scatter_factor: float = .1, abandon_factor: float = 100, distance_spread: float = 25, angle_spread: float = pi/24,
+                 resampler: str = "systematic", kld: KLDSampler = None, free: FreeSpace = None,
+                 propose: Callable[[int], Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> None:
+    """resamples the particles in proportion to their similarities, then jitters every copy
+
+    Args:
+        sim_robots (ParticleSet): simulated robots, updated in place
+        log_weights (np.ndarray): log similarity of each particle
+        dims (Tuple[int, int]): width and height of the map
+        scatter_factor (float, optional): fraction of particles moved to a random location instead. Defaults to .1.
+        abandon_factor (float, optional): if no similarity reaches this, every particle is scattered. Defaults to 100.
+        distance_spread (float, optional): width of the position jitter. Defaults to 25.
+        angle_spread (float, optional): width of the heading jitter. Defaults to pi/24.
+        resampler (str, optional): scheme from Resampling.RESAMPLERS. Defaults to "systematic".
+        kld (KLDSampler, optional): chooses the number of particles instead of keeping it fixed. Defaults to None.
+        free (FreeSpace, optional): scatter into this free space instead of the whole map. Defaults to None.
+        propose (Callable, optional): returns n scattered poses, e.g. FreeSpace.propose against the current scan.
+            replaces free for the scattered particles and for an abandoned set. Defaults to None.
+    """
+    log_weights = np.asarray(log_weights, dtype=float)
+    if log_weights.max() < log(abandon_factor):
+        N = kld.max_n if kld is not None else len(sim_robots)
+        if propose is not None:
+            sim_robots.set_poses(*propose(N))
+        else:
+            sim_robots.scatter(dims, N, free)
+        return
+
+    weights = normalize_log(log_weights)
+    if kld is not None:
+        parents = kld.resample(weights, sim_robots.x, sim_robots.y, sim_robots.angle)
+    else:
+        parents = RESAMPLERS[resampler](weights, len(sim_robots))
+    N = len(parents)
+
+    x = sim_robots.x[parents] + np.random.uniform(-distance_spread/2, distance_spread/2, N)
+    y = sim_robots.y[parents] + np.random.uniform(-distance_spread/2, distance_spread/2, N)
+    angle = sim_robots.angle[parents] + np.random.uniform(-angle_spread/2, angle_spread/2, N)
+
+    # scattered particles keep their parent's heading, only their position is randomized, unless they are proposed
+    scattered = np.random.random(N) < scatter_factor
+    count = np.count_nonzero(scattered)
+    if propose is not None:
+        x[scattered], y[scattered], angle[scattered] = propose(count)
+    else:
+        if free is not None:
+            x[scattered], y[scattered] = free.sample(count)
+        else:
+            x[scattered] = np.random.randint(0, dims[0], count)
+            y[scattered] = np.random.randint(0, dims[1], count)
+        angle[scattered] = sim_robots.angle[parents[scattered]]
+
+    sim_robots.set_poses(x, y, angle)
+
+
+class LocalizationEngine:
+    """the particle filter without any display. moves the true robot and the particles from control inputs,
+    and runs the sense / weight / resample cycle on request. the pygame simulation is only a viewer on top of this
+    """
+    def __init__(self, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], start_pose: Tuple[float, float, float], dims: Tuple[int, int],
+                 N: int = 100, true_odometry: Tuple[Linear, Angular] = None, sim_odometry: Tuple[Linear, Angular] = None,
+                 true_laser: Laser = None, sim_laser: Laser = None, sensor_model: str = "beam", field: LikelihoodField = None,
+                 resampler: str = "systematic", kld: KLDSampler = None, dt: float = .5, true_robot: Robot = None,
+                 workers: int = 0, laser_method: str = "segments", profiler: Profiler = None, scatter: str = "free",
+                 free_space: FreeSpace = None, scan_cache: ScanCache = None, pyramid: MapPyramid = None,
+                 chunk: int = None) -> None:
+        """
+        Args:
+            walls (List[Tuple[Tuple[int, int], Tuple[int, int]]]): wall segments. may be None if both lasers are given
+            start_pose (Tuple[float, float, float]): x, y and heading of the true robot
+            dims (Tuple[int, int]): width and height of the map
+            N (int, optional): number of particles. Defaults to 100.
+            true_odometry (Tuple[Linear, Angular], optional): odometry error of the true robot. Defaults to None.
+            sim_odometry (Tuple[Linear, Angular], optional): odometry error of the particles. Defaults to None.
+            true_laser (Laser, optional): laser of the true robot. Defaults to sim_laser, or an uncached copy
+                of it when sim_laser has a ScanCache.
+            sim_laser (Laser, optional): laser of the particles. Defaults to a laser on walls using laser_method.
+            sensor_model (str, optional): "beam" or "likelihood", see Simulation.simulation. Defaults to "beam".
+            field (LikelihoodField, optional): prebuilt field for the likelihood model. Defaults to one built from walls.
+            resampler (str, optional): scheme from Resampling.RESAMPLERS. Defaults to "systematic".
+            kld (KLDSampler, optional): adapts the number of particles. Defaults to None.
+            dt (float, optional): time step of one control input. Defaults to .5.
+            true_robot (Robot, optional): existing true robot, replaces start_pose and true_odometry. Defaults to None.
+            workers (int, optional): processes for the measurement step, see Parallel.ParallelSensor. 0 weighs in this
+                process. Defaults to 0.
+            laser_method (str, optional): sensing method of the default laser, see Laser.METHODS. Defaults to "segments".
+            profiler (Profiler, optional): records time and work per stage of every update. Defaults to None, recording nothing.
+            scatter (str, optional): where scattered particles go, one of SCATTER_MODES. "free" falls back to the
+                whole map without free_space or walls, "informed" needs one of them. Defaults to "free".
+            free_space (FreeSpace, optional): prebuilt free space. Defaults to one flood filled from walls around the
+                true robot's start.
+            scan_cache (ScanCache, optional): cache for the default laser, so particles in the same small cell share
+                one cast. Defaults to None, casting every particle.
+            pyramid (MapPyramid, optional): map pyramid for global_localize. Defaults to one built from the
+                likelihood field or the walls on first use.
+            chunk (int, optional): stream the particle steps through chunks of this many particles, see
+                Streaming.ParticleStream, so working memory stays bounded for very large N. needs systematic
+                resampling, a fixed N and no workers. Defaults to None, handling the whole set at once.
+        """
+        if scatter not in SCATTER_MODES:
+            raise ValueError(f"scatter must be one of {SCATTER_MODES}, not {scatter!r}")
+        if chunk is not None and (kld is not None or workers or resampler != "systematic"):
+            raise ValueError("streaming needs systematic resampling, a fixed number of particles and no workers")
+        self.walls = walls
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.recorder = None # set by Recording.Recorder
+        self.dims = dims
+        self.dt = dt
+
+        if true_robot is None:
+            if true_odometry is None:
+                true_odometry = (Linear(0, .005), Angular(0, .005))
+            x, y, angle = start_pose
+            true_robot = Robot(*true_odometry, (x, y), angle, bounds=dims)
+        self.true_robot = true_robot
+
+        if sim_odometry is None:
+            sim_odometry = (Linear(0, .01), Angular(0, .005))
+        if sim_laser is None:
+            sim_laser = Laser(500, angles=DEFAULT_ANGLES, walls=walls, method=laser_method, cache=scan_cache)
+        self.sim_laser = sim_laser
+        if true_laser is None:
+            # the true robot's scan is what the filter is judged against, so it never shares the particles' cache
+            true_laser = sim_laser if sim_laser.cache is None else sim_laser.uncached()
+        self.true_laser = true_laser
+
+        if sensor_model == "likelihood" and field is None:
+            field = LikelihoodField.from_walls(walls, dims)
+        self.field = field if sensor_model == "likelihood" else None
+
+        self.resampler = resampler
+        self.kld = kld
+        # redistribute parameters, tunable per engine
+        self.scatter_factor = .1
+        self.abandon_factor = 100
+        self.distance_spread = 25
+        self.angle_spread = pi/24
+        self.proposal_candidates = 4 # poses scored per informed proposal
+
+        if scatter != "uniform" and free_space is None and walls is not None:
+            free_space = FreeSpace.from_walls(walls, dims, true_robot.position)
+        if scatter == "informed" and free_space is None:
+            raise ValueError("informed scattering needs walls or a prebuilt free_space")
+        self.scatter = scatter
+        self.free_space = free_space if scatter != "uniform" else None
+        self.last_reading = None # latest true reading, which informed proposals are drawn toward
+
+        self.particles = ParticleSet(*sim_odometry, N=N, bounds=dims)
+        self.particles.scatter(dims, free=self.free_space)
+
+        self.pyramid = pyramid
+        self.stream = ParticleStream(self.particles, len(self.true_laser.angles), chunk) if chunk else None
+        self.parallel = ParallelSensor(self.sim_laser, workers, field=self.field) if workers else None
+
+    @classmethod
+    def from_map(cls, map_data: MapData, start_pose: Tuple[float, float, float], **kwargs) -> "LocalizationEngine":
+        """builds an engine on a map loaded by MapFile.load_map, reusing its stored grids instead of recomputing them
+
+        Args:
+            map_data (MapData): the map
+            start_pose (Tuple[float, float, float]): x, y and heading of the true robot
+            **kwargs: any other argument of the constructor
+        """
+        if kwargs.get("sensor_model") == "likelihood" and "field" not in kwargs and map_data.distance is not None:
+            kwargs["field"] = LikelihoodField(map_data.distance)
+        if kwargs.get("scatter", "free") != "uniform" and "free_space" not in kwargs and map_data.free_cells is not None:
+            kwargs["free_space"] = FreeSpace.from_map(map_data)
+        if "pyramid" not in kwargs and map_data.distance is not None:
+            kwargs["pyramid"] = MapPyramid.from_map(map_data, kwargs.get("free_space"))
+        if kwargs.get("laser_method") == "raster" and "sim_laser" not in kwargs and map_data.occupancy is not None:
+            kwargs["sim_laser"] = Laser(500, angles=DEFAULT_ANGLES, occupancy=map_data.occupancy, method="raster")
+        return cls(map_data.wall_list(), start_pose, map_data.dims, **kwargs)
+
+    def move(self, forward: bool, ccw: bool, cw: bool) -> None:
+        """applies one frame of control input to the true robot and every particle, like Maps.check_movements reports it"""
+        with self.profiler.stage("motion"):
+            if forward:
+                self.true_robot.drive(self.dt)
+            if cw != ccw:
+                self.true_robot.turn(self.dt, cw)
+        if self.recorder is not None and (forward or cw != ccw):
+            self.recorder.move(forward, ccw, cw)
+        self.move_particles(forward, ccw, cw)
+
+    def move_particles(self, forward: bool, ccw: bool, cw: bool) -> None:
+        """move without the true robot, for replaying a log where the true robot's path was recorded"""
+        with self.profiler.stage("motion"):
+            if self.stream is not None:
+                if forward or cw != ccw:
+                    self.stream.predict(forward, ccw, cw, self.dt)
+                return
+            if forward:
+                self.particles.drive(self.dt)
+            if cw != ccw:
+                self.particles.turn(self.dt, cw)
+
+    def weigh(self, true_reading: Sequence[float] = None) -> np.ndarray:
+        """senses from the true robot and scores every particle against that reading
+
+        Args:
+            true_reading (Sequence[float], optional): use this reading instead of sensing, e.g. one replayed from a log.
+                Defaults to None.
+
+        Returns:
+            np.ndarray: log similarity of each particle
+        """
+        profiler = self.profiler
+        if true_reading is None:
+            with profiler.stage("sensing"):
+                true_reading = self.true_laser.sense_obstacles(self.true_robot)
+            if self.recorder is not None:
+                self.recorder.reading(true_reading)
+        self.last_reading = true_reading
+        if profiler.enabled:
+            profiler.count("rays", len(true_reading))
+            profiler.count("tests", self.true_laser.tests(true_reading))
+            profiler.set("particles", len(self.particles))
+
+        if self.stream is not None:
+            count = None
+            if profiler.enabled:
+                profiler.count("rays", len(self.particles) * len(true_reading))
+                count = lambda readings: profiler.count("tests", self.sim_laser.tests(readings))
+            # sensing and weighting alternate chunk by chunk, so all of it is timed as weighting
+            with profiler.stage("weighting"):
+                return self.stream.weigh(true_reading, self.sim_laser, self.field, self.true_laser.angles, count)
+
+        # the likelihood field and the process pool score without separate sensing, so all their time is weighting
+        if self.parallel is not None:
+            with profiler.stage("weighting"):
+                return self.parallel.log_similarities(true_reading, self.particles)
+        if self.field is not None:
+            with profiler.stage("weighting"):
+                return self.field.log_similarities(true_reading, self.true_laser.angles, self.particles)
+
+        cache = self.sim_laser.cache
+        if profiler.enabled and cache is not None:
+            hits, misses = cache.hits, cache.misses
+        with profiler.stage("sensing"):
+            sim_readings = self.sim_laser.sense_particles(self.particles)
+        if profiler.enabled:
+            tests = self.sim_laser.tests(sim_readings)
+            if cache is not None:
+                # only the cells missing from the cache were cast
+                profiler.count("cache_hits", cache.hits - hits)
+                profiler.count("cache_misses", cache.misses - misses)
+                tests *= (cache.misses - misses) / max(len(sim_readings), 1)
+            profiler.count("rays", sim_readings.size)
+            profiler.count("tests", tests)
+        with profiler.stage("weighting"):
+            return log_similarities(true_reading, sim_readings, self.sim_laser.sigma)
+
+    def score_poses(self, true_reading: Sequence[float], x: np.ndarray, y: np.ndarray, angle: np.ndarray) -> np.ndarray:
+        """log similarity of arbitrary poses against a reading, with the same sensor model as weigh"""
+        if self.field is not None:
+            return self.field.log_similarities_poses(true_reading, self.true_laser.angles, x, y, angle)
+        return log_similarities(true_reading, self.sim_laser.sense_poses(x, y, angle), self.sim_laser.sigma)
+
+    def propose(self, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """n reachable poses drawn toward the latest true reading, see FreeSpace.propose"""
+        reading = self.last_reading
+        return self.free_space.propose(n, lambda x, y, angle: self.score_poses(reading, x, y, angle),
+                                       self.proposal_candidates)
+
+    def resample(self, log_weights: np.ndarray) -> None:
+        """redistributes the particles according to the log similarities from weigh. this ends an update for the profiler"""
+        if self.profiler.enabled:
+            self.profiler.set("ess", effective_sample_size(log_weights))
+        with self.profiler.stage("resampling"):
+            if self.stream is not None:
+                self.stream.resample(log_weights, self.dims, self.scatter_factor, self.abandon_factor, self.distance_spread,
+                                     self.angle_spread, self.free_space, self.propose if self.scatter == "informed" else None)
+                self.profiler.end_update()
+                return
+            redistribute(self.particles, log_weights, self.dims, self.scatter_factor, self.abandon_factor,
+                         self.distance_spread, self.angle_spread, resampler=self.resampler, kld=self.kld,
+                         free=self.free_space, propose=self.propose if self.scatter == "informed" else None)
+        self.profiler.end_update()
+
+    def update(self, true_reading: Sequence[float] = None) -> np.ndarray:
+        """one full sense / weight / resample cycle. returns the log similarities the particles were resampled with"""
+        log_weights = self.weigh(true_reading)
+        self.resample(log_weights)
+        return log_weights
+
+    def global_localize(self, N: int = None, beam: int = 2000, true_reading: Sequence[float] = None) -> Estimate:
+        """finds the robot anywhere on the map from one scan, see Pyramid.MapPyramid.search, and replaces the
+        particles with a compact set around the best poses. the normal filter takes over from there
+
+        Args:
+            N (int, optional): number of particles afterwards. Defaults to the current size.
+            beam (int, optional): poses kept at each level of the search. Defaults to 2000.
+            true_reading (Sequence[float], optional): search with this reading instead of sensing, e.g. one replayed
+                from a log. Defaults to None.
+
+        Returns:
+            Estimate: summary of the new particles
+        """
+        if self.pyramid is None:
+            if self.field is not None:
+                self.pyramid = MapPyramid(self.field.distance, None if self.free_space is None else self.free_space.mask())
+            elif self.walls is not None:
+                self.pyramid = MapPyramid.from_walls(self.walls, self.dims, self.free_space)
+            else:
+                raise ValueError("global localization needs walls, a likelihood field or a prebuilt pyramid")
+
+        reading = true_reading
+        if reading is None:
+            with self.profiler.stage("sensing"):
+                reading = self.true_laser.sense_obstacles(self.true_robot)
+            if self.recorder is not None:
+                self.recorder.global_reading(reading)
+        self.last_reading = reading
+        with self.profiler.stage("weighting"):
+            # the survivors are rescored with the filter's own model, so the hand off matches what the next update expects
+            self.pyramid.localize(reading, self.true_laser.angles, self.particles, N, beam,
+                                  lambda x, y, angle: self.score_poses(reading, x, y, angle))
+        return self.estimate()
+
+    def estimate(self, log_weights: np.ndarray = None, **kwargs) -> Estimate:
+        """summary of the particles, see Estimation.estimate
+
+        Args:
+            log_weights (np.ndarray, optional): log weights from weigh, before resampling. Defaults to uniform weights,
+                which is what the particles carry after resampling.
+            **kwargs: options of Estimation.estimate
+
+        Returns:
+            Estimate: mean pose, covariance, effective sample size, quantile thresholds and clusters
+        """
+        particles = self.particles
+        return estimate(particles.x, particles.y, particles.angle, log_weights, **kwargs)
+
+    def pose_error(self) -> Tuple[float, float]:
+        """distance between the true robot and the mean particle position, and the heading error of the circular mean heading"""
+        x, y = self.true_robot.position
+        position_error = dist((x, y), (self.particles.x.mean(), self.particles.y.mean()))
+
+        heading = np.arctan2(np.sin(self.particles.angle).mean(), np.cos(self.particles.angle).mean())
+        heading_error = abs((heading - self.true_robot.angle + pi) % (2*pi) - pi)
+        return position_error, heading_error
+
+    def odometry(self, forward: bool, ccw: bool, cw: bool) -> Tuple[float, float]:
+        """distance and angle one frame of control input commands, what the robot's odometry would report"""
+        particles = self.particles
+        return (particles.v * self.dt if forward else 0.), (particles.o * self.dt if ccw != cw else 0.)
+
+    def run(self, controls: Iterable[Tuple[bool, bool, bool]], update_every: int = 10,
+            scheduler: UpdateScheduler = None) -> List[Tuple[float, float]]:
+        """drives the filter through a stream of control inputs as fast as possible
+
+        Args:
+            controls (Iterable[Tuple[bool, bool, bool]]): (forward, ccw, cw) for every frame
+            update_every (int, optional): frames between filter updates. Defaults to 10.
+            scheduler (UpdateScheduler, optional): decides when to update from the motion instead of update_every.
+                Defaults to None.
+
+        Returns:
+            List[Tuple[float, float]]: pose_error after every update
+        """
+        errors = []
+        for frame, control in enumerate(controls, 1):
+            self.move(*control)
+            if scheduler is not None:
+                if not scheduler.step(*self.odometry(*control)):
+                    continue
+                began = perf_counter()
+                self.update()
+                scheduler.ran(perf_counter() - began)
+                errors.append(self.pose_error())
+            elif frame % update_every == 0:
+                self.update()
+                errors.append(self.pose_error())
+        return errors
+
+    def map_changed(self) -> None:
+        """call after editing the walls the lasers sense in place, see Laser.map_changed"""
+        self.sim_laser.map_changed()
+        if self.true_laser is not self.sim_laser:
+            self.true_laser.map_changed()
+
+    def close(self) -> None:
+        """stops the measurement workers, if any"""
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
@@ -0,0 +1,129 @@
+from math import pi
+from typing import Dict, List, Sequence
+import numpy as np
+
+from Weighting import effective_sample_size, normalize_log
+
+
+class Cluster:
+    """one mode of the particle distribution"""
+    def __init__(self, x: float, y: float, angle: float, weight: float, count: int) -> None:
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.weight = weight # share of the total weight, between 0 and 1
+        self.count = count # particles in the cluster
+
+    def __repr__(self) -> str:
+        return f"Cluster(x={self.x:.1f}, y={self.y:.1f}, angle={self.angle:.3f}, weight={self.weight:.3f}, count={self.count})"
+
+
+class Estimate:
+    """summary of a weighted particle set
+
+    Attributes:
+        x, y, angle: weighted mean pose. the heading is the circular mean
+        covariance: 3x3 weighted covariance of x, y and heading, with heading residuals wrapped to [-pi, pi)
+        ess: effective sample size of the weights
+        thresholds: log weight at each requested quantile
+        top: indices of the top_k heaviest particles, heaviest first
+        clusters: modes found in the weighted grid histogram, heaviest first
+    """
+    def __init__(self, x: float, y: float, angle: float, covariance: np.ndarray, ess: float, thresholds: Dict[float, float],
+                 top: np.ndarray, clusters: List[Cluster]) -> None:
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.covariance = covariance
+        self.ess = ess
+        self.thresholds = thresholds
+        self.top = top
+        self.clusters = clusters
+
+    @property
+    def position_sd(self) -> float:
+        """square root of the trace of the position covariance, in pixels"""
+        return float(np.sqrt(self.covariance[0, 0] + self.covariance[1, 1]))
+
+
+def estimate(x: np.ndarray, y: np.ndarray, angle: np.ndarray, log_weights: np.ndarray = None, quantiles: Sequence[float] = (.9, .95),
+             top_k: int = 0, cell: float = 40, max_clusters: int = 5, min_cluster_weight: float = .05) -> Estimate:
+    """summarizes weighted particles in a few vectorized passes
+
+    clusters are grown from the heaviest cells of a weighted histogram over a grid of cell sized squares. each cluster
+    takes its peak cell and the unclaimed cells around it, so modes further apart than a cell come out separately
+
+    Args:
+        x (np.ndarray): x coordinates of the particles
+        y (np.ndarray): y coordinates of the particles
+        angle (np.ndarray): headings of the particles
+        log_weights (np.ndarray, optional): log weights, e.g. from LocalizationEngine.weigh. Defaults to uniform weights.
+        quantiles (Sequence[float], optional): quantiles of the log weights to report. Defaults to (.9, .95).
+        top_k (int, optional): number of heaviest particles to report. Defaults to 0.
+        cell (float, optional): side of a histogram cell in pixels. Defaults to 40.
+        max_clusters (int, optional): most clusters reported. Defaults to 5.
+        min_cluster_weight (float, optional): clusters lighter than this share of the weight are dropped. Defaults to .05.
+
+    Returns:
+        Estimate: the summary
+    """
+    x, y, angle = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(angle, dtype=float)
+    N = len(x)
+    if log_weights is None:
+        log_weights = np.zeros(N)
+    log_weights = np.asarray(log_weights, dtype=float)
+    w = normalize_log(log_weights)
+
+    cos, sin = np.cos(angle), np.sin(angle)
+    mean_x, mean_y = w @ x, w @ y
+    mean_angle = np.arctan2(w @ sin, w @ cos) % (2*pi)
+    residuals = np.vstack((x - mean_x, y - mean_y, (angle - mean_angle + pi) % (2*pi) - pi))
+    covariance = (residuals * w) @ residuals.T
+
+    thresholds = dict(zip(quantiles, np.quantile(log_weights, quantiles).tolist())) if len(quantiles) else {}
+    top = np.zeros(0, dtype=np.intp)
+    if top_k:
+        k = min(top_k, N)
+        top = np.argpartition(log_weights, N - k)[N - k:]
+        top = top[np.argsort(log_weights[top])[::-1]]
+
+    return Estimate(float(mean_x), float(mean_y), float(mean_angle), covariance, effective_sample_size(log_weights),
+                    thresholds, top, _clusters(x, y, cos, sin, w, cell, max_clusters, min_cluster_weight))
+
+
+def _clusters(x: np.ndarray, y: np.ndarray, cos: np.ndarray, sin: np.ndarray, w: np.ndarray,
+              cell: float, max_clusters: int, min_weight: float) -> List[Cluster]:
+    col = np.floor(x / cell).astype(np.intp)
+    row = np.floor(y / cell).astype(np.intp)
+    col -= col.min(initial=0)
+    row -= row.min(initial=0)
+    cols, rows = col.max(initial=0) + 1, row.max(initial=0) + 1
+    cells = row * cols + col
+    histogram = np.bincount(cells, weights=w, minlength=rows * cols).reshape(rows, cols)
+
+    # claim the heaviest remaining cell and its unclaimed neighbours until the clusters get too light
+    label = np.full((rows, cols), -1, dtype=np.intp)
+    remaining = histogram.copy()
+    for index in range(max_clusters):
+        peak = np.argmax(remaining)
+        r, c = divmod(peak, cols)
+        block = (slice(max(r - 1, 0), r + 2), slice(max(c - 1, 0), c + 2))
+        if remaining[block].sum() < min_weight:
+            break
+        free = label[block] == -1
+        label[block][free] = index
+        remaining[block] = 0
+
+    particle_label = label.ravel()[cells]
+    count = int(label.max(initial=-1)) + 1
+    if not count:
+        return []
+    kept = particle_label >= 0
+    labels = particle_label[kept]
+    sums = [np.bincount(labels, weights=values[kept], minlength=count) for values in (w, w * x, w * y, w * cos, w * sin)]
+    counts = np.bincount(labels, minlength=count)
+    weight, sx, sy, sc, ss = sums
+
+    clusters = [Cluster(sx[i] / weight[i], sy[i] / weight[i], np.arctan2(ss[i], sc[i]) % (2*pi), weight[i], int(counts[i]))
+                for i in range(count) if weight[i] > 0]
+    return sorted(clusters, key=lambda cluster: cluster.weight, reverse=True)
@@ -0,0 +1,93 @@
+from math import pi
+from typing import Callable, List, Tuple
+import numpy as np
+import pygame
+
+from Grids import free_cells, occupancy_from_surface, occupancy_from_walls
+from MapFile import MapData
+from Resampling import systematic
+from Weighting import normalize_log
+
+
+class FreeSpace:
+    """index of the map cells a robot can actually stand on, built once per map.
+
+    particles scattered uniformly over the whole map land inside walls and in rooms the robot cannot reach, and every
+    one of them is wasted until it is resampled away. drawing positions from this index instead puts each scattered
+    particle somewhere the robot could be
+    """
+    def __init__(self, cells: np.ndarray, dims: Tuple[int, int]) -> None:
+        """
+        Args:
+            cells (np.ndarray): flat [y, x] indices of the free cells, as from Grids.free_cells
+            dims (Tuple[int, int]): width and height of the map
+        """
+        self.cells = np.asarray(cells, dtype=np.intp)
+        self.dims = (int(dims[0]), int(dims[1]))
+        if not len(self.cells):
+            raise ValueError("the map has no free cells")
+
+    @classmethod
+    def from_occupancy(cls, occupancy: np.ndarray, start: Tuple[float, float] = None) -> "FreeSpace":
+        """free cells of a boolean grid indexed [y, x], only those reachable from start if it is given"""
+        H, W = occupancy.shape
+        return cls(free_cells(occupancy, start), (W, H))
+
+    @classmethod
+    def from_walls(cls, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int],
+                   start: Tuple[float, float] = None, width: float = 3) -> "FreeSpace":
+        """free cells around wall segments, drawn with the same thickness as on screen"""
+        return cls.from_occupancy(occupancy_from_walls(walls, dims, width), start)
+
+    @classmethod
+    def from_surface(cls, surface: pygame.Surface, wall_color: Tuple[int, int, int] = (0, 0, 0),
+                     start: Tuple[float, float] = None) -> "FreeSpace":
+        """free cells of a map surface, for maps only known as pixels"""
+        return cls.from_occupancy(occupancy_from_surface(surface, wall_color), start)
+
+    @classmethod
+    def from_map(cls, map_data: MapData, start: Tuple[float, float] = None) -> "FreeSpace":
+        """reuses the index stored by MapFile.save_map, unless start is given and the index must be flood filled again"""
+        if start is None and map_data.free_cells is not None:
+            return cls(map_data.free_cells, map_data.dims)
+        if map_data.occupancy is not None:
+            return cls.from_occupancy(map_data.occupancy, start)
+        return cls.from_walls(map_data.wall_list(), map_data.dims, start, map_data.wall_width)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def mask(self) -> np.ndarray:
+        """the free space as a boolean grid indexed [y, x]"""
+        mask = np.zeros(self.dims[0] * self.dims[1], dtype=bool)
+        mask[self.cells] = True
+        return mask.reshape(self.dims[1], self.dims[0])
+
+    def sample(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """n positions drawn uniformly from the free space, anywhere inside their cell
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: x and y coordinates
+        """
+        cells = self.cells[np.random.randint(0, len(self.cells), n)]
+        row, col = np.divmod(cells, self.dims[0])
+        return col + np.random.random(n), row + np.random.random(n)
+
+    def propose(self, n: int, score: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+                candidates: int = 4) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """n poses drawn toward the current scan. candidates times as many poses are drawn from the free space with
+        random headings, scored, and resampled in proportion to their scores
+
+        Args:
+            n (int): number of poses
+            score (Callable): log similarity of x, y and heading arrays against the current scan
+            candidates (int, optional): poses scored for each one returned. Defaults to 4.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: x, y and heading
+        """
+        count = n * candidates
+        x, y = self.sample(count)
+        angle = np.random.uniform(0, 2*pi, count)
+        chosen = systematic(normalize_log(score(x, y, angle)), n)
+        return x[chosen], y[chosen], angle[chosen]
@@ -0,0 +1,155 @@
+from typing import List, Tuple
+import numpy as np
+import pygame
+
+from Raycast import walls_to_array
+
+# stands in for "no wall in this row" in the distance transform, big enough to never win a minimum
+FAR = 1e12
+
+
+def occupancy_from_walls(walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], width: float = 3) -> np.ndarray:
+    """rasterizes wall segments into an occupancy grid. a cell is occupied when its center lies within
+    width / 2 of a wall, which matches what pygame.draw.line paints in Maps.draw_walls
+
+    Args:
+        walls (List[Tuple[Tuple[int, int], Tuple[int, int]]]): wall segments
+        dims (Tuple[int, int]): width and height of the map
+        width (float, optional): wall thickness in pixels. Defaults to 3.
+
+    Returns:
+        np.ndarray: boolean grid indexed [y, x]
+    """
+    W, H = int(dims[0]), int(dims[1])
+    grid = np.zeros((H, W), dtype=bool)
+    reach = max(width / 2, .5)
+
+    for x1, y1, x2, y2 in walls_to_array(walls):
+        # only the bounding box of each wall can be touched by it
+        left, right = max(int(min(x1, x2) - reach), 0), min(int(max(x1, x2) + reach) + 1, W)
+        top, bottom = max(int(min(y1, y2) - reach), 0), min(int(max(y1, y2) + reach) + 1, H)
+        if left >= right or top >= bottom:
+            continue
+
+        px, py = np.meshgrid(np.arange(left, right) + .5, np.arange(top, bottom) + .5)
+        ex, ey = x2 - x1, y2 - y1
+        length2 = ex * ex + ey * ey
+        u = np.clip(((px - x1) * ex + (py - y1) * ey) / length2, 0, 1) if length2 else np.zeros_like(px)
+        d2 = (px - x1 - u * ex) ** 2 + (py - y1 - u * ey) ** 2
+        grid[top:bottom, left:right] |= d2 <= reach * reach
+
+    return grid
+
+
+def occupancy_from_surface(Map: pygame.Surface, WALL_COLOR: Tuple[int, int, int] = (0, 0, 0)) -> np.ndarray:
+    """reads the wall colored pixels of a map surface into an occupancy grid, the same pixels Laser samples
+
+    Args:
+        Map (pygame.Surface): map with walls drawn on it
+        WALL_COLOR (Tuple[int, int, int], optional): color of the walls. Defaults to (0, 0, 0).
+
+    Returns:
+        np.ndarray: boolean grid indexed [y, x]
+    """
+    pixels = pygame.surfarray.array3d(Map) # indexed [x, y, channel]
+    return np.all(pixels == np.asarray(WALL_COLOR[:3]), axis=2).T
+
+
+def _squared_distance_1d(f: np.ndarray) -> np.ndarray:
+    """exact 1D squared distance transform (Felzenszwalb & Huttenlocher) of every row of f at once.
+    the lower envelope of parabolas is built one column at a time, with a separate stack per row
+    """
+    R, n = f.shape
+    rows = np.arange(R)
+    v = np.zeros((R, n), dtype=np.intp) # parabola vertices in the envelope
+    z = np.empty((R, n + 1)) # boundaries between the parabolas
+    z[:, 0], z[:, 1] = -np.inf, np.inf
+    k = np.zeros(R, dtype=np.intp)
+
+    for q in range(1, n):
+        fq = f[:, q] + q * q
+        while True:
+            vk = v[rows, k]
+            s = (fq - (f[rows, vk] + vk * vk)) / (2 * q - 2 * vk)
+            pop = s <= z[rows, k]
+            if not pop.any():
+                break
+            k -= pop
+        k += 1
+        v[rows, k] = q
+        z[rows, k] = s
+        z[rows, k + 1] = np.inf
+
+    d = np.empty_like(f)
+    k[:] = 0
+    for q in range(n):
+        while True:
+            step = z[rows, k + 1] < q
+            if not step.any():
+                break
+            k += step
+        vk = v[rows, k]
+        d[:, q] = (q - vk) ** 2 + f[rows, vk]
+    return d
+
+
+def distance_transform(occupancy: np.ndarray) -> np.ndarray:
+    """exact euclidean distance from every cell to the closest occupied cell
+
+    Args:
+        occupancy (np.ndarray): boolean grid indexed [y, x]
+
+    Returns:
+        np.ndarray: float32 distances in cells, same shape as occupancy
+    """
+    f = np.where(occupancy, 0., FAR)
+    # columns first, then rows, using the separability of the squared euclidean distance
+    d2 = _squared_distance_1d(_squared_distance_1d(f.T).T)
+    return np.sqrt(np.minimum(d2, FAR)).astype(np.float32)
+
+
+def flood_fill(occupancy: np.ndarray, start: Tuple[float, float]) -> np.ndarray:
+    """every free cell reachable from start through free cells, moving up, down, left or right
+
+    Args:
+        occupancy (np.ndarray): boolean grid indexed [y, x]
+        start (Tuple[float, float]): x and y of a point in free space
+
+    Returns:
+        np.ndarray: boolean grid of the reachable cells, indexed [y, x]. empty if start is in a wall or off the grid
+    """
+    H, W = occupancy.shape
+    free = ~occupancy.ravel()
+    reached = np.zeros(H * W, dtype=bool)
+    col, row = int(start[0]), int(start[1])
+    if not (0 <= col < W and 0 <= row < H) or not free[row * W + col]:
+        return reached.reshape(H, W)
+
+    # breadth first, one ring of cells per pass, so each cell is handled about once
+    frontier = np.array([row * W + col])
+    reached[frontier] = True
+    while len(frontier):
+        col = frontier % W
+        neighbours = np.concatenate((frontier[col > 0] - 1, frontier[col < W - 1] + 1,
+                                     frontier[frontier >= W] - W, frontier[frontier < (H - 1) * W] + W))
+        frontier = np.unique(neighbours[free[neighbours] & ~reached[neighbours]])
+        reached[frontier] = True
+    return reached.reshape(H, W)
+
+
+def free_cells(occupancy: np.ndarray, start: Tuple[float, float] = None) -> np.ndarray:
+    """flat [y, x] indices of the unoccupied cells, for drawing particle positions from free space
+
+    Args:
+        occupancy (np.ndarray): boolean grid indexed [y, x]
+        start (Tuple[float, float], optional): only keep cells reachable from this point, see flood_fill. when start
+            is in a wall every free cell is kept. Defaults to None.
+
+    Returns:
+        np.ndarray: int32 indices into occupancy.ravel()
+    """
+    if start is not None:
+        reached = flood_fill(occupancy, start)
+        if reached.any():
+            return np.flatnonzero(reached).astype(np.int32)
+    return np.flatnonzero(~occupancy).astype(np.int32)
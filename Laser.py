@@ -1,39 +1,123 @@
+import copy
+import itertools
 from math import cos, dist, pi, sin
 from typing import List, Tuple
 import numpy as np
 import pygame
 
+from Particles import ParticleSet
+from RangeTable import RangeTable
+from ScanCache import ScanCache
+from Grids import occupancy_from_surface
+from Raycast import cast_segments, march_raster, walls_to_array
 from Robot import Robot
+from SpatialIndex import SegmentGrid
 
 def uncertainty_add(distance, sigma):
     return np.random.normal(distance, sigma)
 
+# map versions handed out to lasers, never reused, so a version names one laser's map as it was at one time
+_map_versions = itertools.count()
+
 class Laser:
-    def __init__(self, range: float, Map: pygame.Surface, uncertainty: float = .5, WALL_COLOR: Tuple[int, int, int] = (0, 0, 0), angles: List[float] = (0, pi/6, -pi/6)) -> None:
+    """simulated range sensor. walls are found either by sampling pixels of the map surface ("pixel"),
+    by marching through exactly the wall pixels each beam crosses, read once from the surface ("raster"),
+    by intersecting the beams with the wall segments from Maps.draw_walls ("segments"),
+    by intersecting them with only the walls in the SegmentGrid cells they cross ("grid"),
+    or by looking the ranges up in a precomputed RangeTable of the walls ("table").
+    with a ScanCache, poses in the same small cell share one noise free scan. the true robot's scan in sense_obstacles
+    is always cast from its exact pose, and only reused while the robot stands still
+    """
+    METHODS = ("pixel", "raster", "segments", "grid", "table")
+
+    def __init__(self, range: float, Map: pygame.Surface = None, uncertainty: float = .5, WALL_COLOR: Tuple[int, int, int] = (0, 0, 0), angles: List[float] = (0, pi/6, -pi/6),
+                 walls: List[Tuple[Tuple[int, int], Tuple[int, int]]] = None, method: str = "pixel",
+                 table: RangeTable = None, interpolate: bool = False, index: SegmentGrid = None, occupancy: np.ndarray = None,
+                 cache: ScanCache = None) -> None:
+        if method not in self.METHODS:
+            raise ValueError(f"unknown sensing method {method!r}, expected one of {self.METHODS}")
+        if method == "pixel" and Map is None:
+            raise ValueError("pixel sensing needs a Map surface")
+        if method == "raster" and Map is None and occupancy is None:
+            raise ValueError("raster sensing needs a Map surface or an occupancy grid")
+        if method in ("segments", "grid", "table") and walls is None and table is None and index is None:
+            raise ValueError(f"{method} sensing needs a list of walls")
+
         self.range = range
         self.sigma = uncertainty
-        
+
         self.Map = Map
-        self.W, self.H = self.Map.get_size()
-        
+        if Map is not None:
+            self.W, self.H = self.Map.get_size()
+
         self.WALL_COLOR = WALL_COLOR
         self.angles = angles
-    
+
+        self.walls = None if walls is None else walls_to_array(walls)
+        self.method = method
+
+        self.table = table
+        self.interpolate = interpolate
+        self.index = index
+        self.occupancy = occupancy
+        if method == "raster" and occupancy is None:
+            self.occupancy = occupancy_from_surface(Map, WALL_COLOR)
+        if method in ("grid", "table"):
+            # the table and the grid cover the map surface, or just the walls when there is no surface
+            dims = self.Map.get_size() if Map is not None else (np.ceil(self.walls[:, [0, 2]].max()) + 1, np.ceil(self.walls[:, [1, 3]].max()) + 1)
+            if method == "table" and table is None:
+                self.table = RangeTable.load_or_build(walls, dims, range)
+            if method == "grid" and index is None:
+                self.index = SegmentGrid(walls, dims)
+        self.cache = cache
+        self.map_changed()
+
+    def map_changed(self) -> None:
+        """call after editing the walls, occupancy grid, table or surface this laser senses. the laser moves to a new
+        map version, so neither its ScanCache nor its last true scan return anything cast on the old map again
+        """
+        self.map_version = next(_map_versions)
+        self.last_pose = None # pose and noise free ranges of the latest sense_obstacles
+        self.last_scan = None
+
+    def uncached(self) -> "Laser":
+        """a copy of this laser sharing its map, table and index, but without the cache"""
+        laser = copy.copy(self)
+        laser.cache = None
+        laser.last_pose = laser.last_scan = None
+        return laser
+
+    @property
+    def config(self) -> tuple:
+        """everything about this laser which changes its noise free ranges, part of its ScanCache keys"""
+        return (self.method, self.range, tuple(float(a) for a in self.angles), self.interpolate, self.map_version)
+
     def sense_obstacles(self, robot: Robot) -> List[float]:
-        """sense walls in the "angles" directions
+        """sense walls in the "angles" directions, relative to the robot's heading. the scan is cast from the exact
+        pose, never through the cache, and the noise free ranges are reused while the robot does not move
 
         Args:
             robot (Robot): robot from which obstacles are sensed
-            angles (List[float], optional): angles to sense at. Defaults to (0, pi/6, -pi/6).
         """
+        x, y = robot.position
+        pose = (float(x), float(y), float(robot.angle))
+        if pose != self.last_pose:
+            self.last_pose = pose
+            self.last_scan = self._cast(np.array([pose[0]]), np.array([pose[1]]), np.array([pose[2]]))[0]
+        ranges = self.last_scan.copy()
+        hit = ranges != -1
+        ranges[hit] = uncertainty_add(ranges[hit], self.sigma)
+        return ranges.tolist()
+
+    def _cast_pixel(self, x1: float, y1: float, heading: float) -> List[float]:
         data = [-1] * len(self.angles)
-        x1, y1 = robot.position
+        position = (x1, y1)
 
         sample_density = 1000
         # for each angle
         for index, angle in enumerate(self.angles):
             # calculate the end of the laser beam using the laser range
-            dx, dy = self.range * cos(angle), self.range * sin(angle)
+            dx, dy = self.range * cos(heading + angle), self.range * sin(heading + angle)
 
 
             # for many iterations along this laser
@@ -48,16 +132,92 @@ class Laser:
 
                     if color == self.WALL_COLOR:
                         # pygame.draw.circle(self.Map, (0, 255, 0), (x, y), 5)
-                        distance = dist(robot.position, (x, y))
-                        output = uncertainty_add(distance, self.sigma)
-                        data[index] = output
+                        data[index] = dist(position, (x, y))
                         break
-                
+
                 # if no walls were hit, distance remains -1
 
         return data
-            
-            
-            
-    
-    
+
+    def sense_poses(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """sense walls from many poses at once
+
+        Args:
+            x (np.ndarray): x coordinates
+            y (np.ndarray): y coordinates
+            angle (np.ndarray): headings
+            out (np.ndarray, optional): (poses, beams) array to write the readings into, e.g. a reused float32 buffer.
+                the segment method casts straight into it, the others copy their result in. Defaults to None.
+
+        Returns:
+            np.ndarray: (poses, beams) readings, -1 where nothing was hit. out, if it was given
+        """
+        if self.cache is not None:
+            ranges = self.cache.lookup(self.config, x, y, angle, self._cast)
+            if out is not None:
+                np.copyto(out, ranges, casting="same_kind")
+                ranges = out
+        else:
+            ranges = self._cast(x, y, angle, out)
+        hit = ranges != -1
+        ranges[hit] = uncertainty_add(ranges[hit], self.sigma)
+        return ranges
+
+    def _cast(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """noise free (poses, beams) ranges, written into out if it is given"""
+        if self.method == "segments":
+            return cast_segments(x, y, angle, self.angles, self.walls, self.range, out)
+
+        if self.method == "pixel":
+            ranges = np.array([self._cast_pixel(px, py, pa) for px, py, pa in zip(x, y, angle)],
+                              dtype=float).reshape(len(x), len(self.angles))
+        elif self.method == "table":
+            theta = np.asarray(angle, dtype=float)[:, None] + np.asarray(self.angles, dtype=float)[None, :]
+            ranges = self.table.lookup(np.asarray(x)[:, None], np.asarray(y)[:, None], theta, self.interpolate)
+            # the table may have been built for a longer laser
+            ranges[ranges > self.range] = -1
+        elif self.method == "raster":
+            ranges = march_raster(self.occupancy, x, y, angle, self.angles, self.range)
+        else:
+            ranges = self.index.cast(x, y, angle, self.angles, self.range)
+        if out is not None:
+            np.copyto(out, ranges, casting="same_kind")
+            return out
+        return ranges
+
+    def tests(self, readings: np.ndarray) -> float:
+        """elementary tests spent producing readings: segment intersections, pixels sampled, grid cells visited or
+        table lookups, depending on the method. walking methods are estimated from how far each beam travelled
+
+        Args:
+            readings (np.ndarray): readings returned by this laser, -1 where nothing was hit
+
+        Returns:
+            float: number of tests
+        """
+        readings = np.asarray(readings, dtype=float)
+        rays = readings.size
+        if self.method == "segments":
+            return rays * len(self.walls)
+        if self.method == "table":
+            return rays * (8 if self.interpolate else 1)
+
+        travelled = np.where(readings == -1, self.range, np.clip(readings, 0, self.range)).sum()
+        if self.method == "pixel":
+            return travelled / self.range * 1000 # sample_density of sense_obstacles
+        # a beam at a uniformly random angle crosses 4 / pi grid lines per cell side travelled, on average
+        if self.method == "raster":
+            return travelled * 4 / pi + rays
+        segments_per_cell = np.count_nonzero(self.index.table >= 0) / len(self.index.table)
+        return (travelled * 4 / pi / self.index.cell + rays) * segments_per_cell
+
+    def sense_particles(self, particles: ParticleSet) -> np.ndarray:
+        """sense walls from every particle of a ParticleSet
+
+        Args:
+            particles (ParticleSet): simulated robots
+
+        Returns:
+            np.ndarray: (particles, beams) readings, -1 where nothing was hit
+        """
+        return self.sense_poses(particles.x, particles.y, particles.angle)
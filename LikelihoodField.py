@@ -0,0 +1,81 @@
+from typing import List, Sequence, Tuple
+import numpy as np
+import pygame
+
+from Grids import distance_transform, occupancy_from_surface, occupancy_from_walls
+from Particles import ParticleSet
+from Weighting import BEAM_SCALE
+
+
+class LikelihoodField:
+    """measurement model which scores particles against a precomputed distance transform of the walls.
+    the true robot's beam end points are projected into each particle's frame and the distance from each
+    end point to the closest wall is looked up, so no rays are cast for the particles at all
+    """
+    def __init__(self, distance: np.ndarray, sigma: float = 10, z_hit: float = .95, z_rand: float = .05, max_distance: float = None,
+                 resolution: float = 1) -> None:
+        """
+        Args:
+            distance (np.ndarray): distance grid indexed [y, x], from Grids.distance_transform
+            sigma (float, optional): spread of the end point distances, in pixels. Defaults to 10.
+            z_hit (float, optional): weight of the gaussian around the walls. Defaults to .95.
+            z_rand (float, optional): floor of each beam's factor, for unexplained readings. Defaults to .05.
+            max_distance (float, optional): distance given to end points off the map. Defaults to 3 * sigma.
+            resolution (float, optional): pixels per grid cell, for the coarse levels of a Pyramid.MapPyramid.
+                distances stay in pixels. Defaults to 1.
+        """
+        self.distance = distance
+        self.H, self.W = distance.shape
+        self.sigma = sigma
+        self.z_hit = z_hit
+        self.z_rand = z_rand
+        self.max_distance = 3 * sigma if max_distance is None else max_distance
+        self.resolution = resolution
+
+    @classmethod
+    def from_walls(cls, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], width: float = 3, **kwargs) -> "LikelihoodField":
+        """builds the field from the wall segments returned by Maps.draw_walls"""
+        return cls(distance_transform(occupancy_from_walls(walls, dims, width)), **kwargs)
+
+    @classmethod
+    def from_surface(cls, Map: pygame.Surface, WALL_COLOR: Tuple[int, int, int] = (0, 0, 0), **kwargs) -> "LikelihoodField":
+        """builds the field from the wall colored pixels of a map surface"""
+        return cls(distance_transform(occupancy_from_surface(Map, WALL_COLOR)), **kwargs)
+
+    def lookup(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """distance to the closest wall at each point. points off the map get max_distance"""
+        col = np.floor(np.divide(x, self.resolution)).astype(np.intp)
+        row = np.floor(np.divide(y, self.resolution)).astype(np.intp)
+        inside = (col >= 0) & (row >= 0) & (col < self.W) & (row < self.H)
+
+        d = np.full(np.shape(x), self.max_distance, dtype=float)
+        d[inside] = np.minimum(self.distance[row[inside], col[inside]], self.max_distance)
+        return d
+
+    def log_similarities(self, ideal: Sequence[float], angles: Sequence[float], particles: ParticleSet) -> np.ndarray:
+        """scores every particle against the true robot's reading
+
+        Args:
+            ideal (Sequence[float]): reading of the true robot, -1 for beams which hit nothing
+            angles (Sequence[float]): beam angles of the laser which took the reading
+            particles (ParticleSet): simulated robots
+
+        Returns:
+            np.ndarray: log similarity of each particle, on the same scale as Weighting.log_similarities
+        """
+        return self.log_similarities_poses(ideal, angles, particles.x, particles.y, particles.angle)
+
+    def log_similarities_poses(self, ideal: Sequence[float], angles: Sequence[float], x: np.ndarray, y: np.ndarray, angle: np.ndarray) -> np.ndarray:
+        """log_similarities for poses given as separate x, y and heading arrays"""
+        ideal = np.asarray(ideal, dtype=float)
+        hit = ideal != -1
+        ranges, beam_angles = ideal[hit], np.asarray(angles, dtype=float)[hit]
+
+        # beam end points in each particle's frame, shaped (particles, beams)
+        theta = np.asarray(angle)[:, None] + beam_angles[None, :]
+        x = np.asarray(x)[:, None] + ranges * np.cos(theta)
+        y = np.asarray(y)[:, None] + ranges * np.sin(theta)
+
+        d = self.lookup(x, y)
+        factors = self.z_hit * np.exp(-.5 * (d / self.sigma) ** 2) + self.z_rand
+        return np.log(factors * BEAM_SCALE).sum(axis=1)
@@ -0,0 +1,123 @@
+"""compact binary map container
+
+layout:
+    8 bytes   magic, b"PFMAP\\0\\0\\0"
+    4 bytes   format version, little endian uint32
+    4 bytes   header length, little endian uint32
+    header    utf-8 json: dims, wall color and width, and the offset, dtype and shape of every array
+    arrays    raw little endian arrays, each starting on a 64 byte boundary so it can be memory mapped in place
+
+arrays are "walls" (walls, 4) float64, and optionally the derived "occupancy" (H, W) bool,
+"distance" (H, W) float32 and "free_cells" (cells,) int32, as computed by Grids
+"""
+import json
+import struct
+from typing import Dict, List, Tuple
+import numpy as np
+
+from Grids import distance_transform, free_cells, occupancy_from_walls
+from Raycast import walls_to_array
+
+MAGIC = b"PFMAP\0\0\0"
+VERSION = 1
+ALIGNMENT = 64
+PREFIX = struct.Struct("<8sII")
+
+
+class MapData:
+    """a map loaded from a map file. arrays are memory mapped read only unless the file was loaded with mmap=False"""
+    def __init__(self, walls: np.ndarray, dims: Tuple[int, int], wall_color: Tuple[int, int, int] = (0, 0, 0), wall_width: float = 3,
+                 occupancy: np.ndarray = None, distance: np.ndarray = None, free_cells: np.ndarray = None) -> None:
+        self.walls = walls
+        self.dims = dims
+        self.wall_color = wall_color
+        self.wall_width = wall_width
+        self.occupancy = occupancy
+        self.distance = distance
+        self.free_cells = free_cells
+
+    def wall_list(self) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+        """walls in the format Maps.draw_walls returns"""
+        return [((x1, y1), (x2, y2)) for x1, y1, x2, y2 in self.walls.tolist()]
+
+
+def save_map(path: str, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], wall_color: Tuple[int, int, int] = (0, 0, 0),
+             wall_width: float = 3, derived: bool = True, start: Tuple[float, float] = None) -> None:
+    """writes a map file
+
+    Args:
+        path (str): file to write
+        walls (List[Tuple[Tuple[int, int], Tuple[int, int]]]): wall segments, as returned by Maps.draw_walls
+        dims (Tuple[int, int]): width and height of the map
+        wall_color (Tuple[int, int, int], optional): color the walls are drawn in. Defaults to (0, 0, 0).
+        wall_width (float, optional): thickness the walls are drawn with. Defaults to 3.
+        derived (bool, optional): also store the occupancy raster, distance transform and free cell index,
+            so loading never recomputes them. Defaults to True.
+        start (Tuple[float, float], optional): robot start the free cell index is flood filled from, leaving out
+            cells the robot cannot reach. Defaults to None, indexing every free cell.
+    """
+    arrays: Dict[str, np.ndarray] = {"walls": walls_to_array(walls).astype("<f8")}
+    if derived:
+        occupancy = occupancy_from_walls(walls, dims, wall_width)
+        arrays["occupancy"] = occupancy
+        arrays["distance"] = distance_transform(occupancy).astype("<f4")
+        arrays["free_cells"] = free_cells(occupancy, start).astype("<i4")
+
+    relative, position = {}, 0
+    for name, array in arrays.items():
+        relative[name] = position
+        position += _aligned(array.nbytes)
+
+    # the offsets are written in the header, so they depend on its length. grow the data start until it stops moving
+    data_start = _aligned(PREFIX.size)
+    while True:
+        entries = {name: {"offset": data_start + relative[name], "dtype": array.dtype.str, "shape": list(array.shape)}
+                   for name, array in arrays.items()}
+        header = {"dims": [int(d) for d in dims], "wall_color": [int(c) for c in wall_color[:3]], "wall_width": wall_width, "arrays": entries}
+        encoded = json.dumps(header).encode()
+        if _aligned(PREFIX.size + len(encoded)) <= data_start:
+            break
+        data_start = _aligned(PREFIX.size + len(encoded))
+
+    with open(path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(entries[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def _aligned(size: int) -> int:
+    """size rounded up to the next multiple of ALIGNMENT"""
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def load_map(path: str, mmap: bool = True) -> MapData:
+    """reads a map file
+
+    Args:
+        path (str): file written by save_map
+        mmap (bool, optional): memory map the arrays instead of reading them into memory. Defaults to True.
+
+    Returns:
+        MapData: the map. derived arrays which were not saved are None
+    """
+    with open(path, "rb") as f:
+        magic, version, length = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a map file")
+        if version > VERSION:
+            raise ValueError(f"{path} has map format version {version}, this code reads up to {VERSION}")
+        header = json.loads(f.read(length))
+
+        arrays = {}
+        for name, entry in header["arrays"].items():
+            shape, dtype = tuple(entry["shape"]), np.dtype(entry["dtype"])
+            if mmap and np.prod(shape):
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=entry["offset"], shape=shape)
+            else:
+                f.seek(entry["offset"])
+                arrays[name] = np.frombuffer(f.read(int(np.prod(shape)) * dtype.itemsize), dtype=dtype).reshape(shape)
+
+    return MapData(arrays["walls"], tuple(header["dims"]), tuple(header["wall_color"]), header["wall_width"],
+                   arrays.get("occupancy"), arrays.get("distance"), arrays.get("free_cells"))
@@ -1,7 +1,8 @@
-from math import cos, sin
-from random import randrange
+from math import cos, pi, sin
+from random import random, randrange
 from typing import List, Tuple
 
+from FreeSpace import FreeSpace
 from Robot import Robot
 import pygame
 
@@ -220,15 +221,61 @@ def move_loop(Map: pygame.Surface, Target: pygame.Surface, target_location: Tupl
         
         pygame.display.update()
 
-def scatter_robots(robots: List[Robot], dims: Tuple[int, int]) -> None:
+def scatter_robots(robots: List[Robot], dims: Tuple[int, int], free: FreeSpace = None) -> None:
     """randomize location of robots
 
     Args:
         robots (List[Robot]): robots
+        free (FreeSpace, optional): only place robots where they could reach. Defaults to the whole map.
     """
-    
+    if free is not None:
+        xs, ys = free.sample(len(robots))
+        for r, x, y in zip(robots, xs.tolist(), ys.tolist()):
+            r.position = (x, y)
+        return
+
     for r in robots:
         x, y = randrange(0, dims[0]), randrange(0, dims[1])
         r.position = (x, y)
 
     
+
+def box_walls(dims: Tuple[int, int], margin: int = 20) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """walls of a room with a few interior walls, for runs where nobody draws a map
+
+    Args:
+        dims (Tuple[int, int]): width and height of the map
+        margin (int, optional): distance between the outer walls and the map edge. Defaults to 20.
+
+    Returns:
+        List[Tuple[Tuple[int, int], Tuple[int, int]]]: walls in the same format as draw_walls
+    """
+    W, H = dims
+    left, top, right, bottom = margin, margin, W - margin, H - margin
+    return [((left, top), (right, top)), ((right, top), (right, bottom)),
+            ((right, bottom), (left, bottom)), ((left, bottom), (left, top)),
+            ((left, H // 3), (W // 2, H // 3)),
+            ((W // 2, 2 * H // 3), (right, 2 * H // 3)),
+            ((2 * W // 3, top), (2 * W // 3, H // 5))]
+
+def random_walls(count: int, dims: Tuple[int, int], min_length: float = 20, max_length: float = 200) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """procedurally generated map of randomly placed walls inside a box_walls room
+
+    Args:
+        count (int): total number of walls, including the 7 of the room
+        dims (Tuple[int, int]): width and height of the map
+        min_length (float, optional): shortest random wall. Defaults to 20.
+        max_length (float, optional): longest random wall. Defaults to 200.
+
+    Returns:
+        List[Tuple[Tuple[int, int], Tuple[int, int]]]: walls in the same format as draw_walls
+    """
+    walls = box_walls(dims)[:count]
+    for _ in range(count - len(walls)):
+        x1, y1 = randrange(0, dims[0]), randrange(0, dims[1])
+        length = min_length + random() * (max_length - min_length)
+        angle = random() * 2*pi
+        x2 = min(max(int(x1 + length * cos(angle)), 0), dims[0] - 1)
+        y2 = min(max(int(y1 + length * sin(angle)), 0), dims[1] - 1)
+        walls.append(((x1, y1), (x2, y2)))
+    return walls
@@ -6,9 +6,12 @@ class Linear:
     def __init__(self, mean=0, sd=0) -> None:
         self.mean = mean # usually 0
         self.sd = sd # some error
+        self.last_noise = 0 # error drawn by the latest move, kept for Recording
     
-    def move(self, true_distance) -> float:
-        return true_distance + np.random.normal(self.mean, self.sd)
+    def move(self, true_distance, size=None) -> float:
+        """adds linear error to a distance. pass size to draw a whole array of errors at once"""
+        self.last_noise = np.random.normal(self.mean, self.sd, size)
+        return true_distance + self.last_noise
     
 class Angular:
     """Class to simulate errors in angle 
@@ -16,6 +19,9 @@ class Angular:
     def __init__(self, mean=0, sd=0) -> None:
         self.mean = mean # usually 0 
         self.sd = sd # some error
+        self.last_noise = 0 # error drawn by the latest turn, kept for Recording
     
-    def turn(self, true_angle) -> float:
-        return true_angle + np.random.normal(self.mean, self.sd)
\ No newline at end of file
+    def turn(self, true_angle, size=None) -> float:
+        """adds angular error to an angle. pass size to draw a whole array of errors at once"""
+        self.last_noise = np.random.normal(self.mean, self.sd, size)
+        return true_angle + self.last_noise
\ No newline at end of file
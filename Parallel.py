@@ -0,0 +1,159 @@
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+from typing import Dict, Sequence, Tuple
+import numpy as np
+
+from Laser import Laser
+from LikelihoodField import LikelihoodField
+from Particles import ParticleSet
+from Weighting import log_similarities
+
+# per process state of a worker, attached once by _attach
+_worker: Dict[str, object] = {}
+
+
+def _shared(shape: Tuple[int, ...], dtype=np.float64) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """new shared memory block and an array over it"""
+    size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _open(name: str, shape: Tuple[int, ...], dtype=np.float64) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """attaches to a block made by _shared in another process"""
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _attach(buffers: Dict[str, Tuple[str, Tuple[int, ...], str]], laser: Dict, field: Dict) -> None:
+    """pool initializer. maps every shared buffer and rebuilds the measurement model around them"""
+    # forked workers would otherwise all draw the same laser noise
+    np.random.seed()
+
+    _worker.clear()
+    blocks = []
+    for key, (name, shape, dtype) in buffers.items():
+        block, array = _open(name, shape, dtype)
+        blocks.append(block)
+        _worker[key] = array
+    _worker["blocks"] = blocks # the arrays are only valid while their blocks are open
+
+    _worker["field"] = None if field is None else LikelihoodField(_worker["distance"], **field)
+    _worker["laser"] = None
+    if "walls" in _worker:
+        _worker["laser"] = Laser(laser["range"], uncertainty=laser["sigma"], angles=laser["angles"], walls=_worker["walls"], method="segments")
+    elif "occupancy" in _worker:
+        _worker["laser"] = Laser(laser["range"], uncertainty=laser["sigma"], angles=laser["angles"], occupancy=_worker["occupancy"], method="raster")
+    _worker["angles"] = laser["angles"]
+    _worker["sigma"] = laser["sigma"]
+
+
+def _weigh_chunk(bounds: Tuple[int, int]) -> None:
+    """log similarities of particles [start, stop), written straight into the shared weight buffer"""
+    start, stop = bounds
+    state = _worker["particles"]
+    x, y, angle = state[0, start:stop], state[1, start:stop], state[2, start:stop]
+    ideal = _worker["reading"]
+
+    if _worker["field"] is not None:
+        weights = _worker["field"].log_similarities_poses(ideal, _worker["angles"], x, y, angle)
+    else:
+        weights = log_similarities(ideal, _worker["laser"].sense_poses(x, y, angle), _worker["sigma"])
+    _worker["weights"][start:stop] = weights
+
+
+class ParallelSensor:
+    """runs the measurement step on a pool of processes. the walls, the wall raster or the likelihood field's distance grid,
+    the particle poses, the true reading and the output weights all live in shared memory, so an update only copies
+    the poses in and sends each worker the bounds of its chunk
+    """
+    def __init__(self, laser: Laser, workers: int = None, field: LikelihoodField = None, capacity: int = 1 << 14, chunks_per_worker: int = 4) -> None:
+        """
+        Args:
+            laser (Laser): laser of the particles. only the segment and raster methods can be shared between processes
+            workers (int, optional): number of processes. Defaults to the number of cpus.
+            field (LikelihoodField, optional): score with this likelihood field instead of ray casting. Defaults to None.
+            capacity (int, optional): particles the buffers hold before they have to grow. Defaults to 1 << 14.
+            chunks_per_worker (int, optional): chunks each worker gets per update, for load balancing. Defaults to 4.
+        """
+        if field is None and laser.method not in ("segments", "raster"):
+            raise ValueError("parallel sensing needs a segment or raster laser, or a likelihood field")
+
+        self.laser = laser
+        self.field = field
+        self.workers = workers or os.cpu_count()
+        self.chunks_per_worker = chunks_per_worker
+        self.capacity = 0
+        self.pool = None
+        self.blocks = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        """(re)creates the particle and weight buffers with room for capacity particles, and a pool attached to them"""
+        self._release()
+        self.capacity = capacity
+
+        arrays = {}
+        self.blocks["particles"], arrays["particles"] = _shared((3, capacity))
+        self.blocks["weights"], arrays["weights"] = _shared((capacity,))
+        self.blocks["reading"], arrays["reading"] = _shared((len(self.laser.angles),))
+        if self.field is not None:
+            self.blocks["distance"], arrays["distance"] = _shared(self.field.distance.shape, self.field.distance.dtype)
+            arrays["distance"][:] = self.field.distance
+        elif self.laser.method == "raster":
+            self.blocks["occupancy"], arrays["occupancy"] = _shared(self.laser.occupancy.shape, np.bool_)
+            arrays["occupancy"][:] = self.laser.occupancy
+        else:
+            self.blocks["walls"], arrays["walls"] = _shared(self.laser.walls.shape, self.laser.walls.dtype)
+            arrays["walls"][:] = self.laser.walls
+        self.arrays = arrays
+
+        buffers = {key: (block.name, arrays[key].shape, arrays[key].dtype.str) for key, block in self.blocks.items()}
+        laser = {"range": self.laser.range, "sigma": self.laser.sigma, "angles": tuple(self.laser.angles)}
+        field = None if self.field is None else {"sigma": self.field.sigma, "z_hit": self.field.z_hit,
+                                                 "z_rand": self.field.z_rand, "max_distance": self.field.max_distance}
+        self.pool = mp.Pool(self.workers, initializer=_attach, initargs=(buffers, laser, field))
+
+    def _release(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def log_similarities(self, ideal: Sequence[float], particles: ParticleSet) -> np.ndarray:
+        """scores every particle against the true robot's reading on the pool
+
+        Args:
+            ideal (Sequence[float]): reading of the true robot
+            particles (ParticleSet): simulated robots
+
+        Returns:
+            np.ndarray: log similarity of each particle
+        """
+        N = len(particles)
+        if N > self.capacity:
+            self._allocate(max(N, 2 * self.capacity))
+
+        state = self.arrays["particles"]
+        state[0, :N], state[1, :N], state[2, :N] = particles.x, particles.y, particles.angle
+        self.arrays["reading"][:] = ideal
+
+        edges = np.linspace(0, N, min(self.workers * self.chunks_per_worker, N) + 1).astype(int)
+        self.pool.map(_weigh_chunk, list(zip(edges[:-1], edges[1:])))
+        return self.arrays["weights"][:N].copy()
+
+    def close(self) -> None:
+        """stops the workers and frees the shared memory"""
+        self._release()
+
+    def __enter__(self) -> "ParallelSensor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,105 @@
+from math import pi
+from typing import Tuple
+import numpy as np
+
+from FreeSpace import FreeSpace
+from Odometry import Linear, Angular
+from Robot import Robot
+
+
+class ParticleSet:
+    """array-backed set of simulated robots. x, y, angle and weight are stored in contiguous arrays,
+    so driving and turning the whole set is a single numpy pass instead of one Robot call per particle
+    """
+    def __init__(self, linear: Linear, angular: Angular, N: int = 100, v: float = .5, omega: float = .05,
+                 bounds: Tuple[int, int] = None) -> None:
+        self.x = np.zeros(N)
+        self.y = np.zeros(N)
+        self.angle = np.zeros(N)
+        self.weight = np.full(N, 1 / N) if N else np.zeros(0)
+
+        self.linear = linear # error distributions, shared by every particle
+        self.angular = angular
+
+        self.v = v # speed
+        self.o = omega # angular velocity
+        self.bounds = bounds # width and height of the map, None for no limit
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, index: int) -> Robot:
+        """snapshot of a single particle as a Robot, for code which still works on one robot at a time"""
+        return Robot(self.linear, self.angular, (self.x[index], self.y[index]), self.angle[index],
+                     v=self.v, omega=self.o, bounds=self.bounds)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def positions(self) -> np.ndarray:
+        """(N, 2) array of particle positions"""
+        return np.column_stack((self.x, self.y))
+
+    def set_poses(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray) -> None:
+        """replaces every pose at once. the arrays may have a different length than the current set
+
+        Args:
+            x (np.ndarray): new x coordinates
+            y (np.ndarray): new y coordinates
+            angle (np.ndarray): new headings
+        """
+        self.x = np.ascontiguousarray(x, dtype=float)
+        self.y = np.ascontiguousarray(y, dtype=float)
+        self.angle = np.ascontiguousarray(angle, dtype=float) % (2*pi)
+        self.weight = np.full(len(self.x), 1 / len(self.x)) if len(self.x) else np.zeros(0)
+
+    def scatter(self, dims: Tuple[int, int], N: int = None, free: FreeSpace = None) -> None:
+        """randomize the location of every particle, like Maps.scatter_robots
+
+        Args:
+            dims (Tuple[int, int]): width and height of the map
+            N (int, optional): new number of particles. new particles get random headings. Defaults to the current size.
+            free (FreeSpace, optional): draw positions from this free space instead of the whole map. Defaults to None.
+        """
+        if N is not None and N != len(self):
+            self.angle = np.concatenate((self.angle[:N], np.random.uniform(0, 2*pi, max(N - len(self), 0))))
+        N = len(self.angle)
+        if free is not None:
+            self.x, self.y = free.sample(N)
+        else:
+            self.x = np.random.randint(0, dims[0], N).astype(float)
+            self.y = np.random.randint(0, dims[1], N).astype(float)
+        self.weight = np.full(N, 1 / N) if N else np.zeros(0)
+
+    def drive(self, dt) -> None:
+        """batched Robot.drive. every particle's linear error is drawn in one call,
+        and particles which would leave the bounds stay where they are
+
+        Args:
+            dt (_type_): time step
+        """
+        N = len(self)
+        sim_distance = self.linear.move(self.v * dt, N)
+
+        new_x = self.x + sim_distance * np.cos(self.angle)
+        new_y = self.y + sim_distance * np.sin(self.angle)
+
+        if self.bounds is None:
+            self.x, self.y = new_x, new_y
+            return
+        inside = (new_x >= 0) & (new_y >= 0) & (new_x < self.bounds[0]) & (new_y < self.bounds[1])
+        np.copyto(self.x, new_x, where=inside)
+        np.copyto(self.y, new_y, where=inside)
+
+    def turn(self, dt, clockwise: bool = False) -> None:
+        """batched Robot.turn. every particle's angular error is drawn in one call
+
+        Args:
+            dt (_type_): time step
+            clockwise (bool): direction to turn, False by default
+        """
+        sim_turn = self.angular.turn(self.o * dt, len(self))
+        multiplier = int(clockwise) * -2 + 1 # clockwise is -1, ccw is 1
+        self.angle += sim_turn * multiplier
+        self.angle %= 2*pi
@@ -0,0 +1,122 @@
+"""per stage timing and work counters for the filter
+
+stages are timed with Profiler.stage and counters added with Profiler.count. everything recorded between two
+calls to Profiler.end_update becomes one row of the trace, so a row covers the motion frames leading up to an
+update plus the update itself. NullProfiler has the same interface and records nothing, and code which has to
+do extra work to produce a counter checks Profiler.enabled first, so profiling costs nothing when it is off
+"""
+import csv
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Dict, Iterator, List, Tuple
+import pygame
+
+STAGES = ("motion", "sensing", "weighting", "resampling", "rendering")
+
+
+class NullProfiler:
+    """stands in for a Profiler when profiling is off"""
+    enabled = False
+    _null = nullcontext()
+
+    def stage(self, name: str):
+        return self._null
+
+    def count(self, name: str, value: float) -> None:
+        pass
+
+    def set(self, name: str, value: float) -> None:
+        pass
+
+    def end_update(self) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler:
+    """records wall clock seconds per stage and counters such as rays cast, into one trace row per filter update"""
+    enabled = True
+
+    def __init__(self) -> None:
+        self.trace: List[Dict[str, float]] = []
+        self.current: Dict[str, float] = {}
+        # the render loop and a Worker.FilterWorker may record at the same time
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """times the block under the key "<name>_seconds". repeated blocks of a stage add up"""
+        began = perf_counter()
+        try:
+            yield
+        finally:
+            self.count(f"{name}_seconds", perf_counter() - began)
+
+    def count(self, name: str, value: float) -> None:
+        """adds value to a counter of the current row"""
+        with self.lock:
+            self.current[name] = self.current.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        """sets a value of the current row, for gauges such as particles alive"""
+        with self.lock:
+            self.current[name] = value
+
+    def end_update(self) -> None:
+        """closes the current row and starts the next one"""
+        with self.lock:
+            self.trace.append({"update": len(self.trace), **self.current})
+            self.current = {}
+
+    @property
+    def last(self) -> Dict[str, float]:
+        """the most recent complete row, empty before the first update"""
+        return self.trace[-1] if self.trace else {}
+
+    def totals(self) -> Dict[str, float]:
+        """seconds spent in each stage over the whole trace"""
+        return {stage: sum(row.get(f"{stage}_seconds", 0) for row in self.trace) for stage in STAGES}
+
+    def export(self, path: str) -> None:
+        """writes the trace as csv if path ends with .csv, otherwise as json"""
+        if path.endswith(".csv"):
+            columns = list(dict.fromkeys(key for row in self.trace for key in row))
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, columns)
+                writer.writeheader()
+                writer.writerows(self.trace)
+        else:
+            with open(path, "w") as f:
+                json.dump(self.trace, f, indent=1)
+
+
+class Overlay:
+    """draws the last trace row in a box on the screen"""
+    def __init__(self, location: Tuple[int, int], size: int = 16, color=(60, 60, 60), background=(255, 255, 255)) -> None:
+        self.location = location
+        self.font = pygame.font.SysFont("Monaco", size)
+        self.color = color
+        self.background = background
+        self.rect = pygame.Rect(location, (0, 0))
+
+    def draw(self, Map: pygame.Surface, row: Dict[str, float]) -> pygame.Rect:
+        """draws row onto Map over the box of the previous call, and returns the screen rect which changed"""
+        lines = [f"{stage:<10} {row[f'{stage}_seconds'] * 1000:8.2f} ms" for stage in STAGES if f"{stage}_seconds" in row]
+        lines += [f"{key:<10} {row[key]:>11.4g}" for key in ("particles", "rays", "tests", "ess") if key in row]
+        rendered = [self.font.render(line, True, self.color) for line in lines]
+
+        height = sum(r.get_height() for r in rendered)
+        width = max((r.get_width() for r in rendered), default=0)
+        dirty = self.rect.union(pygame.Rect(self.location, (width, height)))
+        Map.fill(self.background, dirty)
+        y = self.location[1]
+        for r in rendered:
+            Map.blit(r, (self.location[0], y))
+            y += r.get_height()
+
+        self.rect = pygame.Rect(self.location, (width, height))
+        return dirty
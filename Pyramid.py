@@ -0,0 +1,163 @@
+"""coarse to fine search of the whole map for the robot's pose, from a single scan
+
+scattering particles over a large map needs a huge set before one of them lands close enough to the robot to be
+recognized. the search here instead scores a grid of poses covering every free cell, but on a coarse copy of the
+distance transform where a few thousand poses already cover the map. the best poses are split into finer poses
+one level down, and so on to full resolution, and the survivors become a compact particle set for the filter
+"""
+from math import ceil, pi
+from typing import Callable, List, Sequence, Tuple
+import numpy as np
+
+from FreeSpace import FreeSpace
+from Grids import FAR, distance_transform, occupancy_from_walls
+from LikelihoodField import LikelihoodField
+from MapFile import MapData
+from Particles import ParticleSet
+from Resampling import systematic
+from Weighting import normalize_log
+
+Poses = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] # x, y, heading and log similarity
+
+
+def _pool(grid: np.ndarray, reduce, fill) -> np.ndarray:
+    """reduces every 2x2 block of grid, padding odd sides with fill"""
+    H, W = grid.shape
+    padded = np.pad(grid, ((0, H % 2), (0, W % 2)), constant_values=fill)
+    return reduce(padded.reshape((H + 1) // 2, 2, (W + 1) // 2, 2), axis=(1, 3))
+
+
+class MapPyramid:
+    """distance grids of one map at halving resolutions.
+
+    level 0 is the full resolution distance transform. every level above holds the minimum of 2x2 cells of the one
+    below, so a coarse cell knows how close a wall comes anywhere inside it, and a cell is free if any cell below it
+    is. each level scores poses with a LikelihoodField whose sigma covers the cell size, so a pose which is only
+    known to within a cell is not ruled out before it is refined
+    """
+    def __init__(self, distance: np.ndarray, free: np.ndarray = None, levels: int = 4, sigma: float = 10) -> None:
+        """
+        Args:
+            distance (np.ndarray): full resolution distance grid indexed [y, x], from Grids.distance_transform
+            free (np.ndarray, optional): boolean grid of cells the robot may be in. Defaults to every cell off a wall.
+            levels (int, optional): levels above full resolution. the coarsest has cells of 2**levels pixels. Defaults to 4.
+            sigma (float, optional): end point spread at full resolution, as LikelihoodField. Defaults to 10.
+        """
+        if free is None:
+            free = distance > 0
+        self.fields: List[LikelihoodField] = []
+        self.free: List[np.ndarray] = []
+        for level in range(levels + 1):
+            cell = 2 ** level
+            spread = float(np.hypot(sigma, cell))
+            self.fields.append(LikelihoodField(distance, sigma=spread, resolution=cell))
+            self.free.append(free)
+            distance, free = _pool(distance, np.min, FAR), _pool(free, np.any, False)
+
+    @classmethod
+    def from_walls(cls, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], free: FreeSpace = None,
+                   width: float = 3, **kwargs) -> "MapPyramid":
+        """builds the pyramid from wall segments, searching only free if it is given"""
+        distance = distance_transform(occupancy_from_walls(walls, dims, width))
+        return cls(distance, None if free is None else free.mask(), **kwargs)
+
+    @classmethod
+    def from_map(cls, map_data: MapData, free: FreeSpace = None, **kwargs) -> "MapPyramid":
+        """reuses the distance grid and free cells stored by MapFile.save_map"""
+        if map_data.distance is None:
+            return cls.from_walls(map_data.wall_list(), map_data.dims, free, map_data.wall_width, **kwargs)
+        if free is None and map_data.free_cells is not None:
+            free = FreeSpace.from_map(map_data)
+        return cls(np.asarray(map_data.distance), None if free is None else free.mask(), **kwargs)
+
+    @property
+    def levels(self) -> int:
+        return len(self.fields) - 1
+
+    def search(self, reading: Sequence[float], angles: Sequence[float], beam: int = 2000) -> Poses:
+        """finds the poses best explaining a reading, anywhere on the map
+
+        every free cell of the coarsest level is scored at every heading. the beam best poses are split into the
+        four cells below them and two headings each, the children in free cells are scored at the next level, and
+        the beam best of those go on, down to full resolution. headings are spaced so that half a step moves the
+        end of the longest beam in the reading by about one cell
+
+        Args:
+            reading (Sequence[float]): reading of the true robot, -1 for beams which hit nothing
+            angles (Sequence[float]): beam angles of the laser which took the reading
+            beam (int, optional): poses kept at each level. Defaults to 2000.
+
+        Returns:
+            Poses: x, y, heading and log similarity of the survivors at full resolution, best first
+        """
+        ranges = np.asarray(reading, dtype=float)
+        longest = max(ranges.max(initial=0), 1)
+        level = self.levels
+        cell = 2 ** level
+        step = 2 * cell / longest
+        headings = max(int(ceil(2*pi / step)), 1)
+        step = 2*pi / headings
+
+        rows, cols = np.nonzero(self.free[level])
+        x = np.repeat((cols + .5) * cell, headings)
+        y = np.repeat((rows + .5) * cell, headings)
+        angle = np.tile((np.arange(headings) + .5) * step, len(rows))
+        scores = self.fields[level].log_similarities_poses(reading, angles, x, y, angle)
+        x, y, angle, scores = self._best(x, y, angle, scores, beam)
+
+        offsets = np.array([-.5, .5])
+        while level > 0:
+            level -= 1
+            cell, step = cell / 2, step / 2
+            # every survivor splits into 2 x 2 cells and 2 headings, centered on the parent
+            dx, dy, da = (a.ravel() for a in np.meshgrid(offsets * cell, offsets * cell, offsets * step, indexing="ij"))
+            x = (x[:, None] + dx).ravel()
+            y = (y[:, None] + dy).ravel()
+            angle = (angle[:, None] + da).ravel()
+
+            free = self.free[level]
+            col, row = (x // cell).astype(np.intp), (y // cell).astype(np.intp)
+            inside = (col >= 0) & (row >= 0) & (col < free.shape[1]) & (row < free.shape[0])
+            inside[inside] = free[row[inside], col[inside]]
+            x, y, angle = x[inside], y[inside], angle[inside]
+
+            scores = self.fields[level].log_similarities_poses(reading, angles, x, y, angle)
+            x, y, angle, scores = self._best(x, y, angle, scores, beam)
+
+        return x, y, angle % (2*pi), scores
+
+    @staticmethod
+    def _best(x: np.ndarray, y: np.ndarray, angle: np.ndarray, scores: np.ndarray, beam: int) -> Poses:
+        if len(scores) > beam:
+            kept = np.argpartition(scores, len(scores) - beam)[len(scores) - beam:]
+        else:
+            kept = np.arange(len(scores))
+        kept = kept[np.argsort(scores[kept])[::-1]]
+        return x[kept], y[kept], angle[kept], scores[kept]
+
+    def localize(self, reading: Sequence[float], angles: Sequence[float], particles: ParticleSet, N: int = None,
+                 beam: int = 2000, score: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray] = None) -> Poses:
+        """search, then replace the particles with poses drawn from the survivors in proportion to their scores
+
+        Args:
+            reading (Sequence[float]): reading of the true robot, -1 for beams which hit nothing
+            angles (Sequence[float]): beam angles of the laser which took the reading
+            particles (ParticleSet): set to fill, updated in place
+            N (int, optional): number of particles. Defaults to the current size.
+            beam (int, optional): poses kept at each level of the search. Defaults to 2000.
+            score (Callable, optional): rescores the survivors before drawing from them, e.g. with the filter's own
+                sensor model, which also uses the beams that hit nothing. Defaults to the full resolution field.
+
+        Returns:
+            Poses: the survivors of the search, see search
+        """
+        x, y, angle, scores = survivors = self.search(reading, angles, beam)
+        if score is not None:
+            scores = score(x, y, angle)
+        N = len(particles) if N is None else N
+        chosen = systematic(normalize_log(scores), N)
+        # spread the copies over the cell and heading step each survivor stands for
+        step = 2 / max(np.max(reading, initial=0), 1)
+        particles.set_poses(x[chosen] + np.random.uniform(-.5, .5, N), y[chosen] + np.random.uniform(-.5, .5, N),
+                            angle[chosen] + np.random.uniform(-step/2, step/2, N))
+        return survivors
@@ -0,0 +1,148 @@
+import hashlib
+import mmap
+import os
+import traceback
+from math import pi
+from typing import List, Tuple
+import numpy as np
+
+from Raycast import cast_segments, walls_to_array
+
+# bump whenever the table layout changes, so stale cache files are never read
+FORMAT_VERSION = 1
+CACHE_DIR = ".raycast_cache"
+
+
+def wall_hash(walls: np.ndarray, dims: Tuple[int, int], max_range: float, resolution: float, angle_bins: int) -> str:
+    """key of a range table: the wall geometry together with everything else the table depends on"""
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(walls, dtype=np.float64).tobytes())
+    digest.update(repr((FORMAT_VERSION, tuple(int(d) for d in dims), float(max_range), float(resolution), int(angle_bins))).encode())
+    return digest.hexdigest()[:16]
+
+
+class RangeTable:
+    """expected laser ranges for every (cell, heading) pair of a fixed map.
+    entry [row, col, k] is the distance to the closest wall from the center of the cell along heading k * 2pi / angle_bins,
+    or -1 if nothing is within max_range. beams of any Laser.angles are read from the heading bins, so sensing is a lookup
+    """
+    def __init__(self, table: np.ndarray, resolution: float, max_range: float) -> None:
+        self.table = table
+        self.rows, self.cols, self.angle_bins = table.shape
+        self.resolution = resolution
+        self.max_range = max_range
+
+    @classmethod
+    def build(cls, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], max_range: float,
+              resolution: float = 4, angle_bins: int = 120, out: np.ndarray = None) -> "RangeTable":
+        """casts every heading from every cell center once
+
+        Args:
+            walls (List[Tuple[Tuple[int, int], Tuple[int, int]]]): wall segments
+            dims (Tuple[int, int]): width and height of the map
+            max_range (float): laser range
+            resolution (float, optional): cell size in pixels. Defaults to 4.
+            angle_bins (int, optional): number of heading bins. Defaults to 120.
+            out (np.ndarray, optional): preallocated (rows, cols, angle_bins) array to fill, e.g. a memmap. Defaults to None.
+        """
+        walls = walls_to_array(walls)
+        cols, rows = int(np.ceil(dims[0] / resolution)), int(np.ceil(dims[1] / resolution))
+        table = np.empty((rows, cols, angle_bins), dtype=np.float32) if out is None else out
+
+        headings = np.arange(angle_bins) * (2*pi / angle_bins)
+        xs = (np.arange(cols) + .5) * resolution
+        # one row of cells at a time keeps the temporaries small for big maps
+        for row in range(rows):
+            ys = np.full(cols, (row + .5) * resolution)
+            table[row] = cast_segments(xs, ys, np.zeros(cols), headings, walls, max_range)
+
+        return cls(table, resolution, max_range)
+
+    @classmethod
+    def load_or_build(cls, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], max_range: float,
+                      resolution: float = 4, angle_bins: int = 120, cache_dir: str = CACHE_DIR) -> "RangeTable":
+        """memory maps the cached table of this map, building and saving it first if it does not exist yet.
+        the table is opened read only, so every process using the same map shares the same pages
+        """
+        key = wall_hash(walls_to_array(walls), dims, max_range, resolution, angle_bins)
+        path = os.path.join(cache_dir, f"ranges_{key}.npy")
+
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            # build into a private file and rename it into place, so a reader never sees a partial table
+            temporary = f"{path}.{os.getpid()}.tmp"
+            try:
+                cls._build_file(temporary, walls, dims, max_range, resolution, angle_bins)
+                os.replace(temporary, path)
+            finally:
+                # a failed or interrupted build leaves nothing behind in the cache directory
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+
+        return cls(np.load(path, mmap_mode="r"), resolution, max_range)
+
+    @classmethod
+    def _build_file(cls, path: str, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int],
+                    max_range: float, resolution: float, angle_bins: int) -> None:
+        """builds a table straight into a new .npy file, through a mapping of the file that is always closed"""
+        cols, rows = int(np.ceil(dims[0] / resolution)), int(np.ceil(dims[1] / resolution))
+        dtype = np.dtype(np.float32)
+        header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (rows, cols, angle_bins)}
+        with open(path, "w+b") as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            offset = f.tell()
+            f.truncate(offset + rows * cols * angle_bins * dtype.itemsize)
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), 0)
+            try:
+                cls.build(walls, dims, max_range, resolution, angle_bins,
+                          out=np.ndarray((rows, cols, angle_bins), dtype, buffer=mapped, offset=offset))
+                mapped.flush()
+            except Exception as error:
+                # the frames of the failed build still hold the array, which keeps the mapping from closing
+                traceback.clear_frames(error.__traceback__)
+                raise
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass # interrupted mid build. the mapping is released with the interrupt's traceback
+
+    def lookup(self, x: np.ndarray, y: np.ndarray, theta: np.ndarray, interpolate: bool = False) -> np.ndarray:
+        """expected ranges at the given positions and absolute beam headings. all arguments broadcast together
+
+        Args:
+            x (np.ndarray): x coordinates
+            y (np.ndarray): y coordinates
+            theta (np.ndarray): absolute beam headings
+            interpolate (bool, optional): trilinear interpolation between the neighbouring cells and headings,
+                falling back to the nearest entry wherever one of the neighbours hits nothing. Defaults to False.
+
+        Returns:
+            np.ndarray: ranges, -1 where nothing is hit
+        """
+        x, y, theta = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(theta, dtype=float))
+        fc = np.clip(x / self.resolution - .5, 0, self.cols - 1)
+        fr = np.clip(y / self.resolution - .5, 0, self.rows - 1)
+        fk = (theta % (2*pi)) * (self.angle_bins / (2*pi))
+
+        nearest = self.table[np.rint(fr).astype(np.intp), np.rint(fc).astype(np.intp),
+                             np.rint(fk).astype(np.intp) % self.angle_bins].astype(float)
+        if not interpolate:
+            return nearest
+
+        c0, r0, k0 = np.floor(fc).astype(np.intp), np.floor(fr).astype(np.intp), np.floor(fk).astype(np.intp)
+        tc, tr, tk = fc - c0, fr - r0, fk - k0
+        c1, r1 = np.minimum(c0 + 1, self.cols - 1), np.minimum(r0 + 1, self.rows - 1)
+        k0, k1 = k0 % self.angle_bins, (k0 + 1) % self.angle_bins
+
+        result = np.zeros(x.shape)
+        missed = np.zeros(x.shape, dtype=bool)
+        for r, wr in ((r0, 1 - tr), (r1, tr)):
+            for c, wc in ((c0, 1 - tc), (c1, tc)):
+                for k, wk in ((k0, 1 - tk), (k1, tk)):
+                    corner = self.table[r, c, k]
+                    missed |= corner == -1
+                    result += wr * wc * wk * corner
+
+        return np.where(missed, nearest, result)
@@ -0,0 +1,182 @@
+from typing import Sequence, Tuple
+import numpy as np
+
+# number of (particle, beam, wall) intersection tests evaluated per chunk. bounds the temporaries in cast_segments
+CHUNK_ELEMENTS = 1 << 22
+
+
+def walls_to_array(walls: Sequence[Tuple[Tuple[float, float], Tuple[float, float]]]) -> np.ndarray:
+    """converts the wall list from Maps.draw_walls into a (walls, 4) array of x1, y1, x2, y2
+
+    Args:
+        walls (Sequence[Tuple[Tuple[float, float], Tuple[float, float]]]): pairs of wall end points
+
+    Returns:
+        np.ndarray: float array with one segment per row
+    """
+    walls = np.asarray(walls, dtype=float)
+    return walls.reshape(-1, 4)
+
+
+def beam_directions(heading: np.ndarray, angles: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """unit direction vectors of every beam of every pose, shaped (poses, beams)"""
+    theta = np.asarray(heading, dtype=float)[:, None] + np.asarray(angles, dtype=float)[None, :]
+    return np.cos(theta), np.sin(theta)
+
+
+def intersect(ox, oy, dx, dy, ax, ay, ex, ey) -> np.ndarray:
+    """distance along each beam to each wall, broadcasting all arguments together
+
+    Args:
+        ox, oy: beam origins
+        dx, dy: unit beam directions
+        ax, ay: first end of each wall
+        ex, ey: vector from the first to the second end of each wall
+
+    Returns:
+        np.ndarray: t such that origin + t * direction lies on the wall, inf where the beam misses it
+    """
+    wx, wy = ax - ox, ay - oy
+    # solve origin + t * beam = a + u * (b - a). parallel walls give denom == 0 and are never hit
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denom = dx * ey - dy * ex
+        t = (wx * ey - wy * ex) / denom
+        u = (wx * dy - wy * dx) / denom
+    return np.where((t >= 0) & (u >= 0) & (u <= 1), t, np.inf)
+
+
+def cast_segments(x: np.ndarray, y: np.ndarray, heading: np.ndarray, angles: Sequence[float], walls: np.ndarray,
+                  max_range: float, out: np.ndarray = None) -> np.ndarray:
+    """intersects every beam of every pose with every wall segment in one vectorized pass
+
+    Args:
+        x (np.ndarray): x coordinates of the poses
+        y (np.ndarray): y coordinates of the poses
+        heading (np.ndarray): headings of the poses
+        angles (Sequence[float]): beam angles, relative to the heading
+        walls (np.ndarray): (walls, 4) array from walls_to_array
+        max_range (float): length of each beam
+        out (np.ndarray, optional): preallocated (poses, beams) array to fill, e.g. a reused float32 buffer. Defaults to None.
+
+    Returns:
+        np.ndarray: (poses, beams) array of distances to the closest wall. -1 where a beam hits nothing
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    heading = np.atleast_1d(np.asarray(heading, dtype=float))
+    N, B, W = len(x), len(angles), len(walls)
+
+    if out is None:
+        ranges = np.full((N, B), -1.0)
+    else:
+        ranges = out
+        ranges.fill(-1)
+    if N == 0 or W == 0:
+        return ranges
+
+    ax, ay = walls[:, 0], walls[:, 1]
+    ex, ey = walls[:, 2] - ax, walls[:, 3] - ay
+
+    chunk = max(1, CHUNK_ELEMENTS // (B * W))
+    for start in range(0, N, chunk):
+        stop = min(start + chunk, N)
+        dx, dy = beam_directions(heading[start:stop], angles)
+        dx, dy = dx[..., None], dy[..., None]
+
+        # shaped (poses, beams, walls)
+        t = intersect(x[start:stop, None, None], y[start:stop, None, None], dx, dy, ax, ay, ex, ey)
+        closest = np.where(t <= max_range, t, np.inf).min(axis=2)
+        ranges[start:stop] = np.where(np.isfinite(closest), closest, -1.0)
+
+    return ranges
+
+
+class GridWalk:
+    """steps many rays at once through the cells of a uniform grid (Amanatides & Woo), visiting exactly
+    the cells each ray crosses, in order. rays starting outside the grid are first moved to where they enter it
+
+    after construction, and after every advance, the still active rays are described by
+    rays (their indices), col, row, t_enter and t_exit (distances along the ray where it enters and leaves the cell)
+    """
+    def __init__(self, ox: np.ndarray, oy: np.ndarray, dx: np.ndarray, dy: np.ndarray, cell: float, cols: int, rows: int, max_range: float) -> None:
+        self.cell, self.cols, self.rows, self.max_range = cell, cols, rows, max_range
+        ox, oy, dx, dy = (np.asarray(a, dtype=float).ravel() for a in (ox, oy, dx, dy))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_x, inv_y = 1 / dx, 1 / dy
+            # slab test against the grid rectangle
+            tx1, tx2 = -ox * inv_x, (cols * cell - ox) * inv_x
+            ty1, ty2 = -oy * inv_y, (rows * cell - oy) * inv_y
+        tx1, tx2 = np.where(dx == 0, np.where((ox >= 0) & (ox < cols * cell), -np.inf, np.inf), tx1), np.where(dx == 0, np.inf, tx2)
+        ty1, ty2 = np.where(dy == 0, np.where((oy >= 0) & (oy < rows * cell), -np.inf, np.inf), ty1), np.where(dy == 0, np.inf, ty2)
+        t_in = np.maximum(np.maximum(np.minimum(tx1, tx2), np.minimum(ty1, ty2)), 0)
+        t_out = np.minimum(np.maximum(tx1, tx2), np.maximum(ty1, ty2))
+
+        self.rays = np.flatnonzero((t_in < t_out) & (t_in <= max_range))
+        ox, oy, dx, dy, t_in = ox[self.rays], oy[self.rays], dx[self.rays], dy[self.rays], t_in[self.rays]
+        ex, ey = ox + t_in * dx, oy + t_in * dy # entry points
+
+        self.col = np.clip(np.floor(ex / cell), 0, cols - 1).astype(np.intp)
+        self.row = np.clip(np.floor(ey / cell), 0, rows - 1).astype(np.intp)
+        self.step_col = np.where(dx > 0, 1, -1)
+        self.step_row = np.where(dy > 0, 1, -1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # distance along the ray to the next vertical and horizontal grid line, and between grid lines
+            self.next_x = np.where(dx != 0, ((self.col + (dx > 0)) * cell - ox) / dx, np.inf)
+            self.next_y = np.where(dy != 0, ((self.row + (dy > 0)) * cell - oy) / dy, np.inf)
+            self.delta_x = np.where(dx != 0, cell / np.abs(dx), np.inf)
+            self.delta_y = np.where(dy != 0, cell / np.abs(dy), np.inf)
+        self.t_enter = t_in
+        self.t_exit = np.minimum(self.next_x, self.next_y)
+
+    def __bool__(self) -> bool:
+        return len(self.rays) > 0
+
+    def advance(self, done: np.ndarray = None) -> None:
+        """drops the rays marked done, then moves every other ray into its next cell.
+        rays which leave the grid or pass max_range are dropped as well"""
+        keep = np.ones(len(self.rays), dtype=bool) if done is None else ~done
+        along_x = self.next_x < self.next_y
+
+        self.t_enter = self.t_exit
+        self.col = self.col + np.where(along_x, self.step_col, 0)
+        self.row = self.row + np.where(along_x, 0, self.step_row)
+        self.next_x = np.where(along_x, self.next_x + self.delta_x, self.next_x)
+        self.next_y = np.where(along_x, self.next_y, self.next_y + self.delta_y)
+        self.t_exit = np.minimum(self.next_x, self.next_y)
+
+        keep &= (self.col >= 0) & (self.col < self.cols) & (self.row >= 0) & (self.row < self.rows) & (self.t_enter <= self.max_range)
+        for name in ("rays", "col", "row", "step_col", "step_row", "next_x", "next_y", "delta_x", "delta_y", "t_enter", "t_exit"):
+            setattr(self, name, getattr(self, name)[keep])
+
+
+def march_raster(occupancy: np.ndarray, x: np.ndarray, y: np.ndarray, heading: np.ndarray, angles: Sequence[float], max_range: float) -> np.ndarray:
+    """marches every beam of every pose through exactly the pixels it crosses until one of them is occupied
+
+    Args:
+        occupancy (np.ndarray): boolean grid indexed [y, x], e.g. from Grids.occupancy_from_surface
+        x (np.ndarray): x coordinates of the poses
+        y (np.ndarray): y coordinates of the poses
+        heading (np.ndarray): headings of the poses
+        angles (Sequence[float]): beam angles, relative to the heading
+        max_range (float): length of each beam
+
+    Returns:
+        np.ndarray: (poses, beams) array of distances to where each beam enters its first wall pixel. -1 where it hits nothing
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    dx, dy = beam_directions(np.atleast_1d(heading), angles)
+    N, B = dx.shape
+    rows, cols = occupancy.shape
+    flat = occupancy.ravel()
+
+    ranges = np.full(N * B, -1.0)
+    walk = GridWalk(np.repeat(x, B), np.repeat(y, B), dx.ravel(), dy.ravel(), 1, cols, rows, max_range)
+    while walk:
+        found = flat[walk.row * cols + walk.col]
+        ranges[walk.rays[found]] = walk.t_enter[found]
+        walk.advance(found)
+
+    return ranges.reshape(N, B)
@@ -0,0 +1,206 @@
+"""append-only binary logs of a run, and a driver which replays them through the filter without a window
+
+layout:
+    8 bytes   magic, b"PFLOG\\0\\0\\0"
+    4 bytes   format version, little endian uint32
+    4 bytes   header length, little endian uint32
+    header    utf-8 json: map, laser and robot settings, and the true robot's starting pose
+    records   packed records of record_dtype, one per moving frame and one per true reading, until the end of the file
+
+a move record holds the keys held that frame, the odometry errors drawn for the true robot and its pose afterwards.
+a reading record holds the true robot's laser reading and its pose when it was taken, for a filter update. a global
+record is laid out the same, for a reading which started a search of the whole map instead
+"""
+import json
+import struct
+from time import time
+from typing import Dict, Iterator, List, Sequence, Tuple
+import numpy as np
+
+from Engine import LocalizationEngine
+from Laser import Laser
+from Raycast import walls_to_array
+
+MAGIC = b"PFLOG\0\0\0"
+VERSION = 1
+PREFIX = struct.Struct("<8sII")
+
+MOVE, READING, GLOBAL = 0, 1, 2
+FORWARD, CCW, CW = 1, 2, 4
+
+
+def record_dtype(beams: int) -> np.dtype:
+    """packed record layout for a laser with this many beams"""
+    return np.dtype([("time", "<f8"), ("kind", "u1"), ("keys", "u1"),
+                     ("x", "<f8"), ("y", "<f8"), ("angle", "<f8"),
+                     ("linear_noise", "<f8"), ("angular_noise", "<f8"),
+                     ("reading", "<f4", (beams,))])
+
+
+class Recorder:
+    """writes everything needed to replay an engine's run. attaches itself to the engine, which then reports
+    every moving frame and every true reading it senses
+    """
+    def __init__(self, path: str, engine: LocalizationEngine, buffer: int = 1024) -> None:
+        """
+        Args:
+            path (str): log file to create
+            engine (LocalizationEngine): engine to record
+            buffer (int, optional): records held in memory between writes. Defaults to 1024.
+        """
+        self.engine = engine
+        laser, robot = engine.true_laser, engine.true_robot
+        header = {
+            "created": time(),
+            "dims": [int(d) for d in engine.dims],
+            "walls": None if engine.walls is None else walls_to_array(engine.walls).tolist(),
+            "dt": engine.dt,
+            "angles": [float(a) for a in laser.angles],
+            "range": laser.range,
+            "sigma": laser.sigma,
+            "v": robot.v,
+            "omega": robot.o,
+            "start": [float(robot.position[0]), float(robot.position[1]), float(robot.angle)],
+        }
+        encoded = json.dumps(header).encode()
+
+        self.file = open(path, "wb")
+        self.file.write(PREFIX.pack(MAGIC, VERSION, len(encoded)))
+        self.file.write(encoded)
+        self.records = np.zeros(buffer, dtype=record_dtype(len(laser.angles)))
+        self.count = 0
+        engine.recorder = self
+
+    def move(self, forward: bool, ccw: bool, cw: bool) -> None:
+        """records a frame the true robot just moved in"""
+        robot = self.engine.true_robot
+        record = self._next(MOVE)
+        record["keys"] = forward * FORWARD | ccw * CCW | cw * CW
+        record["linear_noise"] = robot.linear.last_noise if forward else 0
+        record["angular_noise"] = robot.angular.last_noise if ccw != cw else 0
+        self._commit()
+
+    def reading(self, reading: Sequence[float], kind: int = READING) -> None:
+        """records a reading the true robot just took"""
+        record = self._next(kind)
+        record["reading"] = reading
+        self._commit()
+
+    def global_reading(self, reading: Sequence[float]) -> None:
+        """records a reading which started a global search, see LocalizationEngine.global_localize"""
+        self.reading(reading, GLOBAL)
+
+    def _next(self, kind: int) -> np.void:
+        robot = self.engine.true_robot
+        record = self.records[self.count]
+        record["time"] = time()
+        record["kind"] = kind
+        record["x"], record["y"] = robot.position
+        record["angle"] = robot.angle
+        return record
+
+    def _commit(self) -> None:
+        self.count += 1
+        if self.count == len(self.records):
+            self.flush()
+
+    def flush(self) -> None:
+        """writes the buffered records to the file"""
+        self.file.write(self.records[:self.count].tobytes())
+        self.file.flush()
+        self.count = 0
+
+    def close(self) -> None:
+        """flushes, closes the file and detaches from the engine"""
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        if self.engine.recorder is self:
+            self.engine.recorder = None
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_header(path: str) -> Tuple[Dict, int]:
+    """the json header of a log and the offset of its first record"""
+    with open(path, "rb") as f:
+        magic, version, length = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a log file")
+        if version > VERSION:
+            raise ValueError(f"{path} has log format version {version}, this code reads up to {VERSION}")
+        return json.loads(f.read(length)), PREFIX.size + length
+
+
+def read_records(path: str, chunk: int = 4096) -> Iterator[np.ndarray]:
+    """the records of a log, at most chunk at a time. a record cut off by a crash while writing is dropped"""
+    header, offset = read_header(path)
+    dtype = record_dtype(len(header["angles"]))
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            data = f.read(chunk * dtype.itemsize)
+            count = len(data) // dtype.itemsize
+            if not count:
+                return
+            yield np.frombuffer(data, dtype=dtype, count=count)
+
+
+def engine_from_log(path: str, laser_method: str = "segments", **kwargs) -> LocalizationEngine:
+    """builds a filter on the map, laser and time step stored in a log's header
+
+    Args:
+        path (str): log written by a Recorder
+        laser_method (str, optional): sensing method of the particles. Defaults to "segments".
+        **kwargs: other arguments of the engine
+
+    Returns:
+        LocalizationEngine: the filter, with its true robot at the recorded starting pose
+    """
+    header, _ = read_header(path)
+    if header["walls"] is None:
+        raise ValueError(f"{path} was recorded without wall segments, build an engine for its map instead")
+    walls = [((x1, y1), (x2, y2)) for x1, y1, x2, y2 in header["walls"]]
+    if kwargs.get("sim_laser") is None:
+        kwargs["sim_laser"] = Laser(header["range"], uncertainty=header["sigma"], angles=header["angles"], walls=walls,
+                                    method=laser_method, cache=kwargs.pop("scan_cache", None))
+    return LocalizationEngine(walls, header["start"], tuple(header["dims"]), dt=header["dt"], **kwargs)
+
+
+def replay(path: str, engine: LocalizationEngine = None, chunk: int = 4096) -> List[Tuple[float, float]]:
+    """feeds a log through a filter as fast as possible. the true robot follows its recorded poses and the particles
+    are scored against the recorded readings, so every variant of the filter sees exactly the same run
+
+    Args:
+        path (str): log written by a Recorder
+        engine (LocalizationEngine, optional): filter to run. Defaults to engine_from_log(path).
+        chunk (int, optional): records read at once, which bounds the memory used. Defaults to 4096.
+
+    Returns:
+        List[Tuple[float, float]]: LocalizationEngine.pose_error after every recorded reading
+    """
+    if engine is None:
+        engine = engine_from_log(path)
+
+    errors = []
+    true_robot = engine.true_robot
+    for records in read_records(path, chunk):
+        kinds, keys = records["kind"].tolist(), records["keys"].tolist()
+        for i, kind in enumerate(kinds):
+            if kind == MOVE:
+                engine.move_particles(bool(keys[i] & FORWARD), bool(keys[i] & CCW), bool(keys[i] & CW))
+                continue
+            record = records[i]
+            true_robot.position = (float(record["x"]), float(record["y"]))
+            true_robot.angle = float(record["angle"])
+            if kind == GLOBAL:
+                engine.global_localize(true_reading=record["reading"].astype(float).tolist())
+                continue
+            engine.update(record["reading"].astype(float).tolist())
+            errors.append(engine.pose_error())
+    return errors
@@ -0,0 +1,212 @@
+from typing import List, Tuple
+import numpy as np
+import pygame
+
+from Maps import draw_robot
+from Particles import ParticleSet
+from Robot import Robot
+
+MODES = ("auto", "sprites", "decimate", "splat", "heatmap")
+# half the size of what Maps.draw_robot paints around a robot's position, including the line's width
+SPRITE_RADIUS = 11
+SPLAT_COLOR = (220, 70, 70)
+HEAT_LOW, HEAT_HIGH = (255, 215, 215), (150, 0, 0)
+
+
+class Panel:
+    """one side of the screen: a background without robots, a working copy robots are drawn onto,
+    and the tiles of the working copy which differ from the background
+    """
+    def __init__(self, background: pygame.Surface, location: Tuple[int, int], tile: int) -> None:
+        self.background = background
+        self.surface = background.copy()
+        self.location = location
+        self.tile = tile
+        self.W, self.H = background.get_size()
+        self.rows, self.cols = -(-self.H // tile), -(-self.W // tile)
+        self.dirty = np.ones((self.rows, self.cols), dtype=bool) # everything is drawn on the first frame
+        self.drawn = np.zeros_like(self.dirty)
+
+    def runs(self, tiles: np.ndarray) -> List[pygame.Rect]:
+        """surface rects covering the marked tiles, one per horizontal run of tiles"""
+        rects = []
+        padded = np.zeros((self.rows, self.cols + 2), dtype=np.int8)
+        padded[:, 1:-1] = tiles
+        edges = np.diff(padded, axis=1)
+        for row, start in zip(*np.nonzero(edges == 1)):
+            stop = np.argmax(edges[row, start:] == -1) + start
+            rect = pygame.Rect(start * self.tile, row * self.tile, (stop - start) * self.tile, self.tile)
+            rects.append(rect.clip(pygame.Rect(0, 0, self.W, self.H)))
+        return rects
+
+    def mark(self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray) -> None:
+        """marks the tiles under boxes no wider than a tile, which can only touch the tiles of their corners"""
+        c0 = np.clip(np.floor(x0) // self.tile, 0, self.cols - 1).astype(np.intp)
+        c1 = np.clip(np.floor(x1) // self.tile, 0, self.cols - 1).astype(np.intp)
+        r0 = np.clip(np.floor(y0) // self.tile, 0, self.rows - 1).astype(np.intp)
+        r1 = np.clip(np.floor(y1) // self.tile, 0, self.rows - 1).astype(np.intp)
+        for r, c in ((r0, c0), (r0, c1), (r1, c0), (r1, c1)):
+            self.drawn[r, c] = True
+
+    def mark_pixels(self, mask: np.ndarray) -> None:
+        """marks the tiles holding any pixel set in a [y, x] mask of the surface"""
+        padded = np.zeros((self.rows * self.tile, self.cols * self.tile), dtype=bool)
+        padded[:self.H, :self.W] = mask
+        self.drawn |= padded.reshape(self.rows, self.tile, self.cols, self.tile).any(axis=(1, 3))
+
+    def restore(self) -> None:
+        """wipes the robots drawn last frame off the working copy"""
+        for rect in self.runs(self.dirty):
+            self.surface.blit(self.background, rect, area=rect)
+
+    def present(self, Map: pygame.Surface) -> List[pygame.Rect]:
+        """copies the tiles changed since last frame to the screen and returns their screen rects"""
+        changed = self.dirty | self.drawn
+        rects = []
+        for rect in self.runs(changed):
+            rects.append(Map.blit(self.surface, rect.move(self.location), area=rect))
+        self.dirty, self.drawn = self.drawn, np.zeros_like(self.drawn)
+        return rects
+
+
+class ParticleRenderer:
+    """draws the true robot and the particles each frame without copying the whole map or drawing robot by robot.
+    the map is split into tiles, and only tiles which had a robot on them last frame or have one now are
+    restored, redrawn and sent to pygame.display.update
+
+    modes:
+        "sprites" draws every particle like Maps.draw_robot
+        "decimate" draws an evenly spaced subset of at most max_drawn particles like Maps.draw_robot
+        "splat" writes a small dot per particle straight into the surface's pixels
+        "heatmap" shades cells of the map by how many particles are in them
+        "auto" picks sprites up to max_drawn particles, splat up to heatmap_threshold, then heatmap
+    """
+    def __init__(self, Map: pygame.Surface, true_background: pygame.Surface, sim_background: pygame.Surface,
+                 true_location: Tuple[int, int], sim_location: Tuple[int, int], mode: str = "auto", max_drawn: int = 1000,
+                 heatmap_threshold: int = 50000, heat_cell: int = 6, tile: int = 32) -> None:
+        """
+        Args:
+            Map (pygame.Surface): main pygame surface the panels are blit onto
+            true_background (pygame.Surface): left panel with walls and without robots. drawing on it shows after invalidate
+            sim_background (pygame.Surface): right panel with walls and without robots. drawing on it shows after invalidate
+            true_location (Tuple[int, int]): where the left panel is blit
+            sim_location (Tuple[int, int]): where the right panel is blit
+            mode (str, optional): one of MODES. Defaults to "auto".
+            max_drawn (int, optional): particles drawn as robots in decimate mode, and the auto sprite limit. Defaults to 1000.
+            heatmap_threshold (int, optional): particle count above which auto switches to the heatmap. Defaults to 50000.
+            heat_cell (int, optional): side of a heatmap cell in pixels. Defaults to 6.
+            tile (int, optional): side of a dirty tile in pixels. Defaults to 32.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode!r}")
+        if tile < 2 * SPRITE_RADIUS + 1 or heat_cell > tile:
+            raise ValueError("tiles must be wider than a robot and a heatmap cell")
+
+        self.Map = Map
+        self.true_panel = Panel(true_background, true_location, tile)
+        self.sim_panel = Panel(sim_background, sim_location, tile)
+        self.mode = mode
+        self.max_drawn = max_drawn
+        self.heatmap_threshold = heatmap_threshold
+        self.heat_cell = heat_cell
+
+    def invalidate(self) -> None:
+        """redraws both panels in full next frame, after the backgrounds were drawn on"""
+        for panel in (self.true_panel, self.sim_panel):
+            panel.dirty[:] = True
+
+    def resolve(self, N: int) -> str:
+        """mode used for N particles"""
+        if self.mode != "auto":
+            return self.mode
+        if N <= self.max_drawn:
+            return "sprites"
+        return "splat" if N <= self.heatmap_threshold else "heatmap"
+
+    def draw(self, true_robot: Robot, particles: ParticleSet) -> List[pygame.Rect]:
+        """draws one frame onto Map
+
+        Args:
+            true_robot (Robot): drawn on the left panel
+            particles (ParticleSet): drawn on the right panel
+
+        Returns:
+            List[pygame.Rect]: screen rects which changed, for pygame.display.update
+        """
+        for panel in (self.true_panel, self.sim_panel):
+            panel.restore()
+
+        self._sprites(self.true_panel, [true_robot], true_robot=True)
+
+        mode = self.resolve(len(particles))
+        if mode == "heatmap":
+            self._heatmap(self.sim_panel, particles.x, particles.y)
+        elif mode == "splat":
+            self._splat(self.sim_panel, particles.x, particles.y)
+        else:
+            chosen = np.arange(len(particles))
+            if mode == "decimate" and len(particles) > self.max_drawn:
+                chosen = np.linspace(0, len(particles) - 1, self.max_drawn).astype(np.intp)
+            self._sprites(self.sim_panel, (particles[i] for i in chosen), true_robot=False)
+
+        return self.true_panel.present(self.Map) + self.sim_panel.present(self.Map)
+
+    def _sprites(self, panel: Panel, robots, true_robot: bool) -> None:
+        positions = []
+        for robot in robots:
+            draw_robot(panel.surface, robot, true_robot=true_robot)
+            positions.append(robot.position)
+        if positions:
+            x, y = np.asarray(positions, dtype=float).T
+            panel.mark(x - SPRITE_RADIUS, y - SPRITE_RADIUS, x + SPRITE_RADIUS, y + SPRITE_RADIUS)
+
+    def _splat(self, panel: Panel, x: np.ndarray, y: np.ndarray) -> None:
+        col, row = np.floor(x).astype(np.intp), np.floor(y).astype(np.intp)
+        inside = (col >= 0) & (row >= 0) & (col < panel.W) & (row < panel.H)
+
+        # a 3x3 dot per particle, grown from a mask of the particles' pixels
+        dots = np.zeros((panel.H, panel.W), dtype=bool)
+        dots.ravel()[row[inside] * panel.W + col[inside]] = True
+        grown = dots.copy()
+        grown[1:] |= dots[:-1]
+        grown[:-1] |= dots[1:]
+        dots = grown.copy()
+        dots[:, 1:] |= grown[:, :-1]
+        dots[:, :-1] |= grown[:, 1:]
+
+        pixels = pygame.surfarray.pixels2d(panel.surface).T # [y, x] view, locks the surface until deleted
+        pixels[dots] = panel.surface.map_rgb(SPLAT_COLOR)
+        del pixels
+        panel.mark_pixels(dots)
+
+    def _heatmap(self, panel: Panel, x: np.ndarray, y: np.ndarray) -> None:
+        cell = self.heat_cell
+        cols, rows = -(-panel.W // cell), -(-panel.H // cell)
+        col, row = np.floor(x / cell).astype(np.intp), np.floor(y / cell).astype(np.intp)
+        inside = (col >= 0) & (row >= 0) & (col < cols) & (row < rows)
+        counts = np.bincount(row[inside] * cols + col[inside], minlength=rows * cols).reshape(rows, cols)
+        if not counts.any():
+            return
+
+        # log scale, so a few dense clusters don't wash out everything else
+        level = (np.log1p(counts) / np.log1p(counts.max()))[..., None]
+        colors = ((1 - level) * HEAT_LOW + level * HEAT_HIGH).astype(np.uint8)
+        occupied = counts > 0
+
+        mapped = _map_rgb(panel.surface, colors)
+        image = np.repeat(np.repeat(mapped, cell, axis=0), cell, axis=1)[:panel.H, :panel.W]
+        mask = np.repeat(np.repeat(occupied, cell, axis=0), cell, axis=1)[:panel.H, :panel.W]
+        pixels = pygame.surfarray.pixels2d(panel.surface).T # [y, x] view
+        pixels[mask] = image[mask]
+        del pixels
+        panel.mark_pixels(mask)
+
+
+def _map_rgb(surface: pygame.Surface, colors: np.ndarray) -> np.ndarray:
+    """Surface.map_rgb over an array of colors, shaped (..., 3)"""
+    colors = colors.astype(np.uint32)
+    shifts, losses = surface.get_shifts(), surface.get_losses()
+    mapped = np.zeros(colors.shape[:-1], dtype=np.uint32)
+    for channel in range(3):
+        mapped |= (colors[..., channel] >> losses[channel]) << shifts[channel]
+    return mapped
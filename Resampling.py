@@ -0,0 +1,178 @@
+from math import pi
+from statistics import NormalDist
+from typing import Callable, Dict
+import numpy as np
+
+
+def normalize(weights: np.ndarray) -> np.ndarray:
+    """scales weights to sum to 1. all zero weights become uniform"""
+    weights = np.asarray(weights, dtype=float)
+    total = weights.sum()
+    if not total > 0:
+        return np.full(len(weights), 1 / len(weights))
+    return weights / total
+
+
+def _cumulative(weights: np.ndarray) -> np.ndarray:
+    cumulative = np.cumsum(normalize(weights))
+    cumulative[-1] = 1 # guards searchsorted against rounding in the sum
+    return cumulative
+
+
+def multinomial(weights: np.ndarray, n: int = None) -> np.ndarray:
+    """independent draws, like the old cumulative sum scan in redistribute
+
+    Args:
+        weights (np.ndarray): particle weights, need not be normalized
+        n (int, optional): number of draws. Defaults to len(weights).
+
+    Returns:
+        np.ndarray: indices of the chosen parents
+    """
+    n = len(weights) if n is None else n
+    return np.searchsorted(_cumulative(weights), np.random.random(n), side="right")
+
+
+def systematic(weights: np.ndarray, n: int = None) -> np.ndarray:
+    """low variance resampling. one random offset, then n evenly spaced pointers into the cumulative weights
+
+    Args:
+        weights (np.ndarray): particle weights, need not be normalized
+        n (int, optional): number of draws. Defaults to len(weights).
+
+    Returns:
+        np.ndarray: indices of the chosen parents, in ascending order
+    """
+    n = len(weights) if n is None else n
+    pointers = (np.random.random() + np.arange(n)) / n
+    return np.searchsorted(_cumulative(weights), pointers, side="right")
+
+
+def systematic_rows(weights: np.ndarray, n: int = None) -> np.ndarray:
+    """systematic resampling of every row of a (filters, particles) weight matrix at once, with one offset per row
+
+    Args:
+        weights (np.ndarray): normalized weights of each filter's particles, rows summing to 1
+        n (int, optional): draws per row. Defaults to the number of columns.
+
+    Returns:
+        np.ndarray: (filters, n) indices of the chosen parents within each row
+    """
+    T, N = weights.shape
+    n = N if n is None else n
+    # stacking the rows' cumulative weights end to end as 1, 2, ... T turns every row into one searchsorted
+    cumulative = np.cumsum(weights, axis=1)
+    cumulative[:, -1] = 1
+    cumulative += np.arange(T)[:, None]
+    pointers = (np.random.random((T, 1)) + np.arange(n)) / n + np.arange(T)[:, None]
+    flat = np.searchsorted(cumulative.ravel(), pointers.ravel(), side="right")
+    return np.minimum(flat.reshape(T, n) - np.arange(T)[:, None] * N, N - 1)
+
+
+def stratified(weights: np.ndarray, n: int = None) -> np.ndarray:
+    """one independent draw inside each of n equal strata of the cumulative weights
+
+    Args:
+        weights (np.ndarray): particle weights, need not be normalized
+        n (int, optional): number of draws. Defaults to len(weights).
+
+    Returns:
+        np.ndarray: indices of the chosen parents, in ascending order
+    """
+    n = len(weights) if n is None else n
+    pointers = (np.random.random(n) + np.arange(n)) / n
+    return np.searchsorted(_cumulative(weights), pointers, side="right")
+
+
+def residual(weights: np.ndarray, n: int = None) -> np.ndarray:
+    """keeps floor(n * w) copies of every particle deterministically and draws the rest from the leftover weight
+
+    Args:
+        weights (np.ndarray): particle weights, need not be normalized
+        n (int, optional): number of draws. Defaults to len(weights).
+
+    Returns:
+        np.ndarray: indices of the chosen parents
+    """
+    n = len(weights) if n is None else n
+    expected = normalize(weights) * n
+    copies = np.floor(expected).astype(np.intp)
+    kept = np.repeat(np.arange(len(expected)), copies)
+
+    remaining = n - len(kept)
+    if remaining == 0:
+        return kept
+    return np.concatenate((kept, multinomial(expected - copies, remaining)))
+
+
+RESAMPLERS: Dict[str, Callable[[np.ndarray, int], np.ndarray]] = {
+    "multinomial": multinomial,
+    "systematic": systematic,
+    "stratified": stratified,
+    "residual": residual,
+}
+
+
+class KLDSampler:
+    """KLD-sampling (Fox, 2003). the number of particles after each resample is chosen so that, with probability 1 - delta,
+    the KL divergence between the sampled and the true posterior stays below epsilon. the bound grows with the number of
+    occupied (x, y, heading) histogram bins, so a lost filter gets many particles and a converged one only a few
+    """
+    def __init__(self, min_n: int = 50, max_n: int = 10000, epsilon: float = .05, delta: float = .01,
+                 bin_size: float = 20, angle_bin: float = pi/9) -> None:
+        """
+        Args:
+            min_n (int, optional): fewest particles to keep. Defaults to 50.
+            max_n (int, optional): most particles to keep, also used when the filter scatters. Defaults to 10000.
+            epsilon (float, optional): allowed KL divergence. Defaults to .05.
+            delta (float, optional): probability of exceeding epsilon. Defaults to .01.
+            bin_size (float, optional): side of a position bin in pixels. Defaults to 20.
+            angle_bin (float, optional): width of a heading bin. Defaults to pi/9.
+        """
+        self.min_n = min_n
+        self.max_n = max_n
+        self.epsilon = epsilon
+        self.z = NormalDist().inv_cdf(1 - delta)
+        self.bin_size = bin_size
+        self.angle_bin = angle_bin
+
+    def sample_size(self, k: np.ndarray) -> np.ndarray:
+        """particles needed when k bins are occupied, using the Wilson-Hilferty approximation of the chi square quantile"""
+        k = np.maximum(np.asarray(k, dtype=float), 2)
+        a = 2 / (9 * (k - 1))
+        n = (k - 1) / (2 * self.epsilon) * (1 - a + np.sqrt(a) * self.z) ** 3
+        return np.clip(np.ceil(n), self.min_n, self.max_n).astype(np.intp)
+
+    def bins(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray) -> np.ndarray:
+        """single integer id of the histogram bin of each pose"""
+        bx = np.floor(x / self.bin_size).astype(np.int64)
+        by = np.floor(y / self.bin_size).astype(np.int64)
+        ba = np.floor((angle % (2*pi)) / self.angle_bin).astype(np.int64)
+        # ids only need to be distinct, so the three bins are packed into one 64 bit key
+        return (bx << 40) ^ (by << 20) ^ ba
+
+    def resample(self, weights: np.ndarray, x: np.ndarray, y: np.ndarray, angle: np.ndarray) -> np.ndarray:
+        """draws parents one after another until the sample size bound of the bins seen so far is met
+
+        Args:
+            weights (np.ndarray): particle weights, need not be normalized
+            x (np.ndarray): x coordinates of the particles
+            y (np.ndarray): y coordinates of the particles
+            angle (np.ndarray): headings of the particles
+
+        Returns:
+            np.ndarray: indices of the chosen parents, between min_n and max_n of them
+        """
+        # draw the largest possible set up front, then find the prefix where the sequential algorithm would stop
+        parents = multinomial(weights, self.max_n)
+        ids = self.bins(x[parents], y[parents], angle[parents])
+
+        _, first = np.unique(ids, return_index=True)
+        new_bin = np.zeros(self.max_n, dtype=bool)
+        new_bin[first] = True
+        occupied = np.cumsum(new_bin)
+
+        drawn = np.arange(1, self.max_n + 1)
+        done = np.flatnonzero(drawn >= self.sample_size(occupied))
+        n = drawn[done[0]] if len(done) else self.max_n
+        return parents[:n]
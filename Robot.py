@@ -7,7 +7,7 @@ class Robot:
     """class which allows for simulating where the robot thinks it is. 
     Also allows for different levels of errors in the measurements
     """
-    def __init__(self, linear: Linear, angular: Angular, position: Tuple[int, int]=(0, 0), angle: int=0, v: float=.5, omega: float=.05, bounds: Tuple[int, int]=(540, 694)) -> None:
+    def __init__(self, linear: Linear, angular: Angular, position: Tuple[int, int]=(0, 0), angle: int=0, v: float=.5, omega: float=.05, bounds: Tuple[int, int]=None) -> None:
         self.position = position # location
         self.angle = angle # turn angle, 0 degrees is to the right
         
@@ -16,7 +16,7 @@ class Robot:
         
         self.v = v # speed
         self.o = omega # angular velocity
-        self.bounds = bounds
+        self.bounds = bounds # width and height of the map the robot cannot leave, None for no limit
     
     def drive(self, dt):
         """simulates driving a certain distance based on the object's velocity parameter and angle.
@@ -32,7 +32,7 @@ class Robot:
         
         new_position = np.add(self.position, dl)
         new_x, new_y = new_position
-        if new_x < 0 or new_y < 0 or new_x >= self.bounds[0] or new_y >= self.bounds[1]:
+        if self.bounds is not None and (new_x < 0 or new_y < 0 or new_x >= self.bounds[0] or new_y >= self.bounds[1]):
             return
         self.position = new_position
     
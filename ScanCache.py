@@ -0,0 +1,148 @@
+"""least recently used cache of noise free laser scans, keyed by quantized pose
+
+after resampling most particles are jittered copies of a few parents, so in a converged filter many of them fall
+into the same small cell of (x, y, heading). every pose in a cell gets the scan cast once from the cell's center,
+and the laser adds fresh noise to each copy. the error this costs is bounded by the cell size: half a cell of
+position and half a heading bin, which grows with the range of the beam.
+
+before the filter converges nearly every particle has a cell of its own, and looking each cell up would cost a
+dictionary probe per particle while saving almost no casts. such lookups skip the cache and cast every pose exactly
+"""
+import itertools
+from collections import OrderedDict
+from math import pi
+from typing import Callable, Hashable, Tuple
+import numpy as np
+
+# bits of each quantized coordinate in a pose code. cells further than 2**20 from the origin alias
+_BITS = 21
+_OFFSET = 1 << (_BITS - 1)
+
+
+class ScanCache:
+    """bounded map from (laser configuration, quantized pose) to the noise free ranges cast from it. a laser's
+    configuration includes its map version, so scans of a map the laser no longer senses are never returned.
+
+    lookups move entries to the back of an OrderedDict and inserts evict from the front, so the least recently
+    used scans go first. configurations are kept in least recently used order too, and once there are too many
+    the oldest goes with all of its scans. hits, misses and evictions are counted over the cache's lifetime
+    """
+    def __init__(self, capacity: int = 50000, cell: float = 4, heading: float = pi/90, max_configs: int = 16,
+                 bypass: float = .9) -> None:
+        """
+        Args:
+            capacity (int, optional): most scans held. Defaults to 50000.
+            cell (float, optional): side of a position cell in pixels. Defaults to 4.
+            heading (float, optional): width of a heading bin in radians. Defaults to pi/90, 2 degrees.
+            max_configs (int, optional): most laser configurations held. Defaults to 16.
+            bypass (float, optional): lookups where the distinct cells are more than this share of the poses cast
+                every pose directly. Defaults to .9.
+        """
+        self.entries: "OrderedDict[Tuple[int, int], np.ndarray]" = OrderedDict()
+        self.capacity = capacity
+        self.cell = cell
+        self.bins = max(int(round(2*pi / heading)), 1)
+        self.heading = 2*pi / self.bins
+        self.max_configs = max_configs
+        self.bypass = bypass
+        self.configs: "OrderedDict[Hashable, int]" = OrderedDict() # laser configuration -> id used in the keys
+        self.ids = itertools.count() # config ids are never reused, so an evicted config's id names nothing
+        self.hits = 0 # poses answered from the cache
+        self.misses = 0 # poses cast, stored or bypassed
+        self.bypassed = 0 # poses cast directly by lookups that skipped the cache
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """share of poses answered without casting, 0 before the first lookup"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def invalidate(self) -> None:
+        """forgets every scan. a laser whose map changed only needs Laser.map_changed, which leaves its old
+        scans to be evicted
+        """
+        self.entries.clear()
+        self.configs.clear()
+
+    def _config_id(self, config: Hashable) -> int:
+        config_id = self.configs.get(config)
+        if config_id is not None:
+            self.configs.move_to_end(config)
+            return config_id
+        if len(self.configs) >= self.max_configs:
+            _, stale = self.configs.popitem(last=False)
+            keys = [key for key in self.entries if key[0] == stale]
+            for key in keys:
+                del self.entries[key]
+            self.evictions += len(keys)
+        config_id = self.configs[config] = next(self.ids)
+        return config_id
+
+    def quantize(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray) -> np.ndarray:
+        """one int64 code per pose, equal for poses in the same cell and heading bin"""
+        col = np.floor(np.asarray(x, dtype=float) / self.cell).astype(np.int64) + _OFFSET
+        row = np.floor(np.asarray(y, dtype=float) / self.cell).astype(np.int64) + _OFFSET
+        heading = np.floor(np.asarray(angle, dtype=float) % (2*pi) / self.heading).astype(np.int64) % self.bins
+        return (col << (2 * _BITS)) | (row << _BITS) | heading
+
+    def centers(self, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """x, y and heading at the middle of the cells and bins of codes"""
+        mask = (1 << _BITS) - 1
+        col = (codes >> (2 * _BITS)) - _OFFSET
+        row = ((codes >> _BITS) & mask) - _OFFSET
+        heading = codes & mask
+        return (col + .5) * self.cell, (row + .5) * self.cell, (heading + .5) * self.heading
+
+    def lookup(self, config: Hashable, x: np.ndarray, y: np.ndarray, angle: np.ndarray,
+               cast: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]) -> np.ndarray:
+        """noise free scans of many poses. the cells missing from the cache are cast together in one call. every
+        distinct cell costs a dictionary probe in python, so lookups with nearly as many cells as poses bypass the cache
+
+        Args:
+            config (Hashable): everything about the laser which changes its ranges, see Laser.config
+            x (np.ndarray): x coordinates
+            y (np.ndarray): y coordinates
+            angle (np.ndarray): headings
+            cast (Callable): noise free (poses, beams) ranges of x, y and heading arrays
+
+        Returns:
+            np.ndarray: (poses, beams) ranges, a new array the caller may change
+        """
+        if not len(x):
+            return cast(x, y, angle)
+        codes, inverse = np.unique(self.quantize(x, y, angle), return_inverse=True)
+        if len(codes) > self.bypass * len(x):
+            self.misses += len(x)
+            self.bypassed += len(x)
+            return cast(x, y, angle)
+        config_id = self._config_id(config)
+        entries = self.entries
+
+        scans = [None] * len(codes)
+        missing = []
+        for i, code in enumerate(codes.tolist()):
+            key = (config_id, code)
+            scan = entries.get(key)
+            if scan is None:
+                missing.append(i)
+            else:
+                entries.move_to_end(key)
+                scans[i] = scan
+
+        if missing:
+            cx, cy, ca = self.centers(codes[missing])
+            for i, scan in zip(missing, cast(cx, cy, ca)):
+                scans[i] = scan = scan.copy() # a row alone, so evicting it frees it
+                entries[(config_id, int(codes[i]))] = scan
+            overflow = len(entries) - self.capacity
+            for _ in range(max(overflow, 0)):
+                entries.popitem(last=False)
+            self.evictions += max(overflow, 0)
+
+        self.misses += len(missing)
+        self.hits += len(inverse) - len(missing)
+        return np.array(scans, dtype=float).reshape(len(codes), -1)[inverse.ravel()]
@@ -0,0 +1,77 @@
+from math import pi
+
+
+class UpdateScheduler:
+    """decides when to run a sense / weight / resample cycle, from the motion since the last one.
+
+    an update is wanted once the robot has driven translation pixels or turned rotation radians since the last
+    update, or after max_interval frames whatever it did. a robot standing still is never rescanned before that,
+    since its scan would only repeat what the filter already knows.
+
+    with a budget, every frame earns that many seconds of compute, and a wanted update only runs once the earned
+    time covers what updates have been costing. idle frames can bank at most one update's worth, so the average
+    spent per frame stays near the budget
+    """
+    def __init__(self, translation: float = 5, rotation: float = pi/18, max_interval: int = 150, budget: float = None,
+                 smoothing: float = .2) -> None:
+        """
+        Args:
+            translation (float, optional): pixels driven which call for an update. Defaults to 5.
+            rotation (float, optional): radians turned which call for an update. Defaults to pi/18.
+            max_interval (int, optional): frames after which an update is wanted anyway, None for never. Defaults to 150.
+            budget (float, optional): seconds of update compute earned per frame, None for no limit. Defaults to None.
+            smoothing (float, optional): weight of the latest update in the running average of update cost. Defaults to .2.
+        """
+        self.translation = translation
+        self.rotation = rotation
+        self.max_interval = max_interval
+        self.budget = budget
+        self.smoothing = smoothing
+
+        self.distance = 0. # driven since the last update
+        self.turned = 0. # turned since the last update
+        self.frames = 0 # frames since the last update
+        self.cost = 0. # running average of update seconds
+        self.credit = 0. # seconds earned and not yet spent
+        self.deferred = 0 # frames where an update was wanted but not affordable
+
+    @property
+    def wanted(self) -> bool:
+        """whether enough happened since the last update to justify another"""
+        return (self.distance >= self.translation or self.turned >= self.rotation or
+                (self.max_interval is not None and self.frames >= self.max_interval))
+
+    def step(self, distance: float = 0, rotation: float = 0) -> bool:
+        """records one frame of motion
+
+        Args:
+            distance (float, optional): distance the odometry reports for this frame. Defaults to 0.
+            rotation (float, optional): angle the odometry reports for this frame, either direction. Defaults to 0.
+
+        Returns:
+            bool: whether to update now. call ran once the update is done
+        """
+        self.distance += abs(distance)
+        self.turned += abs(rotation)
+        self.frames += 1
+        if self.budget is not None:
+            self.credit = min(self.credit + self.budget, self.cost + self.budget)
+
+        if not self.wanted:
+            return False
+        if self.budget is not None and self.credit < self.cost:
+            self.deferred += 1
+            return False
+        return True
+
+    def ran(self, seconds: float = 0) -> None:
+        """records a finished update, wanted or forced, and starts accumulating motion again
+
+        Args:
+            seconds (float, optional): what the update cost. Defaults to 0.
+        """
+        self.cost = seconds if not self.cost else self.cost + self.smoothing * (seconds - self.cost)
+        if self.budget is not None:
+            self.credit = max(self.credit - seconds, 0)
+        self.distance = self.turned = 0.
+        self.frames = 0
@@ -1,19 +1,33 @@
-from math import dist, pi
-import random
-from time import sleep
+from time import perf_counter
 import numpy as np
 import pygame
 from typing import List, Tuple
+from Engine import DEFAULT_ANGLES, LocalizationEngine, redistribute
+from Estimation import Estimate
+from FreeSpace import FreeSpace
 from Laser import Laser
-from Maps import check_continue, check_movements, draw_robot, scatter_robots
+from LikelihoodField import LikelihoodField
+from MapFile import MapData
+from Maps import check_continue, check_movements
+from Profiling import Overlay, Profiler
+from Recording import Recorder
+from Renderer import ParticleRenderer
+from Resampling import KLDSampler
 from Robot import Robot
+from ScanCache import ScanCache
+from Scheduler import UpdateScheduler
+from Worker import FilterWorker
 from Odometry import Linear, Angular
 
 
 def simulation(Map: pygame.Surface, TrueSurface: pygame.Surface, SimSurface: pygame.Surface,
                true_surface_location: Tuple[int, int], sim_surface_location: Tuple[int, int],
                true_robot: Robot, WALL_COLOR: Tuple[int, int, int] = (0, 0, 0), exit_key=pygame.K_RETURN, N=100,
-               sim_odometry: Tuple[Linear, Angular] = None, sim_laser: Laser = None, true_laser: Laser = None):
+               sim_odometry: Tuple[Linear, Angular] = None, sim_laser: Laser = None, true_laser: Laser = None,
+               walls: List[Tuple[Tuple[int, int], Tuple[int, int]]] = None, laser_method: str = "pixel", sensor_model: str = "beam",
+               resampler: str = "systematic", kld: KLDSampler = None, workers: int = 0, map_data: MapData = None,
+               render_mode: str = "auto", background: bool = False, profiler: Profiler = None,
+               record: str = None, scatter: str = "free", scan_cache: ScanCache = None, scheduler: UpdateScheduler = None):
     """runs the main simulation on the 2 screens
 
     Args:
@@ -29,147 +43,173 @@ def simulation(Map: pygame.Surface, TrueSurface: pygame.Surface, SimSurface: pyg
         sim_odometry (Tuple[Linear, Angular], optional): odometry for error in simulation robots. Defaults to None.
         sim_laser (Laser, optional): laser sensor for simulation robots. Defaults to None.
         true_laser (Laser, optional): laser sensor for true robot. Defaults to None.
+        walls (List[Tuple[Tuple[int, int], Tuple[int, int]]], optional): wall segments from Maps.draw_walls. Defaults to None.
+        laser_method (str, optional): sensing method of the default laser, see Laser.METHODS. Defaults to "pixel".
+        sensor_model (str, optional): "beam" compares ray cast readings, "likelihood" scores particles against a
+            distance transform of the walls without ray casting them. Defaults to "beam".
+        resampler (str, optional): resampling scheme from Resampling.RESAMPLERS. Defaults to "systematic".
+        kld (KLDSampler, optional): adapts the number of particles to the filter's uncertainty. N is then only the
+            starting count. Defaults to None.
+        workers (int, optional): processes for the measurement step, needs a segment or raster laser or the likelihood model.
+            Defaults to 0, weighing in this process.
+        map_data (MapData, optional): map loaded by MapFile.load_map. supplies the walls and the likelihood field's
+            distance grid when they are not given. Defaults to None.
+        render_mode (str, optional): how particles are drawn, see Renderer.MODES. Defaults to "auto".
+        background (bool, optional): run the filter on a Worker.FilterWorker thread, so the window keeps drawing the
+            last finished estimate while an update is computed. Defaults to False.
+        profiler (Profiler, optional): records time and work per stage, and shows the last update in an overlay.
+            Defaults to None, recording nothing.
+        record (str, optional): log the run to this file, for Recording.replay. Defaults to None.
+        scatter (str, optional): where scattered particles go, see Engine.SCATTER_MODES. the free space is flood filled
+            from the true robot's start on map_data, the walls or TrueSurface. Defaults to "free".
+        scan_cache (ScanCache, optional): cache for the default laser, so particles in the same small cell share one
+            cast. Defaults to None.
+        scheduler (UpdateScheduler, optional): decides when the filter updates from the robot's motion. SPACE forces
+            an update on top of it. Defaults to UpdateScheduler().
     """
 
-    redistribute_frequency, RF = 1000, 1000
-    
     hint = pygame.font.SysFont("Monaco", 25)
     hint_box = hint.render(
-        "move with W, A, D. estimate location with SPACE.", True, (200, 200, 200))
+        "move with W, A, D. force an update with SPACE.", True, (200, 200, 200))
 
     Map.blit(TrueSurface, true_surface_location)
     Map.blit(SimSurface, sim_surface_location)
     true_surface_blank = TrueSurface.copy()
     sim_surface_blank = SimSurface.copy()
 
-    if sim_odometry is None:
-        sim_odometry = (Linear(0, .01), Angular(0, .005))
-    if sim_laser is None:
-        sim_laser = Laser(500, true_surface_blank, WALL_COLOR=WALL_COLOR, angles=(
-            0, pi/12, pi/6, pi/4, -pi/12, -pi/6, -pi/4))
-    if true_laser is None:
-        true_laser = sim_laser
+    if map_data is not None and walls is None:
+        walls = map_data.wall_list()
 
-    sim_robots = [Robot(*sim_odometry) for _ in range(N)]
-    scatter_robots(sim_robots, TrueSurface.get_size())
+    if sim_laser is None:
+        sim_laser = Laser(500, true_surface_blank, WALL_COLOR=WALL_COLOR, angles=DEFAULT_ANGLES, walls=walls, method=laser_method,
+                          cache=scan_cache)
+
+    field = None
+    if sensor_model == "likelihood" and map_data is not None and map_data.distance is not None:
+        field = LikelihoodField(map_data.distance)
+    elif sensor_model == "likelihood":
+        field = LikelihoodField.from_walls(walls, TrueSurface.get_size()) if walls is not None else \
+            LikelihoodField.from_surface(true_surface_blank, WALL_COLOR)
+
+    free_space = None
+    if scatter != "uniform":
+        if map_data is not None:
+            free_space = FreeSpace.from_map(map_data, true_robot.position)
+        elif walls is not None:
+            free_space = FreeSpace.from_walls(walls, TrueSurface.get_size(), true_robot.position)
+        else:
+            free_space = FreeSpace.from_surface(true_surface_blank, WALL_COLOR, true_robot.position)
+
+    engine = LocalizationEngine(walls, None, TrueSurface.get_size(), N=N, sim_odometry=sim_odometry,
+                                true_laser=true_laser, sim_laser=sim_laser, sensor_model=sensor_model, field=field,
+                                resampler=resampler, kld=kld, true_robot=true_robot, workers=workers, profiler=profiler,
+                                scatter=scatter, free_space=free_space)
+    renderer = ParticleRenderer(Map, true_surface_blank, sim_surface_blank, true_surface_location, sim_surface_location,
+                                mode=render_mode)
+    profiler = engine.profiler
+    recorder = Recorder(record, engine) if record else None
+    overlay = None
+    if profiler.enabled:
+        overlay = Overlay((sim_surface_location[0] + SimSurface.get_width() - 190, sim_surface_location[1] + 5))
+
+    if scheduler is None:
+        scheduler = UpdateScheduler()
+
+    worker = None
+    if background:
+        worker = FilterWorker(engine)
+        worker.start()
+    shown_updates = 0
+
+    # frames below only flip what they redraw, so show everything drawn before the loop, like the headers, once
+    pygame.display.update()
 
     running = True
     while running:
         pygame.time.wait(int(1/30*100))
         running = check_continue(key=exit_key)
 
-        # redistribution key
-        if pygame.key.get_pressed()[pygame.K_SPACE] or redistribute_frequency < 0:
-            redistribute_frequency = RF
-            
-            # calculate the readings at the true robot's location and each of the simulated ones
-            true_reading = true_laser.sense_obstacles(true_robot)
-            sim_readings = [sim_laser.sense_obstacles(sim) for sim in sim_robots]
-
-            # calculate the similarities between the readings
-            similarity_list = similarities(true_reading, sim_readings, sim_laser.sigma)
-
-            # draw permanent green circles around the most similar poses
-            for sim_robot, s, reading in zip(sim_robots, similarity_list, sim_readings):
-                if s > np.percentile(similarity_list, 90):
-                    if s > np.percentile(similarity_list, 95):
-                        pygame.draw.circle(
-                            sim_surface_blank, (100, 255, 100), sim_robot.position, 15)
-                    else:
-                        pygame.draw.circle(
-                            sim_surface_blank, (200, 255, 200), sim_robot.position, 15)
-
-            pygame.display.update()
-            redistribute(sim_robots, similarity_list, SimSurface.get_size())
-            sleep(1/30)
-
-        # apply movements 
-        new_true_surface = true_surface_blank.copy() # create copies of the blank maps
-        new_sim_surface = sim_surface_blank.copy()
-        apply_movements(Map, new_true_surface, new_sim_surface,
-                        true_surface_location, sim_surface_location,
-                        true_robot, sim_robots)
+        if worker is not None:
+            # the worker owns the engine now. queue the input and draw whatever it finished last
+            movements = check_movements()
+            worker.move(*movements)
+            due = scheduler.step(*engine.odometry(*movements))
+            if (due or pygame.key.get_pressed()[pygame.K_SPACE]) and worker.request_update():
+                # the update runs later on the worker, so charge what the last one cost
+                scheduler.ran(worker.update_seconds)
+
+            with worker.snapshot() as state:
+                if state.updates != shown_updates:
+                    shown_updates = state.updates
+                    draw_highlights(sim_surface_blank, *state.scored, state.estimate)
+                    renderer.invalidate()
+                with profiler.stage("rendering"):
+                    changed = renderer.draw(state.true_robot, state.particles)
 
-        # put instructions at bottom of the screen
-        Map.blit(hint_box, (Map.get_width()/4-hint_box.get_width() /
-                 2, Map.get_height() - 1.5 * hint_box.get_height()))
+        else:
+            movements = check_movements()
+            due = scheduler.step(*engine.odometry(*movements))
+            if due or pygame.key.get_pressed()[pygame.K_SPACE]:
+                began = perf_counter()
+                # calculate the log similarities between the true robot's reading and each of the simulated ones
+                similarity_list = engine.weigh()
 
-        pygame.display.update()
+                # draw permanent green circles around the most similar poses
+                draw_highlights(sim_surface_blank, engine.particles.x, engine.particles.y, similarity_list,
+                                engine.estimate(similarity_list))
 
+                renderer.invalidate()
+                engine.resample(similarity_list)
+                scheduler.ran(perf_counter() - began)
 
-def apply_movements(Map: pygame.Surface, left_blank: pygame.Surface, right_blank: pygame.Surface, left_coords: Tuple[int, int], 
-                    right_coords: Tuple[int, int], true_robot: Robot, sim_robots: List[Robot]) -> None:
-    """applies movements using controls each frame. 
+            # apply movements 
+            changed = apply_movements(renderer, engine, movements)
 
-    Args:
-        Map (pygame.Surface): main map
-        left_blank (pygame.Surface): a copy of the left, true side of the screen, with walls and without any robots
-        right_blank (pygame.Surface): same as left_blank
-        left_coords (Tuple[int, int]): location where left is blit'd onto map
-        right_coords (Tuple[int, int]): location where right is blit'd onto map
-        true_robot (Robot): true robot object
-        sim_robots (List[Robot]): list of simulated robots
-    """
-    forward, ccw, cw = check_movements()
-
-    if forward:
-        for robot in (true_robot, *sim_robots):
-            robot.drive(.5)
-    if cw != ccw:
-        for robot in (true_robot, *sim_robots):
-            robot.turn(.5, cw)
-
-    draw_robot(left_blank, true_robot, true_robot=True)
-    for sim in sim_robots:
-        draw_robot(right_blank, sim, true_robot=False)
-
-    Map.blit(left_blank, left_coords)
-    Map.blit(right_blank, right_coords)
-
-def similarity(ideal, sim, sigma):
-    product = 1
-    for ideal_measurement, sim_measurement in zip(ideal, sim):
-        if ideal_measurement == -1 == sim_measurement:
-            product *= .5
-        # if the simulated one didn't see the wall at all itll basically make it 0
-        elif ideal_measurement != -1 and sim_measurement == -1:
-            product *= .05
-        elif ideal_measurement == -1 and sim_measurement != -1:
-            product *= .01
-        else:
-            # product *= gaussian(sim_measurement, ideal_measurement, sigma * 10) + .1
-            product *= 1/(dist(ideal, sim) / 35)
-    return product * 10 ** len(sim)
+        if overlay is not None:
+            changed.append(overlay.draw(Map, profiler.last))
 
+        # put instructions at bottom of the screen
+        changed.append(Map.blit(hint_box, (Map.get_width()/4-hint_box.get_width() /
+                       2, Map.get_height() - 1.5 * hint_box.get_height())))
 
-def similarities(ideal, sims, sigma):
-    return [similarity(ideal, sim, sigma) for sim in sims]
+        pygame.display.update(changed)
 
+    if worker is not None:
+        worker.stop()
+    if recorder is not None:
+        recorder.close()
+    engine.close()
 
-def redistribute(sim_robots: List[Robot], s_list: List[float], dims: Tuple[int, int], scatter_factor: float = .1, abandon_factor: float = 100, distance_spread: float = 25, angle_spread: float = pi/24) -> None:
-    if max(s_list) < abandon_factor:
-        scatter_robots(sim_robots, dims)
-        return
 
-    similarity_sum = sum(s_list)
+def draw_highlights(Target: pygame.Surface, x: np.ndarray, y: np.ndarray, similarities: np.ndarray, estimate: Estimate) -> None:
+    """draws permanent green circles around the poses scoring in the top 10%, darker for the top 5%
 
-    coords = [r.position for r in sim_robots]
-    angles = [r.angle for r in sim_robots]
+    Args:
+        Target (pygame.Surface): surface to draw on
+        x (np.ndarray): x coordinates of the scored poses
+        y (np.ndarray): y coordinates of the scored poses
+        similarities (np.ndarray): log similarity of each pose
+        estimate (Estimate): estimate of the scored poses, with the .9 and .95 quantile thresholds
+    """
+    top_10, top_5 = estimate.thresholds[.9], estimate.thresholds[.95]
+    highlighted = np.flatnonzero(similarities > top_10)
+    strong = similarities[highlighted] > top_5
+    for px, py, s in zip(x[highlighted].tolist(), y[highlighted].tolist(), strong.tolist()):
+        pygame.draw.circle(Target, (100, 255, 100) if s else (200, 255, 200), (px, py), 15)
 
-    for r in sim_robots:
-        if random.random() < scatter_factor:
-            r.position = (random.randrange(
-                0, dims[0]), random.randrange(0, dims[1]))
 
-        else:
-            ran = random.random() * similarity_sum
-            current_sum = s_list[0]
-            current_index = 0
-            while current_sum < ran:
-                current_index += 1
-                current_sum += s_list[current_index]
-
-            r.position = np.add(coords[current_index], (random.uniform(
-                -distance_spread/2, distance_spread/2), random.uniform(-distance_spread/2, distance_spread/2)))
-            
-            r.angle = angles[current_index] + random.uniform(-angle_spread/2, angle_spread/2)
+def apply_movements(renderer: ParticleRenderer, engine: LocalizationEngine,
+                    movements: Tuple[bool, bool, bool] = None) -> List[pygame.Rect]:
+    """applies movements using controls each frame, and draws the robots where they ended up
+
+    Args:
+        renderer (ParticleRenderer): draws the true robot and the particles onto the main map
+        engine (LocalizationEngine): filter holding the true robot and the simulated ones
+        movements (Tuple[bool, bool, bool], optional): this frame's (forward, ccw, cw). Defaults to check_movements().
+
+    Returns:
+        List[pygame.Rect]: parts of the screen which changed
+    """
+    engine.move(*(check_movements() if movements is None else movements))
+    with engine.profiler.stage("rendering"):
+        return renderer.draw(engine.true_robot, engine.particles)
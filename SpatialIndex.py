@@ -0,0 +1,96 @@
+from typing import List, Sequence, Tuple
+import numpy as np
+
+from Raycast import GridWalk, beam_directions, intersect, walls_to_array
+
+EPSILON = 1e-6
+
+
+class SegmentGrid:
+    """uniform grid over the map where every cell lists the wall segments passing through it.
+    a beam walks the cells it crosses and only tests their segments, stopping at the first cell with a hit,
+    so casting costs about the same whether the map has ten walls or thousands
+    """
+    def __init__(self, walls: List[Tuple[Tuple[int, int], Tuple[int, int]]], dims: Tuple[int, int], cell: float = 32) -> None:
+        """
+        Args:
+            walls (List[Tuple[Tuple[int, int], Tuple[int, int]]]): wall segments
+            dims (Tuple[int, int]): width and height of the map. walls outside it are never hit
+            cell (float, optional): side of a grid cell in pixels. Defaults to 32.
+        """
+        self.walls = walls_to_array(walls)
+        self.cell = cell
+        self.cols = max(int(np.ceil(dims[0] / cell)), 1)
+        self.rows = max(int(np.ceil(dims[1] / cell)), 1)
+
+        cells, segments = [], []
+        half_diagonal = cell * np.sqrt(2) / 2
+        for index, (x1, y1, x2, y2) in enumerate(self.walls):
+            # candidate cells are the wall's bounding box, kept if the wall passes within the cell's circumcircle
+            c0, c1 = np.clip(np.floor(np.array([min(x1, x2), max(x1, x2)]) / cell).astype(int), 0, self.cols - 1)
+            r0, r1 = np.clip(np.floor(np.array([min(y1, y2), max(y1, y2)]) / cell).astype(int), 0, self.rows - 1)
+            col, row = np.meshgrid(np.arange(c0, c1 + 1), np.arange(r0, r1 + 1))
+            col, row = col.ravel(), row.ravel()
+
+            px, py = (col + .5) * cell, (row + .5) * cell
+            ex, ey = x2 - x1, y2 - y1
+            length2 = ex * ex + ey * ey
+            u = np.clip(((px - x1) * ex + (py - y1) * ey) / length2, 0, 1) if length2 else np.zeros_like(px)
+            near = (px - x1 - u * ex) ** 2 + (py - y1 - u * ey) ** 2 <= half_diagonal ** 2
+
+            cells.append(row[near] * self.cols + col[near])
+            segments.append(np.full(np.count_nonzero(near), index))
+
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype=int)
+        segments = np.concatenate(segments) if segments else np.zeros(0, dtype=int)
+
+        # padded table of segment ids per cell, -1 for unused slots
+        counts = np.bincount(cells, minlength=self.rows * self.cols)
+        self.table = np.full((self.rows * self.cols, max(counts.max(initial=0), 1)), -1, dtype=np.intp)
+        order = np.argsort(cells, kind="stable")
+        slot = np.arange(len(cells)) - np.repeat(np.cumsum(counts) - counts, counts)
+        self.table[cells[order], slot] = segments[order]
+
+        self.ax, self.ay = self.walls[:, 0], self.walls[:, 1]
+        self.ex, self.ey = self.walls[:, 2] - self.ax, self.walls[:, 3] - self.ay
+
+    def cast(self, x: np.ndarray, y: np.ndarray, heading: np.ndarray, angles: Sequence[float], max_range: float) -> np.ndarray:
+        """same result as Raycast.cast_segments, walking the grid instead of testing every wall
+
+        Args:
+            x (np.ndarray): x coordinates of the poses
+            y (np.ndarray): y coordinates of the poses
+            heading (np.ndarray): headings of the poses
+            angles (Sequence[float]): beam angles, relative to the heading
+            max_range (float): length of each beam
+
+        Returns:
+            np.ndarray: (poses, beams) array of distances to the closest wall. -1 where a beam hits nothing
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        dx, dy = beam_directions(np.atleast_1d(heading), angles)
+        N, B = dx.shape
+
+        ox, oy = np.repeat(x, B), np.repeat(y, B)
+        dx, dy = dx.ravel(), dy.ravel()
+        ranges = np.full(N * B, -1.0)
+
+        walk = GridWalk(ox, oy, dx, dy, self.cell, self.cols, self.rows, max_range)
+        while walk:
+            rays = walk.rays
+            candidates = self.table[walk.row * self.cols + walk.col] # (rays, slots)
+            used = candidates >= 0
+            ids = np.where(used, candidates, 0)
+
+            t = intersect(ox[rays, None], oy[rays, None], dx[rays, None], dy[rays, None],
+                          self.ax[ids], self.ay[ids], self.ex[ids], self.ey[ids])
+            closest = np.where(used, t, np.inf).min(axis=1)
+
+            # a hit beyond this cell may still be beaten by a wall registered in a later cell.
+            # the tolerance keeps walls lying exactly on a grid line from being missed to rounding
+            found = (closest <= walk.t_exit + EPSILON) & (closest <= max_range)
+            ranges[rays[found]] = closest[found]
+            walk.advance(found)
+
+        return ranges.reshape(N, B)
@@ -0,0 +1,291 @@
+"""predict / weigh / resample over fixed size chunks of a very large particle set
+
+the vectorized engine holds a (particles, beams) reading matrix and its float64 temporaries for the whole set at
+once, which for a million particles is hundreds of MB per update. ParticleStream walks the set chunk by chunk
+instead, through float32 scratch buffers allocated once and reused every update. weighing keeps one float32 log
+weight per particle and a running log-sum-exp of them, and systematic resampling walks the chunks again with a
+running cumulative sum, writing each chunk's children straight into a second set of pose arrays. apart from the
+poses and the log weights, memory is set by the chunk size, not by the number of particles.
+
+the segment laser casts each chunk straight into the reused ranges buffer. some per chunk temporaries remain: the
+ray / wall intersections inside the caster, the laser noise draw, the result arrays of the other sensing methods
+before they are copied in, and the index arrays of resampling
+"""
+from math import ceil, log, pi
+from typing import Callable, Sequence, Tuple
+import numpy as np
+
+from FreeSpace import FreeSpace
+from Laser import Laser
+from LikelihoodField import LikelihoodField
+from Particles import ParticleSet
+from Weighting import BEAM_SCALE, BOTH_MISSED, IDEAL_MISSED, SIM_MISSED
+
+
+class ParticleStream:
+    """runs the filter's particle steps on a ParticleSet in chunks, see the module docstring.
+    weighing follows Weighting.log_similarities and LikelihoodField, and resampling is systematic
+    """
+    def __init__(self, particles: ParticleSet, beams: int, chunk: int = 65536, spread: float = 10, floor: float = .1) -> None:
+        """
+        Args:
+            particles (ParticleSet): particles to update in place
+            beams (int): beams of the laser
+            chunk (int, optional): particles handled at once. Defaults to 65536.
+            spread (float, optional): as Weighting.log_similarities. Defaults to 10.
+            floor (float, optional): as Weighting.log_similarities. Defaults to .1.
+        """
+        self.particles = particles
+        self.chunk = chunk
+        self.spread = spread
+        self.floor = floor
+        # a generator so scratch buffers can be filled in place. seeded from np.random, so np.random.seed still applies
+        self.rng = np.random.default_rng(np.random.randint(2**32))
+
+        self.scratch = np.empty(chunk, dtype=np.float32)
+        self.dx = np.empty(chunk, dtype=np.float32)
+        self.dy = np.empty(chunk, dtype=np.float32)
+        self.moved = np.empty(chunk, dtype=np.float32)
+        # float64, since sums over a whole chunk and pointers into them lose too much in float32
+        self.cumulative = np.empty(chunk)
+        self.pointers = np.empty(chunk)
+        self.offsets = np.arange(chunk, dtype=float)
+        self.mask = np.empty(chunk, dtype=bool)
+        self.inside = np.empty(chunk, dtype=bool)
+        self.ranges = np.empty((chunk, beams), dtype=np.float32)
+        self.terms = np.empty((chunk, beams), dtype=np.float32)
+        self.hit = np.empty((chunk, beams), dtype=bool)
+        self.missed = np.empty((chunk, beams), dtype=bool)
+
+        self.log_weights = np.empty(0, dtype=np.float32)
+        self.next = (np.empty(0), np.empty(0), np.empty(0))
+        self.peak = -np.inf # running log-sum-exp of log_weights, as peak + log(total)
+        self.total = 0.
+
+    def _fit(self) -> int:
+        """resizes the per particle arrays if something replaced the particle set since the last call"""
+        N = len(self.particles)
+        if len(self.log_weights) != N:
+            self.log_weights = np.empty(N, dtype=np.float32)
+            self.next = (np.empty(N), np.empty(N), np.empty(N))
+        return N
+
+    def _chunks(self, N: int):
+        for start in range(0, N, self.chunk):
+            yield start, min(start + self.chunk, N)
+
+    def predict(self, forward: bool, ccw: bool, cw: bool, dt: float) -> None:
+        """ParticleSet.drive and ParticleSet.turn, one chunk at a time"""
+        p = self.particles
+        N = self._fit()
+        multiplier = -1 if cw else 1
+        for a, b in self._chunks(N):
+            n = b - a
+            x, y, angle = p.x[a:b], p.y[a:b], p.angle[a:b]
+            noise = self.scratch[:n]
+            if forward:
+                self.rng.standard_normal(dtype=np.float32, out=noise)
+                noise *= p.linear.sd
+                noise += p.linear.mean + p.v * dt
+                self._drive(x, y, angle, noise)
+            if cw != ccw:
+                self.rng.standard_normal(dtype=np.float32, out=noise)
+                noise *= p.angular.sd
+                noise += p.angular.mean + p.o * dt
+                noise *= multiplier
+                angle += noise
+                np.mod(angle, 2*pi, out=angle)
+
+    def _drive(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray, distance: np.ndarray) -> None:
+        n = len(x)
+        dx, dy = self.dx[:n], self.dy[:n]
+        np.cos(angle, out=dx)
+        dx *= distance
+        np.sin(angle, out=dy)
+        dy *= distance
+        bounds = self.particles.bounds
+        if bounds is None:
+            x += dx
+            y += dy
+            return
+
+        # like ParticleSet.drive, particles which would leave the map stay where they are
+        moved, inside, test = self.moved[:n], self.inside[:n], self.mask[:n]
+        np.add(x, dx, out=moved)
+        np.greater_equal(moved, 0, out=inside)
+        inside &= np.less(moved, bounds[0], out=test)
+        np.add(y, dy, out=moved)
+        inside &= np.greater_equal(moved, 0, out=test)
+        inside &= np.less(moved, bounds[1], out=test)
+        np.add(x, dx, out=x, where=inside)
+        np.add(y, dy, out=y, where=inside)
+
+    def weigh(self, reading: Sequence[float], laser: Laser = None, field: LikelihoodField = None,
+              angles: Sequence[float] = None, count: Callable[[np.ndarray], None] = None) -> np.ndarray:
+        """scores every particle against the true robot's reading, one chunk at a time
+
+        Args:
+            reading (Sequence[float]): reading of the true robot, -1 for beams which hit nothing
+            laser (Laser, optional): laser of the particles, for the beam model. Defaults to None.
+            field (LikelihoodField, optional): likelihood field, replaces the laser. Defaults to None.
+            angles (Sequence[float], optional): beam angles of the reading, for the field. Defaults to None.
+            count (Callable, optional): called with each chunk's readings, e.g. to count ray tests. Defaults to None.
+
+        Returns:
+            np.ndarray: float32 log similarity of each particle. the array is reused by the next update
+        """
+        p = self.particles
+        N = self._fit()
+        ideal = np.asarray(reading, dtype=np.float32)
+        ideal_hit = ideal != -1
+        # the factor of a beam the particle missed: the true robot missed it too, or it didn't
+        missed_terms = np.where(ideal_hit, log(SIM_MISSED), log(BOTH_MISSED)).astype(np.float32)
+
+        self.peak, self.total = -np.inf, 0.
+        for a, b in self._chunks(N):
+            out = self.log_weights[a:b]
+            if field is not None:
+                out[:] = field.log_similarities_poses(reading, angles, p.x[a:b], p.y[a:b], p.angle[a:b])
+            else:
+                readings = laser.sense_poses(p.x[a:b], p.y[a:b], p.angle[a:b], out=self.ranges[:b - a])
+                if count is not None:
+                    count(readings)
+                self._beam(ideal, ideal_hit, missed_terms, readings, laser.sigma, out)
+            self._accumulate(out)
+        return self.log_weights
+
+    def _beam(self, ideal: np.ndarray, ideal_hit: np.ndarray, missed_terms: np.ndarray, readings: np.ndarray,
+              sigma: float, out: np.ndarray) -> None:
+        """Weighting.log_similarities of one chunk, computed in place in the scratch buffers. readings is the chunk's
+        slice of the ranges buffer, which the laser sensed into
+        """
+        n, beams = readings.shape
+        r, t = readings, self.terms[:n]
+        hit, missed = self.hit[:n], self.missed[:n]
+        np.not_equal(r, -1, out=hit)
+
+        np.subtract(r, ideal, out=t)
+        t *= 1 / (sigma * self.spread)
+        np.square(t, out=t)
+        t *= -.5
+        np.exp(t, out=t)
+        t += self.floor
+        np.log(t, out=t)
+
+        np.logical_not(hit, out=missed)
+        np.copyto(t, missed_terms, where=missed)
+        hit &= ~ideal_hit
+        np.copyto(t, np.float32(log(IDEAL_MISSED)), where=hit)
+
+        np.sum(t, axis=1, out=out)
+        out += beams * log(BEAM_SCALE)
+
+    def _accumulate(self, log_weights: np.ndarray) -> None:
+        """adds a chunk to the running log-sum-exp"""
+        peak = float(log_weights.max(initial=-np.inf))
+        if not np.isfinite(peak):
+            return
+        if peak > self.peak:
+            self.total *= np.exp(self.peak - peak) if np.isfinite(self.peak) else 0.
+            self.peak = peak
+        shifted = self.scratch[:len(log_weights)]
+        np.subtract(log_weights, self.peak, out=shifted)
+        np.exp(shifted, out=shifted)
+        self.total += float(shifted.sum(dtype=np.float64))
+
+    def resample(self, log_weights: np.ndarray, dims: Tuple[int, int], scatter_factor: float = .1, abandon_factor: float = 100,
+                 distance_spread: float = 25, angle_spread: float = pi/24, free: FreeSpace = None,
+                 propose: Callable[[int], Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> None:
+        """Engine.redistribute with systematic resampling, one chunk at a time
+
+        the pointers of systematic resampling are evenly spaced, so the children of a chunk of parents are a
+        contiguous range of the new set. each chunk's cumulative weights are summed in place, its children found
+        with one searchsorted and written into the second set of pose arrays, which are then swapped in
+
+        Args:
+            log_weights (np.ndarray): log similarities from weigh
+            dims (Tuple[int, int]): width and height of the map
+            other arguments: as Engine.redistribute
+        """
+        p = self.particles
+        N = self._fit()
+        if log_weights is not self.log_weights:
+            self.peak, self.total = -np.inf, 0.
+            for a, b in self._chunks(N):
+                self._accumulate(np.asarray(log_weights[a:b], dtype=np.float32))
+
+        if self.peak < log(abandon_factor):
+            for a, b in self._chunks(N):
+                p.x[a:b], p.y[a:b], angle = self._scattered(b - a, dims, free, propose)
+                if angle is not None:
+                    p.angle[a:b] = angle
+            return
+
+        nx, ny, na = self.next
+        u = self.rng.random()
+        scale = self.total / N # weight between two pointers
+        carried, placed = 0., 0
+        for a, b in self._chunks(N):
+            n = b - a
+            cumulative = self.cumulative[:n]
+            shifted = self.scratch[:n]
+            np.subtract(log_weights[a:b], self.peak, out=shifted)
+            np.exp(shifted, out=shifted)
+            np.cumsum(shifted, dtype=np.float64, out=cumulative)
+            cumulative += carried
+            end = cumulative[-1]
+            # pointers (u + i) * scale below end. the last chunk takes every pointer left, whatever the rounding
+            last = N if b == N else min(max(int(ceil(end / scale - u)), placed), N)
+
+            for o in range(placed, last, self.chunk):
+                m = min(o + self.chunk, last) - o
+                pointers = np.add(self.offsets[:m], o + u, out=self.pointers[:m])
+                pointers *= scale
+                parents = np.searchsorted(cumulative, pointers, side="right")
+                np.minimum(parents, n - 1, out=parents)
+                self._children(a, b, parents, o, m, distance_spread, angle_spread, scatter_factor, dims, free, propose)
+
+            carried, placed = end, last
+
+        p.x, nx = nx, p.x
+        p.y, ny = ny, p.y
+        p.angle, na = na, p.angle
+        self.next = (nx, ny, na)
+        np.mod(p.angle, 2*pi, out=p.angle)
+        if len(p.weight) == N:
+            p.weight.fill(1 / N)
+        else:
+            p.weight = np.full(N, 1 / N)
+
+    def _children(self, a: int, b: int, parents: np.ndarray, o: int, m: int, distance_spread: float, angle_spread: float,
+                  scatter_factor: float, dims: Tuple[int, int], free: FreeSpace, propose) -> None:
+        """writes m children of parents in chunk [a, b) to the new poses from index o on, jittered or scattered"""
+        p = self.particles
+        nx, ny, na = (array[o:o + m] for array in self.next)
+        np.take(p.x[a:b], parents, out=nx)
+        np.take(p.y[a:b], parents, out=ny)
+        np.take(p.angle[a:b], parents, out=na)
+
+        jitter = self.scratch[:m]
+        for target, spread in ((nx, distance_spread), (ny, distance_spread), (na, angle_spread)):
+            self.rng.random(dtype=np.float32, out=jitter)
+            jitter -= .5
+            jitter *= spread
+            target += jitter
+
+        # scattered children keep their parent's heading, only their position is randomized, unless they are proposed
+        self.rng.random(dtype=np.float32, out=jitter)
+        scattered = np.flatnonzero(np.less(jitter, scatter_factor, out=self.mask[:m]))
+        if len(scattered):
+            x, y, angle = self._scattered(len(scattered), dims, free, propose)
+            nx[scattered], ny[scattered] = x, y
+            na[scattered] = p.angle[a:b][parents[scattered]] if angle is None else angle
+
+    def _scattered(self, n: int, dims: Tuple[int, int], free: FreeSpace, propose) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """n scattered positions, and headings when they are proposed"""
+        if propose is not None:
+            return propose(n)
+        if free is not None:
+            x, y = free.sample(n)
+            return x, y, None
+        return np.random.randint(0, dims[0], n), np.random.randint(0, dims[1], n), None
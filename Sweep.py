@@ -0,0 +1,309 @@
+"""runs many independent filters at once to tune the noise and redistribute parameters
+
+every configuration is run for a number of trials, and all trials of all configurations are stacked into
+(trials, particles) arrays which move, sense, weigh and resample together. sensing goes through one laser,
+so its acceleration structure (segment grid or range table) is built once for the whole sweep
+
+example:
+    python Sweep.py --linear-sd .005 .01 .02 --scatter-factor .05 .1 --trials 20 -N 500 --frames 1000
+"""
+import argparse
+import itertools
+import json
+import os
+from math import pi
+from time import perf_counter
+from typing import Dict, List, Sequence, Tuple
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from Engine import DEFAULT_ANGLES
+from headless import TRAJECTORIES, Control, read_controls, read_walls
+from FreeSpace import FreeSpace
+from Laser import Laser
+from MapFile import load_map
+from Maps import box_walls
+from Resampling import systematic_rows
+from Weighting import log_similarities
+
+# tunable parameters and their defaults, the same as LocalizationEngine's
+PARAMETERS: Dict[str, float] = {
+    "linear_sd": .01, # sd of the particles' Linear odometry error
+    "angular_sd": .005, # sd of the particles' Angular odometry error
+    "sigma": .5, # Laser uncertainty
+    "scatter_factor": .1,
+    "abandon_factor": 100,
+    "distance_spread": 25,
+    "angle_spread": pi/24,
+}
+
+
+def configurations(**values: Sequence[float]) -> List[Dict[str, float]]:
+    """every combination of the given parameter values, with the rest at their defaults
+
+    Args:
+        **values: candidate values for any of PARAMETERS
+
+    Returns:
+        List[Dict[str, float]]: one dict of every parameter per combination
+    """
+    unknown = set(values) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"unknown parameters {sorted(unknown)}, expected some of {list(PARAMETERS)}")
+    names = list(values)
+    return [{**PARAMETERS, **dict(zip(names, combination))} for combination in itertools.product(*(values[name] for name in names))]
+
+
+class TrialBatch:
+    """independent particle filters stacked into (filters, particles) arrays. filter t uses the parameters in
+    column t of the parameter arrays, and has its own true robot following the same controls as every other
+    """
+    def __init__(self, laser: Laser, configs: List[Dict[str, float]], trials: int, N: int, dims: Tuple[int, int],
+                 start: Tuple[float, float, float], dt: float = .5, true_noise: Tuple[float, float] = (.005, .005),
+                 v: float = .5, omega: float = .05, free: FreeSpace = None) -> None:
+        """
+        Args:
+            laser (Laser): noise free laser shared by every filter. its uncertainty should be 0, each filter adds its own
+            configs (List[Dict[str, float]]): parameters of each configuration, see configurations
+            trials (int): filters per configuration
+            N (int): particles per filter
+            dims (Tuple[int, int]): width and height of the map
+            start (Tuple[float, float, float]): starting pose of every true robot
+            dt (float, optional): time step of one control input. Defaults to .5.
+            true_noise (Tuple[float, float], optional): linear and angular odometry error sd of the true robots. Defaults to (.005, .005).
+            v (float, optional): speed of every robot. Defaults to .5.
+            omega (float, optional): angular velocity of every robot. Defaults to .05.
+            free (FreeSpace, optional): scatter particles into this free space instead of the whole map. Defaults to None.
+        """
+        self.laser = laser
+        self.configs = configs
+        self.trials = trials
+        self.N = N
+        self.dims = dims
+        self.dt = dt
+        self.true_noise = true_noise
+        self.v, self.o = v, omega
+        self.free = free
+
+        T = len(configs) * trials
+        self.T = T
+        # (filters, 1) columns, so they broadcast against the (filters, particles) state
+        self.params = {name: np.repeat([config[name] for config in configs], trials).astype(float)[:, None] for name in PARAMETERS}
+
+        self.tx, self.ty, self.ta = np.full(T, float(start[0])), np.full(T, float(start[1])), np.full(T, float(start[2]))
+        self.x, self.y = self._positions((T, N))
+        self.angle = np.zeros((T, N)) # like ParticleSet, particles start out facing the same way
+
+    def move(self, forward: bool, ccw: bool, cw: bool) -> None:
+        """one frame of control input for every true robot and every particle"""
+        if forward:
+            distance = self.v * self.dt
+            self.tx, self.ty = self._drive(self.tx, self.ty, self.ta, distance + np.random.normal(0, self.true_noise[0], self.T))
+            self.x, self.y = self._drive(self.x, self.y, self.angle,
+                                         distance + np.random.normal(0, 1, self.x.shape) * self.params["linear_sd"])
+        if cw != ccw:
+            multiplier = -1 if cw else 1
+            turn = self.o * self.dt
+            self.ta = (self.ta + multiplier * (turn + np.random.normal(0, self.true_noise[1], self.T))) % (2*pi)
+            self.angle = (self.angle + multiplier * (turn + np.random.normal(0, 1, self.angle.shape) * self.params["angular_sd"])) % (2*pi)
+
+    def _positions(self, shape) -> Tuple[np.ndarray, np.ndarray]:
+        """random positions for scattered particles, from the free space if there is one"""
+        if self.free is not None:
+            x, y = self.free.sample(int(np.prod(shape)))
+            return x.reshape(shape), y.reshape(shape)
+        return np.random.randint(0, self.dims[0], shape).astype(float), np.random.randint(0, self.dims[1], shape).astype(float)
+
+    def _drive(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray, distance: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        new_x = x + distance * np.cos(angle)
+        new_y = y + distance * np.sin(angle)
+        inside = (new_x >= 0) & (new_y >= 0) & (new_x < self.dims[0]) & (new_y < self.dims[1])
+        return np.where(inside, new_x, x), np.where(inside, new_y, y)
+
+    def _sense(self, x: np.ndarray, y: np.ndarray, angle: np.ndarray, sigma: np.ndarray) -> np.ndarray:
+        """readings of poses shaped like sigma's broadcast, with laser noise of each pose's filter"""
+        ranges = self.laser.sense_poses(x.ravel(), y.ravel(), angle.ravel()).reshape(*x.shape, -1)
+        hit = ranges != -1
+        noisy = ranges + np.random.normal(0, 1, ranges.shape) * sigma[..., None]
+        return np.where(hit, noisy, -1)
+
+    def update(self) -> None:
+        """one sense / weight / resample cycle of every filter"""
+        sigma = self.params["sigma"]
+        ideal = self._sense(self.tx, self.ty, self.ta, sigma[:, 0]) # (filters, beams)
+        readings = self._sense(self.x, self.y, self.angle, np.broadcast_to(sigma, self.x.shape)) # (filters, particles, beams)
+        log_weights = log_similarities(ideal[:, None, :], readings, sigma[:, :, None])
+        self._redistribute(log_weights)
+
+    def _redistribute(self, log_weights: np.ndarray) -> None:
+        """Engine.redistribute with systematic resampling, for every filter at once"""
+        T, N = log_weights.shape
+        p = self.params
+        abandoned = log_weights.max(axis=1) < np.log(p["abandon_factor"][:, 0])
+
+        peak = log_weights.max(axis=1, keepdims=True)
+        weights = np.exp(log_weights - np.where(np.isfinite(peak), peak, 0))
+        totals = weights.sum(axis=1, keepdims=True)
+        weights = np.where(totals > 0, weights / np.where(totals > 0, totals, 1), 1 / N)
+        parents = systematic_rows(weights)
+
+        half_spread = p["distance_spread"] / 2
+        x = np.take_along_axis(self.x, parents, axis=1) + np.random.uniform(-1, 1, (T, N)) * half_spread
+        y = np.take_along_axis(self.y, parents, axis=1) + np.random.uniform(-1, 1, (T, N)) * half_spread
+        parent_angle = np.take_along_axis(self.angle, parents, axis=1)
+        angle = parent_angle + np.random.uniform(-1, 1, (T, N)) * p["angle_spread"] / 2
+
+        # scattered particles keep their parent's heading, and abandoned filters scatter every particle in place
+        scattered = np.random.random((T, N)) < p["scatter_factor"]
+        angle = np.where(scattered, parent_angle, angle)
+        scattered |= abandoned[:, None]
+        x = np.where(abandoned[:, None], self.x, x)
+        y = np.where(abandoned[:, None], self.y, y)
+        angle = np.where(abandoned[:, None], self.angle, angle)
+        x[scattered], y[scattered] = self._positions(np.count_nonzero(scattered))
+
+        self.x, self.y, self.angle = x, y, angle % (2*pi)
+
+    def errors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """LocalizationEngine.pose_error of every filter"""
+        position = np.hypot(self.x.mean(axis=1) - self.tx, self.y.mean(axis=1) - self.ty)
+        heading = np.arctan2(np.sin(self.angle).mean(axis=1), np.cos(self.angle).mean(axis=1))
+        return position, np.abs((heading - self.ta + pi) % (2*pi) - pi)
+
+
+def convergence(errors: np.ndarray, threshold: float) -> np.ndarray:
+    """first update after which each filter's error stays below threshold, nan for filters which never settle
+
+    Args:
+        errors (np.ndarray): (updates, filters) position errors
+        threshold (float): error counted as converged
+
+    Returns:
+        np.ndarray: update index per filter
+    """
+    below = errors < threshold
+    # True where every error from this update on is below the threshold
+    settled = np.flip(np.logical_and.accumulate(np.flip(below, axis=0), axis=0), axis=0)
+    first = np.argmax(settled, axis=0).astype(float)
+    first[~settled.any(axis=0)] = np.nan
+    return first
+
+
+def _distribution(values: np.ndarray) -> Dict[str, float]:
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {"mean": None, "median": None, "p90": None}
+    return {"mean": float(values.mean()), "median": float(np.median(values)), "p90": float(np.percentile(values, 90))}
+
+
+def sweep(laser: Laser, dims: Tuple[int, int], configs: List[Dict[str, float]], controls: List[Control], start: Tuple[float, float, float],
+          trials: int = 10, N: int = 500, update_every: int = 10, threshold: float = 20, **kwargs) -> List[Dict]:
+    """runs every configuration for trials filters over the same controls, all in one TrialBatch
+
+    Args:
+        laser (Laser): noise free laser on the map
+        dims (Tuple[int, int]): width and height of the map
+        configs (List[Dict[str, float]]): parameters of each configuration, see configurations
+        controls (List[Control]): (forward, ccw, cw) for every frame
+        start (Tuple[float, float, float]): starting pose of the true robots
+        trials (int, optional): filters per configuration. Defaults to 10.
+        N (int, optional): particles per filter. Defaults to 500.
+        update_every (int, optional): frames between updates. Defaults to 10.
+        threshold (float, optional): position error in pixels counted as converged. Defaults to 20.
+        **kwargs: other arguments of TrialBatch
+
+    Returns:
+        List[Dict]: per configuration, its parameters, the share of trials which converged, the distribution of their
+            convergence times in frames, and the distributions of the final and mean position and final heading errors
+    """
+    batch = TrialBatch(laser, configs, trials, N, dims, start, **kwargs)
+    position, heading = [], []
+    for frame, control in enumerate(controls, 1):
+        batch.move(*control)
+        if frame % update_every == 0:
+            batch.update()
+            p, h = batch.errors()
+            position.append(p)
+            heading.append(h)
+
+    if not position:
+        raise ValueError("the controls are shorter than one update")
+    position, heading = np.array(position), np.array(heading) # (updates, filters)
+    settled = convergence(position, threshold)
+
+    reports = []
+    for index, config in enumerate(configs):
+        trial = slice(index * trials, (index + 1) * trials)
+        converged = settled[trial]
+        reports.append({
+            "config": config,
+            "converged": float(np.isfinite(converged).mean()),
+            "convergence_frames": _distribution((converged + 1) * update_every),
+            "final_position_error": _distribution(position[-1, trial]),
+            "mean_position_error": _distribution(position[:, trial].mean(axis=0)),
+            "final_heading_error": _distribution(heading[-1, trial]),
+        })
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sweep filter parameters over many stacked trials")
+    for name, default in PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, nargs="+", default=[default], metavar="VALUE")
+    parser.add_argument("--trials", type=int, default=10, help="filters per configuration")
+    parser.add_argument("-N", type=int, default=500, help="particles per filter")
+    parser.add_argument("--walls", help="json file of wall segments. defaults to a generated room")
+    parser.add_argument("--map", help="map file saved with main.py --save-map, replaces --walls, --width and --height")
+    parser.add_argument("--width", type=int, default=540)
+    parser.add_argument("--height", type=int, default=694)
+    parser.add_argument("--start", type=float, nargs=3, metavar=("X", "Y", "ANGLE"), help="true starting pose. defaults to the map center")
+    parser.add_argument("--trajectory", choices=sorted(TRAJECTORIES), default="square")
+    parser.add_argument("--controls", help="file of per frame key presses, replaces --trajectory")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--update-every", type=int, default=10)
+    parser.add_argument("--laser", choices=("segments", "grid", "table"), default="segments", help="sensing method shared by every filter")
+    parser.add_argument("--scatter", choices=("uniform", "free"), default="free", help="where scattered particles go")
+    parser.add_argument("--threshold", type=float, default=20, help="position error counted as converged")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", action="store_true", help="print the reports as json")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    map_data = None
+    if args.map:
+        map_data = load_map(args.map)
+        walls, dims = map_data.wall_list(), map_data.dims
+    else:
+        dims = (args.width, args.height)
+        walls = read_walls(args.walls) if args.walls else box_walls(dims)
+    start = tuple(args.start) if args.start else (dims[0] / 2, dims[1] / 2, 0)
+    free = None
+    if args.scatter == "free":
+        free = FreeSpace.from_map(map_data) if map_data is not None else FreeSpace.from_walls(walls, dims, start[:2])
+    controls = read_controls(args.controls) if args.controls else TRAJECTORIES[args.trajectory](args.frames)
+
+    configs = configurations(**{name: getattr(args, name) for name in PARAMETERS})
+    laser = Laser(500, uncertainty=0, angles=DEFAULT_ANGLES, walls=walls, method=args.laser)
+
+    began = perf_counter()
+    reports = sweep(laser, dims, configs, controls, start, trials=args.trials, N=args.N,
+                    update_every=args.update_every, threshold=args.threshold, free=free)
+    elapsed = perf_counter() - began
+
+    if args.json:
+        print(json.dumps({"seconds": elapsed, "filters": len(configs) * args.trials, "reports": reports}))
+        return
+    print(f"{len(configs)} configurations x {args.trials} trials in {elapsed:.1f}s")
+    for report in reports:
+        changed = {name: value for name, value in report["config"].items() if value != PARAMETERS[name]}
+        frames = report["convergence_frames"]["median"]
+        print(f"{changed or 'defaults'}: converged {report['converged']:.0%}, median frames {frames}, "
+              f"final error median {report['final_position_error']['median']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
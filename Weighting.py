@@ -0,0 +1,76 @@
+from math import log
+from typing import Sequence
+import numpy as np
+
+# per beam factors of the beam model, for when one or both scans hit nothing
+BOTH_MISSED = .5
+SIM_MISSED = .05 # the true robot saw a wall, the particle didn't
+IDEAL_MISSED = .01 # the particle saw a wall, the true robot didn't
+# every beam is scaled by 10, so a good match stays above Engine.redistribute's abandon_factor
+BEAM_SCALE = 10
+
+
+def log_similarities(ideal: Sequence[float], readings: np.ndarray, sigma: float, spread: float = 10, floor: float = .1) -> np.ndarray:
+    """log similarity of every particle's reading to the true robot's reading, in one pass over the (particles, beams) matrix
+
+    beams which both scans hit contribute a gaussian on the range difference (with standard deviation sigma * spread)
+    plus floor, the other combinations contribute the constant factors above. factors are summed as logs,
+    so any number of beams can be used without the product under- or overflowing
+
+    ideal, readings and sigma may also be stacked arrays which broadcast against each other, such as a (filters, 1, beams)
+    ideal with (filters, particles, beams) readings, to score many independent filters at once
+
+    Args:
+        ideal (Sequence[float]): reading of the true robot, -1 for beams which hit nothing
+        readings (np.ndarray): (particles, beams) readings of the simulated robots
+        sigma (float): noise of the laser
+        spread (float, optional): widens sigma to cover the particles' pose jitter. Defaults to 10.
+        floor (float, optional): factor added to the gaussian, for outliers. Defaults to .1.
+
+    Returns:
+        np.ndarray: log similarity of each particle
+    """
+    ideal = np.asarray(ideal, dtype=float)
+    readings = np.asarray(readings, dtype=float)
+    if ideal.ndim == 1:
+        readings = readings.reshape(-1, len(ideal))
+
+    ideal_hit = ideal != -1
+    sim_hit = readings != -1
+    both_hit = ideal_hit & sim_hit
+
+    difference = np.where(both_hit, readings - ideal, 0) / (sigma * spread)
+    terms = np.log(np.exp(-.5 * difference * difference) + floor)
+
+    terms[~ideal_hit & ~sim_hit] = log(BOTH_MISSED)
+    terms[ideal_hit & ~sim_hit] = log(SIM_MISSED)
+    terms[~ideal_hit & sim_hit] = log(IDEAL_MISSED)
+
+    return terms.sum(axis=-1) + ideal.shape[-1] * log(BEAM_SCALE)
+
+
+def log_sum_exp(log_weights: np.ndarray) -> float:
+    """log of the sum of exp(log_weights), without leaving log space"""
+    log_weights = np.asarray(log_weights, dtype=float)
+    peak = log_weights.max()
+    if not np.isfinite(peak):
+        return peak
+    return peak + np.log(np.exp(log_weights - peak).sum())
+
+
+def normalize_log(log_weights: np.ndarray) -> np.ndarray:
+    """turns log weights into weights which sum to 1. if every weight is zero the result is uniform"""
+    log_weights = np.asarray(log_weights, dtype=float)
+    total = log_sum_exp(log_weights)
+    if not np.isfinite(total):
+        return np.full(len(log_weights), 1 / len(log_weights))
+    return np.exp(log_weights - total)
+
+
+def effective_sample_size(log_weights: np.ndarray) -> float:
+    """1 / sum(w^2) of the normalized weights, computed in log space. N for uniform weights, 1 when one particle has all the weight"""
+    log_weights = np.asarray(log_weights, dtype=float)
+    total = log_sum_exp(log_weights)
+    if not np.isfinite(total):
+        return float(len(log_weights))
+    return float(np.exp(2 * total - log_sum_exp(2 * log_weights)))
@@ -0,0 +1,132 @@
+import queue
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator, Tuple
+import numpy as np
+
+from Engine import LocalizationEngine
+from Estimation import Estimate
+from Particles import ParticleSet
+from Robot import Robot
+
+_UPDATE = "update"
+_STOP = None
+
+
+class Snapshot:
+    """copy of the filter's state which the render loop can draw while the worker keeps changing the engine"""
+    def __init__(self, engine: LocalizationEngine) -> None:
+        source = engine.particles
+        self.particles = ParticleSet(source.linear, source.angular, N=0, v=source.v, omega=source.o, bounds=source.bounds)
+        self.true_robot = Robot(engine.true_robot.linear, engine.true_robot.angular, bounds=engine.true_robot.bounds)
+        self.updates = 0 # filter updates finished when this was captured
+        self.scored = None # (x, y, log weights) of the particles at the last update, before resampling
+        self.estimate = None # Estimation.Estimate of the particles at the last update, before resampling
+
+    def capture(self, engine: LocalizationEngine, updates: int, scored: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                estimate: Estimate) -> None:
+        """copies the engine's poses in, reusing this buffer's arrays while the number of particles stays the same"""
+        source, target = engine.particles, self.particles
+        if len(target) == len(source):
+            np.copyto(target.x, source.x)
+            np.copyto(target.y, source.y)
+            np.copyto(target.angle, source.angle)
+        else:
+            target.set_poses(source.x.copy(), source.y.copy(), source.angle.copy())
+
+        self.true_robot.position = tuple(engine.true_robot.position)
+        self.true_robot.angle = engine.true_robot.angle
+        self.updates = updates
+        self.scored = scored
+        self.estimate = estimate
+
+
+class FilterWorker(threading.Thread):
+    """runs a LocalizationEngine on a background thread, so an expensive update never stalls the render loop.
+
+    the render loop sends control input with move and asks for updates with request_update. both are queued as
+    events and applied in order. after each batch of events the worker fills the back one of two snapshots and
+    swaps it to the front under a lock, and the render loop draws the front snapshot, the latest finished state
+    """
+    def __init__(self, engine: LocalizationEngine) -> None:
+        super().__init__(name="FilterWorker", daemon=True)
+        self.engine = engine
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.front, self.back = Snapshot(engine), Snapshot(engine)
+        self.front.capture(engine, 0, None, None)
+        self.updates = 0
+        self.scored = None
+        self.estimate = None
+        self.update_seconds = 0. # what the latest update cost
+        self.pending = threading.Event() # set while an update is queued or running
+        self.error = None
+
+    def move(self, forward: bool, ccw: bool, cw: bool) -> None:
+        """queues one frame of control input, see LocalizationEngine.move"""
+        if forward or ccw or cw:
+            self.events.put((forward, ccw, cw))
+
+    def request_update(self) -> bool:
+        """queues a sense / weight / resample cycle, unless one is already waiting
+
+        Returns:
+            bool: whether an update was queued
+        """
+        if self.pending.is_set():
+            return False
+        self.pending.set()
+        self.events.put(_UPDATE)
+        return True
+
+    @contextmanager
+    def snapshot(self) -> Iterator[Snapshot]:
+        """the latest published state. the worker cannot swap buffers until the block exits, so keep it short"""
+        if self.error is not None:
+            raise RuntimeError("the filter worker failed") from self.error
+        with self.lock:
+            yield self.front
+
+    def stop(self, timeout: float = None) -> None:
+        """finishes the queued events, then ends the thread"""
+        self.events.put(_STOP)
+        self.join(timeout)
+
+    def run(self) -> None:
+        try:
+            while True:
+                event = self.events.get()
+                # apply everything already queued before publishing, so the snapshot never falls behind the input
+                while event is not _STOP:
+                    self._apply(event)
+                    try:
+                        event = self.events.get_nowait()
+                    except queue.Empty:
+                        break
+                self._publish()
+                if event is _STOP:
+                    return
+        except Exception as e:
+            self.error = e
+            self.pending.clear()
+
+    def _apply(self, event) -> None:
+        if event == _UPDATE:
+            began = perf_counter()
+            log_weights = self.engine.weigh()
+            particles = self.engine.particles
+            self.scored = (particles.x.copy(), particles.y.copy(), log_weights)
+            # summarized here rather than in the render loop, which only has to draw the result
+            self.estimate = self.engine.estimate(log_weights)
+            self.engine.resample(log_weights)
+            self.update_seconds = perf_counter() - began
+            self.updates += 1
+            self.pending.clear()
+        else:
+            self.engine.move(*event)
+
+    def _publish(self) -> None:
+        self.back.capture(self.engine, self.updates, self.scored, self.estimate)
+        with self.lock:
+            self.front, self.back = self.back, self.front
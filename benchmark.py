@@ -0,0 +1,225 @@
+"""benchmarks the filter's hot paths over particle count, beam count, laser range and wall count
+
+every case is timed, its peak traced memory recorded, and the results written as json.
+a saved result file can be passed as --baseline to compare against it
+
+example:
+    python benchmark.py --particles 100 1000 10000 --output bench.json
+    python benchmark.py --baseline bench.json --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+from itertools import product
+from math import pi
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+from Engine import redistribute
+from Laser import Laser
+from Maps import random_walls
+from Odometry import Linear, Angular
+from Particles import ParticleSet
+from RangeTable import RangeTable
+from Robot import Robot
+from Weighting import log_similarities
+
+DIMS = (540, 694)
+
+
+def measure(function: Callable[[], object], repeats: int) -> Dict[str, float]:
+    """times repeated calls of function, then traces the peak memory of one more call"""
+    times = []
+    for _ in range(repeats):
+        began = perf_counter()
+        function()
+        times.append(perf_counter() - began)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": median(times), "best_seconds": min(times), "peak_bytes": peak}
+
+
+def particles(N: int) -> ParticleSet:
+    p = ParticleSet(Linear(0, .01), Angular(0, .005), N=N, bounds=DIMS)
+    p.scatter(DIMS)
+    p.angle = np.random.uniform(0, 2*pi, N)
+    return p
+
+
+def beam_angles(beams: int) -> tuple:
+    return tuple(np.linspace(-pi/4, pi/4, beams)) if beams > 1 else (0,)
+
+
+def surface(walls) -> pygame.Surface:
+    Map = pygame.Surface(DIMS)
+    Map.fill((255, 255, 255))
+    for start, end in walls:
+        pygame.draw.line(Map, (0, 0, 0), start, end, width=3)
+    return Map
+
+
+def sense_case(N: int, beams: int, laser_range: float, wall_count: int, method: str, cache_dir: str) -> Callable[[], object]:
+    walls = random_walls(wall_count, DIMS)
+    table = RangeTable.load_or_build(walls, DIMS, laser_range, cache_dir=cache_dir) if method == "table" else None
+    laser = Laser(laser_range, surface(walls) if method == "pixel" else None, angles=beam_angles(beams),
+                  walls=walls, method=method, table=table)
+    p = particles(N)
+    return lambda: laser.sense_particles(p)
+
+
+def similarities_case(N: int, beams: int) -> Callable[[], object]:
+    walls = random_walls(10, DIMS)
+    laser = Laser(500, angles=beam_angles(beams), walls=walls, method="segments")
+    readings = laser.sense_particles(particles(N))
+    ideal = laser.sense_obstacles(Robot(None, None, (DIMS[0] / 2, DIMS[1] / 2)))
+    return lambda: log_similarities(ideal, readings, laser.sigma)
+
+
+def redistribute_case(N: int, resampler: str) -> Callable[[], object]:
+    p = particles(N)
+    log_weights = np.log(np.random.random(N) * 1000)
+    return lambda: redistribute(p, log_weights, DIMS, resampler=resampler)
+
+
+def motion_case(N: int, kind: str) -> Callable[[], object]:
+    if kind == "robot":
+        robots = [Robot(Linear(0, .01), Angular(0, .005), (DIMS[0] / 2, DIMS[1] / 2)) for _ in range(N)]
+
+        def step():
+            for r in robots:
+                r.drive(.5)
+                r.turn(.5)
+        return step
+
+    p = particles(N)
+
+    def step():
+        p.drive(.5)
+        p.turn(.5)
+    return step
+
+
+def cases(args) -> List[Dict]:
+    """every (bench, params) combination of the sweep, in increasing particle count so budgets can cut sweeps short"""
+    specs = []
+    for method, beams, laser_range, wall_count in product(args.methods, args.beams, args.ranges, args.walls):
+        for N in args.particles:
+            specs.append({"bench": "sense", "params": {"method": method, "N": N, "beams": beams, "range": laser_range, "walls": wall_count}})
+    for beams in args.beams:
+        for N in args.particles:
+            specs.append({"bench": "similarities", "params": {"N": N, "beams": beams}})
+    for resampler in args.resamplers:
+        for N in args.particles:
+            specs.append({"bench": "redistribute", "params": {"N": N, "resampler": resampler}})
+    for kind in ("particles", "robot"):
+        for N in args.particles:
+            specs.append({"bench": "motion", "params": {"N": N, "kind": kind}})
+    return specs
+
+
+def build(spec: Dict, cache_dir: str) -> Callable[[], object]:
+    params = dict(spec["params"])
+    if spec["bench"] == "sense":
+        return sense_case(params["N"], params["beams"], params["range"], params["walls"], params["method"], cache_dir)
+    if spec["bench"] == "similarities":
+        return similarities_case(params["N"], params["beams"])
+    if spec["bench"] == "redistribute":
+        return redistribute_case(params["N"], params["resampler"])
+    return motion_case(params["N"], params["kind"])
+
+
+def key(result: Dict) -> str:
+    return json.dumps([result["bench"], result["params"]], sort_keys=True)
+
+
+def compare(results: List[Dict], baseline_path: str, tolerance: float) -> List[Dict]:
+    """prints the time ratio of every case also in the baseline. returns the cases slower than 1 + tolerance"""
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in json.load(f)["results"] if "seconds" in r}
+
+    regressions = []
+    for r in results:
+        old = baseline.get(key(r))
+        if old is None or "seconds" not in r:
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{r['bench']:>13} {json.dumps(r['params'], sort_keys=True)}: {ratio:6.2f}x {flag}", file=sys.stderr)
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark sensing, weighting, resampling and motion")
+    parser.add_argument("--particles", type=int, nargs="+", default=[10**2, 10**3, 10**4, 10**5, 10**6])
+    parser.add_argument("--beams", type=int, nargs="+", default=[7])
+    parser.add_argument("--ranges", type=float, nargs="+", default=[500])
+    parser.add_argument("--walls", type=int, nargs="+", default=[10])
+    parser.add_argument("--methods", nargs="+", choices=Laser.METHODS, default=["segments", "table"])
+    parser.add_argument("--resamplers", nargs="+", default=["systematic"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=10, help="seconds per call after which larger N of the same case are skipped")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="json file to write. defaults to stdout")
+    parser.add_argument("--baseline", help="earlier output to compare against")
+    parser.add_argument("--tolerance", type=float, default=.1, help="allowed slowdown against the baseline")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    results = []
+    over_budget = set()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for spec in cases(args):
+            params = {k: v for k, v in spec["params"].items() if k != "N"}
+            series = json.dumps([spec["bench"], params], sort_keys=True)
+            if series in over_budget:
+                results.append({**spec, "skipped": "over budget"})
+                continue
+
+            result = {**spec, **measure(build(spec, cache_dir), args.repeats)}
+            beams = spec["params"].get("beams", 1)
+            result["throughput"] = spec["params"]["N"] * beams / result["seconds"] if result["seconds"] else None
+            results.append(result)
+            print(f"{spec['bench']:>13} {json.dumps(spec['params'], sort_keys=True)}: {result['seconds'] * 1000:.2f} ms", file=sys.stderr)
+
+            if result["seconds"] > args.budget:
+                over_budget.add(series)
+
+    report = {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                 "processor": platform.processor(), "cpus": os.cpu_count(), "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
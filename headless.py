@@ -0,0 +1,177 @@
+"""runs the particle filter without a window, on a scripted trajectory, and reports the pose error
+
+example:
+    python headless.py --trajectory square --frames 2000 -N 2000 --sensor likelihood
+"""
+import argparse
+import json
+import os
+from math import radians
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from Engine import SCATTER_MODES, LocalizationEngine
+from MapFile import load_map
+from Maps import box_walls
+from Profiling import Profiler
+from Recording import MOVE, Recorder, engine_from_log, read_records, replay
+from Resampling import RESAMPLERS, KLDSampler
+from ScanCache import ScanCache
+from Scheduler import UpdateScheduler
+
+Control = Tuple[bool, bool, bool] # forward, ccw, cw, the same order as Maps.check_movements
+
+
+def square(frames: int, side: int = 120, turn: int = 63) -> List[Control]:
+    """drive a side, then turn roughly a quarter circle (omega * dt * 63 ~ pi/2 with the default robot)"""
+    pattern = [(True, False, False)] * side + [(False, True, False)] * turn
+    return [pattern[i % len(pattern)] for i in range(frames)]
+
+
+def circle(frames: int) -> List[Control]:
+    """drive and turn together"""
+    return [(True, True, False)] * frames
+
+
+def zigzag(frames: int, leg: int = 80, turn: int = 40) -> List[Control]:
+    """alternate left and right turns between straight legs"""
+    pattern = [(True, False, False)] * leg + [(False, True, False)] * turn + \
+              [(True, False, False)] * leg + [(False, False, True)] * turn
+    return [pattern[i % len(pattern)] for i in range(frames)]
+
+
+TRAJECTORIES: Dict[str, Callable[[int], List[Control]]] = {
+    "square": square,
+    "circle": circle,
+    "zigzag": zigzag,
+}
+
+
+def read_controls(path: str) -> List[Control]:
+    """reads one frame per line, written with the keys held during that frame (w, a, d). blank lines or "-" idle"""
+    controls = []
+    with open(path) as f:
+        for line in f:
+            keys = line.strip().lower()
+            # d turns ccw and a turns cw, see Maps.check_movements
+            controls.append(("w" in keys, "d" in keys, "a" in keys))
+    return controls
+
+
+def read_walls(path: str) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """reads walls saved as json, [[[x1, y1], [x2, y2]], ...], the same shape main.py prints"""
+    with open(path) as f:
+        return [tuple(map(tuple, wall)) for wall in json.load(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the particle filter headless on a scripted trajectory")
+    parser.add_argument("--walls", help="json file of wall segments. defaults to a generated room")
+    parser.add_argument("--map", help="map file saved with main.py --save-map, replaces --walls, --width and --height")
+    parser.add_argument("--width", type=int, default=540)
+    parser.add_argument("--height", type=int, default=694)
+    parser.add_argument("--start", type=float, nargs=3, metavar=("X", "Y", "ANGLE"), help="true starting pose. defaults to the map center")
+    parser.add_argument("--trajectory", choices=sorted(TRAJECTORIES), default="square")
+    parser.add_argument("--controls", help="file of per frame key presses, replaces --trajectory")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--update-every", type=int, default=10, help="frames between filter updates")
+    parser.add_argument("--schedule", type=float, nargs=2, metavar=("PIXELS", "DEGREES"),
+                        help="update after driving or turning this far instead of every --update-every frames")
+    parser.add_argument("--max-interval", type=int, default=150, help="frames after which a scheduled update runs anyway")
+    parser.add_argument("--budget", type=float, help="seconds of update compute per frame for scheduled updates")
+    parser.add_argument("-N", type=int, default=1000, help="number of particles")
+    parser.add_argument("--sensor", choices=("beam", "likelihood"), default="beam")
+    parser.add_argument("--laser", choices=("segments", "grid", "table"), default="segments", help="sensing method of the laser")
+    parser.add_argument("--global", dest="global_", action="store_true",
+                        help="start from a coarse to fine search of the whole map instead of scattered particles. "
+                             "a replay reruns the search its log recorded")
+    parser.add_argument("--scatter", choices=SCATTER_MODES, default="free", help="where scattered particles go")
+    parser.add_argument("--cache", type=float, nargs=2, metavar=("CELL", "DEGREES"),
+                        help="cache scans of poses in cells this many pixels wide and degrees of heading apart")
+    parser.add_argument("--resampler", choices=sorted(RESAMPLERS), default="systematic")
+    parser.add_argument("--kld", action="store_true", help="adapt the number of particles with KLD-sampling")
+    parser.add_argument("--workers", type=int, default=0, help="processes for the measurement step")
+    parser.add_argument("--stream", type=int, metavar="CHUNK",
+                        help="update the particles this many at a time, bounding memory for very large -N")
+    parser.add_argument("--profile", metavar="TRACE", help="write a per update stage trace here, as csv if it ends with .csv, else json")
+    parser.add_argument("--record", metavar="LOG", help="record the run's controls, odometry noise and true readings to this log")
+    parser.add_argument("--replay", metavar="LOG", help="replay a recorded log instead of driving a trajectory. map options are ignored")
+    parser.add_argument("--chunk", type=int, default=4096, help="records read at once while replaying")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    options = dict(N=args.N, sensor_model=args.sensor, resampler=args.resampler, kld=KLDSampler() if args.kld else None,
+                   workers=args.workers, laser_method=args.laser, profiler=Profiler() if args.profile else None,
+                   scatter=args.scatter, chunk=args.stream, scan_cache=ScanCache(cell=args.cache[0], heading=radians(args.cache[1])) if args.cache else None)
+    recorder = None
+    if args.replay:
+        engine = engine_from_log(args.replay, **options)
+        frames = sum(int((records["kind"] == MOVE).sum()) for records in read_records(args.replay, args.chunk))
+    else:
+        map_data = load_map(args.map) if args.map else None
+        dims = map_data.dims if map_data else (args.width, args.height)
+        start = tuple(args.start) if args.start else (dims[0] / 2, dims[1] / 2, 0)
+        controls = read_controls(args.controls) if args.controls else TRAJECTORIES[args.trajectory](args.frames)
+        frames = len(controls)
+
+        if map_data:
+            engine = LocalizationEngine.from_map(map_data, start, **options)
+        else:
+            walls = read_walls(args.walls) if args.walls else box_walls(dims)
+            engine = LocalizationEngine(walls, start, dims, **options)
+        if args.record:
+            recorder = Recorder(args.record, engine)
+
+    try:
+        began = perf_counter()
+        if args.global_ and not args.replay:
+            # a replayed log reruns the global search it recorded, on the recorded reading
+            engine.global_localize()
+        if args.replay:
+            errors = replay(args.replay, engine, args.chunk)
+        else:
+            scheduler = None
+            if args.schedule:
+                scheduler = UpdateScheduler(args.schedule[0], radians(args.schedule[1]), args.max_interval, args.budget)
+            errors = engine.run(controls, update_every=args.update_every, scheduler=scheduler)
+        elapsed = perf_counter() - began
+    finally:
+        if recorder is not None:
+            recorder.close()
+        engine.close()
+
+    position_errors = np.array([e[0] for e in errors])
+    heading_errors = np.array([e[1] for e in errors])
+    report = {
+        "frames": frames,
+        "updates": len(errors),
+        "particles": len(engine.particles),
+        "seconds": elapsed,
+        "updates_per_second": len(errors) / elapsed if elapsed else float("inf"),
+        "mean_position_error": float(position_errors.mean()) if len(errors) else None,
+        "final_position_error": float(position_errors[-1]) if len(errors) else None,
+        "final_heading_error": float(heading_errors[-1]) if len(errors) else None,
+    }
+    if args.profile:
+        engine.profiler.export(args.profile)
+        report.update({f"{stage}_seconds": seconds for stage, seconds in engine.profiler.totals().items()})
+    if engine.sim_laser.cache is not None:
+        report["cache_hit_rate"] = engine.sim_laser.cache.hit_rate
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
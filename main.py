@@ -1,10 +1,19 @@
+import argparse
+import json
 import pygame
+from MapFile import load_map, save_map
 from Maps import draw_walls,  end_loop, place_robot
 from Odometry import Angular, Linear
 from Robot import Robot
 from Simulation import simulation
 
 def main():
+    parser = argparse.ArgumentParser(description="particle filter localization")
+    parser.add_argument("--map", help="load a map file instead of drawing the walls")
+    parser.add_argument("--save-map", help="save the drawn walls and their derived grids to this map file")
+    parser.add_argument("--start", type=float, nargs=2, metavar=("X", "Y"), help="robot starting position instead of placing it")
+    args = parser.parse_args()
+
     pygame.init()
     
     # initializing constants
@@ -28,37 +37,52 @@ def main():
     Map.blit(right_header, (3*WIDTH/4-right_header.get_width()/2, 10))
 
     
-    # allowing user to create map
     left = pygame.Surface((WIDTH/2, HEIGHT-HEADER_HEIGHT-1))
     left.fill(WHITE)
     left_panel_location = (0, HEADER_HEIGHT+1)
-    hint = pygame.font.SysFont('Monaco', 100)
-    hint_box = hint.render('draw here', True, (150, 150, 150))
-    hint_subtitle = pygame.font.SysFont('Monaco', 40)
-    hint_subtitle_box = hint_subtitle.render('click and drag', True, (175, 175, 175))
-    Map.blit(hint_box, (WIDTH/4-hint_box.get_width()/2, (HEIGHT-HEADER_HEIGHT-hint_box.get_height())/2))
-    Map.blit(hint_subtitle_box, (WIDTH/4-hint_box.get_width()/2, (HEIGHT-HEADER_HEIGHT-hint_subtitle_box.get_height())/2 + hint_box.get_height() ))
-    
-    
-    
-    lines = draw_walls(Map, left, left_panel_location)
-    
+    map_data = None
+
+    if args.map:
+        # loading a saved map, drawn straight onto the panel
+        map_data = load_map(args.map)
+        lines = map_data.wall_list()
+        for start, end in lines:
+            pygame.draw.line(left, map_data.wall_color, start, end, width=int(map_data.wall_width))
+        Map.blit(left, left_panel_location)
+    else:
+        # allowing user to create map
+        hint = pygame.font.SysFont('Monaco', 100)
+        hint_box = hint.render('draw here', True, (150, 150, 150))
+        hint_subtitle = pygame.font.SysFont('Monaco', 40)
+        hint_subtitle_box = hint_subtitle.render('click and drag', True, (175, 175, 175))
+        Map.blit(hint_box, (WIDTH/4-hint_box.get_width()/2, (HEIGHT-HEADER_HEIGHT-hint_box.get_height())/2))
+        Map.blit(hint_subtitle_box, (WIDTH/4-hint_box.get_width()/2, (HEIGHT-HEADER_HEIGHT-hint_subtitle_box.get_height())/2 + hint_box.get_height() ))
+
+        lines = draw_walls(Map, left, left_panel_location)
+
     # putting another copy of the map on the right side
     right = left.copy()
     right_panel_location = (WIDTH/2+1, left_panel_location[1])
     Map.blit(right, right_panel_location)
-    print("landmarks:", lines)
+    print("landmarks:", json.dumps(lines))
     
     # allowing user to place robot
-    robot_position, left = place_robot(Map, left, left_panel_location)
+    if args.start:
+        robot_position = tuple(args.start)
+    else:
+        robot_position, left = place_robot(Map, left, left_panel_location)
     print("robot starting position:", robot_position)
+
+    if args.save_map:
+        # saved once the robot is placed, so the stored free space is what it can reach
+        save_map(args.save_map, lines, left.get_size(), BLACK, start=robot_position)
     
     # move loop
     true_linear = Linear(0, .005)
     true_angular = Angular(0, 0.005)
-    true_robot = Robot(true_linear, true_angular, robot_position)
+    true_robot = Robot(true_linear, true_angular, robot_position, bounds=left.get_size())
     
-    simulation(Map, left, right, left_panel_location, right_panel_location, true_robot)
+    simulation(Map, left, right, left_panel_location, right_panel_location, true_robot, walls=lines, laser_method="segments", map_data=map_data)
     
     end_loop()
     